@@ -40,6 +40,9 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'core.middleware.ReplicaRoutingMiddleware',
+    'core.middleware.SlowQueryMiddleware',
+    'core.middleware.ProfilerMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -95,10 +98,106 @@ DATABASES = {
             'client_encoding': 'UTF8',
             # 'isolation_level': psycopg2.extensions.ISOLATION_LEVEL_DEFAULT,
         }
+    },
+    # 'replica': {
+    #     'ENGINE': 'django.db.backends.postgresql',
+    #     'NAME': 'donotban',
+    #     'USER': 'donotban',
+    #     'PASSWORD': 'password',
+    #     'HOST': 'replica-host',
+    #     'OPTIONS': {
+    #         'client_encoding': 'UTF8',
+    #         'connect_timeout': 2,
+    #     },
+    #     'TEST': {
+    #         'MIRROR': 'default',
+    #     },
+    # },
+}
+
+# Read replicas
+# safe-method requests read from one of these aliases, writes always go to `default`
+
+DATABASE_ROUTERS = ['core.routers.PrimaryReplicaRouter']
+
+REPLICA_DATABASES = [
+    # 'replica',
+]
+
+# seconds a client keeps reading from the primary after a write, by cookie, `X-Primary-Pin` or `X-Client-Id`
+REPLICA_PIN_SECONDS = 15
+
+# seconds a replica health check result is trusted
+REPLICA_HEALTH_CHECK_INTERVAL = 10
+
+
+# Cache
+# the search and facet caches are only used with a shared backend like memcached,
+# as their invalidation must reach every process, see `common.cache.is_shared`
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
     }
 }
 
 
+# Search cache
+# seconds ids of a search result are cached, and max ids kept per search,
+# pages beyond are read from the database
+
+SEARCH_CACHE_TIMEOUT = 300
+
+SEARCH_CACHE_MAX_IDS = 10000
+
+
+# Facets
+# seconds facet counts of a filter set are cached, and max values of each facet
+
+FACET_CACHE_TIMEOUT = 60
+
+FACET_LIMIT = 20
+
+
+# Change feed
+# rows edited in the last seconds are held back until concurrent transactions settle
+
+CHANGE_FEED_SETTLE_SECONDS = 5
+
+
+# Rating updates
+# append rating changes of comment writes to a delta table instead of locking the
+# resource row, and fold them in with command `flush_rating_deltas`
+
+COALESCE_RATING_UPDATES = False
+
+
+# Contributor prefix search
+# author and translator filters match names starting with at least min length
+# characters, expanded to at most max names with the most books
+
+CONTRIBUTOR_PREFIX_MIN_LENGTH = 2
+
+CONTRIBUTOR_PREFIX_MAX_NAMES = 1000
+
+
+# Trending
+# comment activity decays by half every half life hours, hourly activity buckets
+# older than the window are dropped by command `compact_activity`
+
+TRENDING_HALF_LIFE_HOURS = 24
+
+TRENDING_WINDOW_HOURS = 7 * 24
+
+
+# Weighted rating
+# ratings are pulled towards the prior mean as if there were prior weight extra votes
+
+RATING_PRIOR_MEAN = 3.5
+
+RATING_PRIOR_WEIGHT = 10
+
+
 # Password validation
 # https://docs.djangoproject.com/en/2.2/ref/settings/#auth-password-validators
 
@@ -137,3 +236,61 @@ USE_TZ = True
 MEDIA_ROOT = ''
 MEDIA_URL = '/'
 
+# seconds an unreferenced file is kept before `sweep_blobs` deletes it
+BLOB_SWEEP_GRACE_SECONDS = 3600
+
+
+
+# Admin
+
+# admin only endpoints are disabled when not set
+ADMIN_SECRET_KEY = None
+
+
+# Slow queries
+
+# queries slower than this are recorded, None disables the capture
+SLOW_QUERY_THRESHOLD_MS = 500
+# records per minute per process, queries over the limit are dropped
+SLOW_QUERY_MAX_PER_MINUTE = 60
+# probability of explaining a recorded select query, and the rate limit of it
+SLOW_QUERY_EXPLAIN_SAMPLE_RATE = 0.1
+SLOW_QUERY_EXPLAIN_MAX_PER_MINUTE = 6
+SLOW_QUERY_EXPLAIN_TIMEOUT_MS = 5000
+# records kept in memory per process for `/admin/slow-queries/`
+SLOW_QUERY_BUFFER_SIZE = 200
+SLOW_QUERY_LOG_FILE = os.path.join(BASE_DIR, 'slow_query.log')
+
+
+# Profiling
+
+# probability of profiling a request, besides the ones asked for by admins
+PROFILE_SAMPLE_RATE = 0
+# sampled profiles per minute per process
+PROFILE_MAX_PER_MINUTE = 6
+# directory profiles are dumped to, None disables dumping, and the latest ones kept
+PROFILE_DIR = os.path.join(BASE_DIR, 'profiles')
+PROFILE_MAX_FILES = 100
+# functions in the summary header
+PROFILE_SUMMARY_SIZE = 10
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'slow_query_file': {
+            'class': 'logging.handlers.RotatingFileHandler',
+            'filename': SLOW_QUERY_LOG_FILE,
+            'maxBytes': 10 * 1024 * 1024,
+            'backupCount': 5,
+            'encoding': 'utf-8',
+        },
+    },
+    'loggers': {
+        'core.slow_query': {
+            'handlers': ['slow_query_file'],
+            'level': 'WARNING',
+            'propagate': False,
+        },
+    },
+}
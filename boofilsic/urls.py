@@ -14,7 +14,9 @@ Including another URLconf
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
 from django.urls import path, include
+from core.views import SlowQueryList
 
 urlpatterns = [
     path('books/', include('books.urls')),
+    path('admin/slow-queries/', SlowQueryList.as_view(), name='slow_query_list'),
 ]
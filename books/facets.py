@@ -0,0 +1,75 @@
+"""
+Facet counts of book search results.
+All requested facets are counted by one grouped query with GROUPING SETS
+over the filtered queryset.
+"""
+
+from django.conf import settings
+from django.db import connections
+from django.db.models import F, IntegerField, Value
+from django.db.models.functions import Cast, Floor, Least
+
+
+# facet name => expression of the grouped value
+FACETS = {
+    'language': F('language'),
+    'pub_house': F('pub_house'),
+    'decade': F('pub_year') / 10 * 10,
+    # [n, n + 1), except that 5.0 falls in the top band [4, 5]
+    'rating_band': Least(Cast(Floor('rating'), IntegerField()), Value(4)),
+}
+
+# facets ordered by value instead of count
+ORDERED_BY_VALUE = ['decade', 'rating_band']
+
+
+def parse_facets(value):
+    """ parse comma separated facet names, `all` for every facet """
+    if value.strip() == 'all':
+        return list(FACETS)
+    names = []
+    for name in value.split(','):
+        name = name.strip()
+        if name not in FACETS:
+            raise ValueError(name)
+        if name not in names:
+            names.append(name)
+    return names
+
+
+def get_facets(queryset, names):
+    """
+    Return {facet: [{'value': value, 'count': count}, ...]}.
+    Facets ordered by count are truncated to `FACET_LIMIT` values.
+    """
+    columns = [f'facet_{name}' for name in names]
+    queryset = queryset.order_by().annotate(
+        **{column: FACETS[name] for column, name in zip(columns, names)}
+    ).values(*columns)
+    sql, params = queryset.query.sql_with_params()
+    grouping = ', '.join(f'GROUPING({column})' for column in columns)
+    grouping_sets = ', '.join(f'({column})' for column in columns)
+    sql = (
+        f"SELECT {', '.join(columns)}, {grouping}, COUNT(*) FROM ({sql}) AS facet_source "
+        f"GROUP BY GROUPING SETS ({grouping_sets})"
+    )
+    with connections[queryset.db].cursor() as cursor:
+        cursor.execute(sql, params)
+        rows = cursor.fetchall()
+
+    facets = {name: [] for name in names}
+    size = len(names)
+    for row in rows:
+        values, groupings, count = row[:size], row[size:2 * size], row[-1]
+        # GROUPING() is 0 for the column the row is grouped by
+        index = groupings.index(0)
+        facets[names[index]].append({'value': values[index], 'count': count})
+
+    limit = getattr(settings, 'FACET_LIMIT', 20)
+    for name, buckets in facets.items():
+        if name in ORDERED_BY_VALUE:
+            buckets.sort(key=lambda bucket: (bucket['value'] is None, bucket['value']))
+        else:
+            buckets.sort(key=lambda bucket: -bucket['count'])
+            del buckets[limit:]
+    return facets
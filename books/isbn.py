@@ -0,0 +1,38 @@
+"""
+ISBN normalization. Every valid ISBN-10 or ISBN-13, hyphenated or not,
+is converted to the same canonical ISBN-13 string.
+"""
+
+import re
+
+
+def _isbn13_check_digit(digits):
+    total = sum(int(d) * (1 if i % 2 == 0 else 3) for i, d in enumerate(digits[:12]))
+    return str((10 - total % 10) % 10)
+
+
+def to_isbn13(value):
+    """
+    Return canonical ISBN-13 of `value`.
+    Raise ValueError if it is not a valid ISBN-10 or ISBN-13.
+    """
+    code = re.sub(r'[\s-]', '', str(value)).upper()
+    if re.fullmatch(r'\d{9}[\dX]', code):
+        total = sum((10 - i) * (10 if d == 'X' else int(d)) for i, d in enumerate(code))
+        if total % 11 != 0:
+            raise ValueError(f"Invalid ISBN-10 checksum `{value}`.")
+        code = '978' + code[:9]
+        return code + _isbn13_check_digit(code)
+    if re.fullmatch(r'97[89]\d{10}', code):
+        if _isbn13_check_digit(code) != code[12]:
+            raise ValueError(f"Invalid ISBN-13 checksum `{value}`.")
+        return code
+    raise ValueError(f"Invalid ISBN `{value}`.")
+
+
+def canonical_isbn(value):
+    """ canonical ISBN-13, or None if invalid """
+    try:
+        return to_isbn13(value)
+    except ValueError:
+        return None
@@ -0,0 +1,62 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Max
+from books.isbn import canonical_isbn
+from books.models import Book
+from common.cache import bump_generation
+
+
+class Command(BaseCommand):
+    help = (
+        "Fill canonical `isbn13` of books in batches of id range. "
+        "Books whose ISBN is invalid, or duplicates another book in a different form, are reported and skipped."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        last_id = Book.objects.aggregate(last_id=Max('id'))['last_id'] or 0
+        updated = 0
+        invalid = []
+        duplicated = []
+
+        for start in range(0, last_id + 1, batch_size):
+            with transaction.atomic():
+                books = list(
+                    Book.objects.select_for_update()
+                    .filter(id__gte=start, id__lt=start + batch_size)
+                    .only('id', 'isbn', 'isbn13')
+                )
+                canonical = {book.id: canonical_isbn(book.isbn) for book in books}
+                taken = set(
+                    Book.objects.filter(isbn13__in=[value for value in canonical.values() if value])
+                    .exclude(id__in=canonical.keys())
+                    .values_list('isbn13', flat=True)
+                )
+                changed = []
+                for book in books:
+                    isbn13 = canonical[book.id]
+                    if isbn13 is None:
+                        invalid.append(book.id)
+                    elif isbn13 in taken:
+                        duplicated.append(book.id)
+                        isbn13 = None
+                    else:
+                        taken.add(isbn13)
+                    if book.isbn13 != isbn13:
+                        book.isbn13 = isbn13
+                        changed.append(book)
+                Book.objects.bulk_update(changed, ['isbn13'])
+                updated += len(changed)
+            self.stdout.write(f"{min(start + batch_size, last_id + 1)}/{last_id + 1}", ending='\r')
+
+        bump_generation(Book)
+        self.stdout.write(f"\n{updated} books updated.")
+        if invalid:
+            self.stdout.write(f"{len(invalid)} books with invalid ISBN: {invalid}")
+        if duplicated:
+            self.stdout.write(self.style.WARNING(
+                f"{len(duplicated)} books duplicating the ISBN of another book: {duplicated}"
+            ))
@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand
+from django.db.models import DateField, F, Func, Max, Q, Value
+from django.db.models.functions import Coalesce
+from books.models import Book
+from common.cache import bump_generation
+
+
+class Command(BaseCommand):
+    help = "Fill `pub_date` of books from `pub_year` and `pub_month`, in batches of id range."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=10000)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        # keep consistent with `books.models.get_pub_date`,
+        # pub_month is kept in [1, 12] by check constraints
+        pub_date = Func(
+            F('pub_year'),
+            Coalesce(F('pub_month'), Value(1)),
+            Value(1),
+            function='make_date',
+            output_field=DateField(),
+        )
+        valid_year = Q(pub_year__gte=1, pub_year__lte=9999)
+
+        last_id = Book.objects.aggregate(last_id=Max('id'))['last_id'] or 0
+        updated = 0
+        for start in range(0, last_id + 1, batch_size):
+            batch = Book.objects.filter(id__gte=start, id__lt=start + batch_size)
+            updated += batch.filter(valid_year).update(pub_date=pub_date)
+            batch.exclude(valid_year).exclude(pub_date=None).update(pub_date=None)
+            self.stdout.write(f"{min(start + batch_size, last_id + 1)}/{last_id + 1}", ending='\r')
+        bump_generation(Book)
+        self.stdout.write(f"\n{updated} books updated.")
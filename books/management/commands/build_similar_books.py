@@ -0,0 +1,133 @@
+from collections import defaultdict
+from datetime import timedelta
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Max
+from django.utils import timezone
+from books.models import BookComment, BookSimilarity
+
+
+class Command(BaseCommand):
+    help = (
+        "Build the most similar books of every book from item-item cosine similarity "
+        "of comment ratings centered on the mean of each user. With `--incremental`, only books rated since the last build "
+        "are recomputed. Requires numpy and scipy."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--top-k', type=int, default=20, help="Similar books kept per book.")
+        parser.add_argument('--chunk-size', type=int, default=1000, help="Books computed at once.")
+        parser.add_argument(
+            '--min-common', type=int, default=2,
+            help="Least users who rated both books for them to be similar."
+        )
+        parser.add_argument(
+            '--incremental', action='store_true',
+            help="Recompute books whose comments changed since the last build, "
+            "and patch their scores into the lists of other books."
+        )
+
+    def handle(self, *args, **options):
+        try:
+            import numpy as np
+            from books import similarity
+        except ImportError:
+            raise CommandError("numpy and scipy are required, install them with `pip install numpy scipy`.")
+
+        # comments edited lately may not be committed yet, they are picked up again by the next build
+        started = timezone.now() - timedelta(seconds=getattr(settings, 'CHANGE_FEED_SETTLE_SECONDS', 5))
+        since = None
+        if options['incremental']:
+            since = BookSimilarity.objects.aggregate(since=Max('computed_time'))['since']
+            if since is None:
+                raise CommandError("Nothing built yet, run a full build first.")
+
+        rows = BookComment.objects.filter(
+            is_deleted=False, rating__isnull=False, book__is_deleted=False
+        ).values_list('user_id', 'book_id', 'rating').iterator(chunk_size=10000)
+        matrix, book_ids = similarity.build_rating_matrix(rows)
+        normalized = similarity.normalize_columns(matrix)
+        self.stdout.write(f"{matrix.shape[0]} users, {matrix.shape[1]} books, {matrix.nnz} ratings.")
+
+        columns = np.arange(len(book_ids))
+        if since is not None:
+            # `edited_time` is bumped on edit and soft deletion, hard deleted comments need a full build
+            changed_ids = set(
+                BookComment.objects.filter(edited_time__gte=since).values_list('book_id', flat=True).distinct()
+            )
+            columns = columns[np.isin(book_ids, list(changed_ids))]
+
+        top_k = options['top_k']
+        chunk_size = options['chunk_size']
+        # book id => {book id: score} of changed books, for patching other lists
+        patches = defaultdict(dict)
+        built = 0
+        for start in range(0, len(columns), chunk_size):
+            chunk = columns[start:start + chunk_size]
+            records = []
+            for column, neighbors, scores in similarity.iter_similarities(normalized, chunk, options['min_common']):
+                if since is not None:
+                    for neighbor, score in zip(book_ids[neighbors].tolist(), scores.tolist()):
+                        patches[neighbor][int(book_ids[column])] = score
+                neighbors, scores = similarity.top_k(neighbors, scores, top_k)
+                records.append(BookSimilarity(
+                    book_id=int(book_ids[column]),
+                    similar_ids=book_ids[neighbors].tolist(),
+                    scores=[round(score, 6) for score in scores.tolist()],
+                    computed_time=started,
+                ))
+            self.save(records, [int(book_id) for book_id in book_ids[chunk]])
+            built += len(records)
+            self.stdout.write(f"{min(start + chunk_size, len(columns))}/{len(columns)}", ending='\r')
+        self.stdout.write(f"\n{built} books built.")
+
+        # books no longer rated
+        if since is None:
+            BookSimilarity.objects.filter(computed_time__lt=started).delete()
+        else:
+            BookSimilarity.objects.filter(book_id__in=changed_ids - set(book_ids[columns].tolist())).delete()
+            patched = self.patch(patches, changed_ids, top_k, started)
+            self.stdout.write(f"{patched} books patched.")
+
+    def save(self, records, book_ids):
+        with transaction.atomic():
+            BookSimilarity.objects.filter(book_id__in=book_ids).delete()
+            BookSimilarity.objects.bulk_create(records)
+
+    def patch(self, patches, changed_ids, top_k, computed_time):
+        """
+        Replace scores against changed books in the lists of other books.
+        A list may get shorter than `top_k` when a changed book drops out of it,
+        until the next full build.
+        """
+        affected = BookSimilarity.objects.filter(similar_ids__overlap=list(changed_ids)).exclude(
+            book_id__in=changed_ids
+        )
+        existing = {record.book_id: record for record in affected}
+        existing.update({
+            record.book_id: record
+            for record in BookSimilarity.objects.filter(book_id__in=list(patches)).exclude(book_id__in=changed_ids)
+        })
+
+        records = []
+        for book_id in set(existing) | (set(patches) - changed_ids):
+            record = existing.get(book_id)
+            scores = {}
+            if record is not None:
+                scores = {
+                    similar_id: score for similar_id, score in zip(record.similar_ids, record.scores)
+                    if similar_id not in changed_ids
+                }
+            scores.update(patches.get(book_id, {}))
+            best = sorted(scores.items(), key=lambda item: -item[1])[:top_k]
+            records.append(BookSimilarity(
+                book_id=book_id,
+                similar_ids=[similar_id for similar_id, _ in best],
+                scores=[round(score, 6) for _, score in best],
+                computed_time=record.computed_time if record is not None else computed_time,
+            ))
+        for start in range(0, len(records), 1000):
+            batch = records[start:start + 1000]
+            self.save(batch, [record.book_id for record in batch])
+        return len(records)
@@ -0,0 +1,47 @@
+import json
+from django.core.management.base import BaseCommand, CommandError
+from common.views import bulk_create_comments
+from books.models import BookComment
+
+
+class Command(BaseCommand):
+    help = (
+        "Import book comments from a JSON lines file, one comment per line with keys "
+        "`book`, `user_id`, `rating` and `content`."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--batch-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        self.created = 0
+        self.rejected = 0
+        try:
+            with open(options['path'], encoding='utf-8') as f:
+                batch = []
+                line_numbers = []
+                for line_number, line in enumerate(f, 1):
+                    if not line.strip():
+                        continue
+                    try:
+                        batch.append(json.loads(line))
+                    except ValueError:
+                        raise CommandError(f"Invalid JSON at line {line_number}.")
+                    line_numbers.append(line_number)
+                    if len(batch) >= options['batch_size']:
+                        self.import_batch(batch, line_numbers)
+                        batch, line_numbers = [], []
+                if batch:
+                    self.import_batch(batch, line_numbers)
+        except OSError as e:
+            raise CommandError(str(e))
+        self.stdout.write(f"{self.created} comments created, {self.rejected} rejected.")
+
+    def import_batch(self, batch, line_numbers):
+        for result in bulk_create_comments(BookComment, 'book', batch, batch_size=len(batch)):
+            if 'errors' in result:
+                self.rejected += 1
+                self.stderr.write(f"line {line_numbers[result['index']]}: {result['errors']}")
+            else:
+                self.created += 1
@@ -0,0 +1,191 @@
+import json
+import random
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from hashlib import sha256
+from urllib.error import HTTPError, URLError
+from urllib.parse import quote
+from urllib.request import Request, urlopen
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import (
+    BooleanField, Case, Count, F, IntegerField, OuterRef, Q, Subquery, Sum, Value, When
+)
+from django.db.models.functions import Coalesce
+from books.models import Book, BookComment
+from common.models import RatingDelta
+
+
+class Command(BaseCommand):
+    help = (
+        "Send a mix of list, search, retrieve and comment requests to a running server "
+        "over many concurrent connections, report latency and throughput, then check that "
+        "rating and comments count of books match the comment table."
+    )
+
+    # workload => default weight
+    workloads = {
+        'list': 3,
+        'search': 3,
+        'retrieve': 3,
+        'comment': 1,
+    }
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', default='http://127.0.0.1:8000', help="Base url of the server.")
+        parser.add_argument('--concurrency', type=int, default=32)
+        parser.add_argument('--duration', type=float, default=30, help="Seconds to run.")
+        parser.add_argument(
+            '--mix', default=None,
+            help="Workload weights like `list=3,search=3,retrieve=3,comment=1`."
+        )
+        parser.add_argument(
+            '--hot-books', type=int, default=5,
+            help="Comments are written to this many books, so writes contend on the same rows."
+        )
+        parser.add_argument('--timeout', type=float, default=10)
+        parser.add_argument('--skip-check', action='store_true', help="Don't check rating consistency.")
+
+    def handle(self, *args, **options):
+        weights = dict(self.workloads)
+        if options['mix']:
+            for pair in options['mix'].split(','):
+                name, _, weight = pair.partition('=')
+                if name not in weights:
+                    raise CommandError(f"Unknown workload `{name}`.")
+                weights[name] = float(weight)
+
+        self.base_url = options['url'].rstrip('/')
+        self.timeout = options['timeout']
+        self.secret_key = sha256(settings.SECRET_KEY.encode()).hexdigest()
+        self.book_ids = list(Book.objects.filter(is_deleted=False).values_list('id', flat=True)[:10000])
+        if not self.book_ids:
+            raise CommandError("No book in the database.")
+        self.hot_book_ids = random.sample(self.book_ids, min(options['hot_books'], len(self.book_ids)))
+        self.keywords = [
+            word for title in Book.objects.filter(id__in=self.book_ids[:1000]).values_list('title', flat=True)
+            for word in title.split()[:1]
+        ] or ['a']
+        self.lock = threading.Lock()
+        self.samples = {name: [] for name in weights}
+        self.errors = {name: 0 for name in weights}
+
+        names = [name for name, weight in weights.items() if weight > 0]
+        name_weights = [weights[name] for name in names]
+        deadline = time.monotonic() + options['duration']
+
+        def worker(worker_id):
+            rng = random.Random(worker_id)
+            while time.monotonic() < deadline:
+                name = rng.choices(names, name_weights)[0]
+                self.run(name, rng, f'loadtest-{uuid.uuid4().hex}')
+
+        started = time.monotonic()
+        with ThreadPoolExecutor(max_workers=options['concurrency']) as executor:
+            list(executor.map(worker, range(options['concurrency'])))
+        elapsed = time.monotonic() - started
+
+        self.report(elapsed)
+        if not options['skip_check']:
+            self.check_consistency()
+
+    def run(self, name, rng, user_id):
+        if name == 'list':
+            method, path, body = 'GET', f'/books/?page={rng.randint(1, 10)}&page_size=20', None
+        elif name == 'search':
+            method, path, body = 'GET', f'/books/?title={quote(rng.choice(self.keywords))}&page_size=20', None
+        elif name == 'retrieve':
+            method, path, body = 'GET', f'/books/{rng.choice(self.book_ids)}/', None
+        else:
+            book_id = rng.choice(self.hot_book_ids)
+            rating = rng.choice([None] + [x / 2 for x in range(11)])
+            method, path = 'POST', f'/books/{book_id}/comments/'
+            body = {'user_id': user_id, 'rating': rating, 'content': 'load test'}
+
+        data = json.dumps(body).encode() if body is not None else None
+        request = Request(self.base_url + path, data=data, method=method)
+        request.add_header('Secret-Key', self.secret_key)
+        if data is not None:
+            request.add_header('Content-Type', 'application/json')
+
+        started = time.perf_counter()
+        ok = True
+        try:
+            with urlopen(request, timeout=self.timeout) as response:
+                response.read()
+        except HTTPError as e:
+            ok = e.code < 500
+        except (URLError, OSError):
+            ok = False
+        latency = time.perf_counter() - started
+        with self.lock:
+            self.samples[name].append(latency)
+            if not ok:
+                self.errors[name] += 1
+
+    def report(self, elapsed):
+        total = 0
+        self.stdout.write(f"{'workload':<10}{'requests':>10}{'errors':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'req/s':>10}")
+        for name, samples in self.samples.items():
+            total += len(samples)
+            if not samples:
+                continue
+            samples = sorted(samples)
+            self.stdout.write(
+                f"{name:<10}{len(samples):>10}{self.errors[name]:>8}"
+                f"{percentile(samples, 50) * 1000:>10.1f}"
+                f"{percentile(samples, 95) * 1000:>10.1f}"
+                f"{percentile(samples, 99) * 1000:>10.1f}"
+                f"{len(samples) / elapsed:>10.1f}"
+            )
+        self.stdout.write(f"total {total} requests in {elapsed:.1f}s, {total / elapsed:.1f} req/s")
+
+    def check_consistency(self):
+        """
+        compare denormalized rating and count of books with the comment table,
+        adding rating deltas not yet flushed when `COALESCE_RATING_UPDATES` is on
+        """
+        comments = BookComment.objects.filter(book=OuterRef('pk'), is_deleted=False).order_by().values('book')
+        rated = comments.exclude(rating=None)
+        deltas = RatingDelta.objects.filter(
+            resource_type=Book._meta.label_lower, resource_id=OuterRef('pk')
+        ).order_by().values('resource_id')
+
+        def subquery(queryset, aggregate):
+            return Coalesce(Subquery(queryset.annotate(value=aggregate).values('value'), output_field=IntegerField()), 0)
+
+        consistent = Q(
+            stored_count=F('actual_count'),
+            stored_rating_number=F('actual_rating_number'),
+            stored_rating_total_score=F('actual_rating_total_score'),
+        )
+        books = Book.objects.annotate(
+            actual_count=subquery(comments, Count('pk')),
+            actual_rating_number=subquery(rated, Count('pk')),
+            # ratings are stored doubled in rating_total_score
+            actual_rating_total_score=subquery(rated, Sum('rating') * 2),
+        ).annotate(
+            # stored values with pending deltas, null rating number and score stand for 0
+            stored_count=F('comments_count') + subquery(deltas, Sum('comments_count')),
+            stored_rating_number=Coalesce('rating_number', 0) + subquery(deltas, Sum('rating_number')),
+            stored_rating_total_score=Coalesce('rating_total_score', 0) + subquery(deltas, Sum('rating_total_score')),
+        ).annotate(
+            is_consistent=Case(When(consistent, then=Value(True)), default=Value(False), output_field=BooleanField()),
+        ).filter(is_consistent=False)
+        mismatched = list(books.values(
+            'id', 'stored_count', 'actual_count', 'stored_rating_number', 'actual_rating_number',
+            'stored_rating_total_score', 'actual_rating_total_score',
+        )[:20])
+        if mismatched:
+            self.stdout.write(self.style.ERROR("Books with rating or count not matching their comments:"))
+            for row in mismatched:
+                self.stdout.write(str(row))
+        else:
+            self.stdout.write(self.style.SUCCESS("Rating and comments count of all books are consistent."))
+
+
+def percentile(sorted_samples, percent):
+    index = min(len(sorted_samples) - 1, int(round(percent / 100 * (len(sorted_samples) - 1))))
+    return sorted_samples[index]
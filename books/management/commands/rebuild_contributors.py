@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from books.models import Book, Contributor, normalize_name
+
+
+class Command(BaseCommand):
+    help = "Rebuild book counts of authors and translators from the book table."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        counts = {}
+        with connection.cursor() as cursor:
+            for role in ('author', 'translator'):
+                # a name listed twice in one book is counted once, like `get_contributors`
+                cursor.execute(
+                    f"SELECT name, count(DISTINCT id) FROM "
+                    f"(SELECT id, unnest({role}) AS name FROM {Book._meta.db_table} WHERE NOT is_deleted) AS t "
+                    f"WHERE btrim(name) <> '' GROUP BY name"
+                )
+                for name, count in cursor.fetchall():
+                    counts[(role, name)] = count
+
+        with transaction.atomic():
+            Contributor.objects.bulk_create(
+                [
+                    Contributor(role=role, name=name, normalized_name=normalize_name(name))
+                    for role, name in counts
+                ],
+                batch_size=options['batch_size'],
+                ignore_conflicts=True,
+            )
+            changed = []
+            for contributor in Contributor.objects.select_for_update().iterator():
+                count = counts.get((contributor.role, contributor.name), 0)
+                if contributor.book_count != count:
+                    contributor.book_count = count
+                    changed.append(contributor)
+            Contributor.objects.bulk_update(changed, ['book_count'], batch_size=options['batch_size'])
+        self.stdout.write(f"{len(counts)} contributors, {len(changed)} rows fixed.")
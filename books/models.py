@@ -1,15 +1,88 @@
+from collections import Counter
+from datetime import date
 from decimal import *
-from django.db import models
+from django.db import models, transaction
 from django.utils.translation import ugettext_lazy as _
 from django.core.serializers.json import DjangoJSONEncoder
 import django.contrib.postgres.fields as postgres
+from django.contrib.postgres.indexes import GinIndex
 from common.models import Comment, Resource
+from common.storage import content_storage
+from .isbn import canonical_isbn, to_isbn13
 
 
 def book_cover_path(instance, filename):
     return f'book/cover/{filename}'
 
 
+def get_pub_date(pub_year, pub_month):
+    """
+    Sortable publication date, the first day of the published month.
+    Books without month are considered published in January.
+    """
+    if pub_year is None or not 1 <= pub_year <= 9999:
+        return None
+    if pub_month is None or not 1 <= pub_month <= 12:
+        pub_month = 1
+    return date(pub_year, pub_month, 1)
+
+
+def normalize_name(name):
+    """ case and whitespace insensitive form of author or translator names """
+    return ' '.join(name.split()).casefold()[:100]
+
+
+# fields of a book that decide its contributors
+CONTRIBUTOR_FIELDS = ('author', 'translator', 'is_deleted')
+
+
+def get_contributors(author, translator, is_deleted):
+    """ set of (role, name) that a book contributes to `Contributor.book_count` """
+    if is_deleted:
+        return set()
+    return {
+        (role, name)
+        for role, names in (('author', author), ('translator', translator))
+        for name in names or []
+        if name and name.strip()
+    }
+
+
+def update_contributors(changes):
+    """
+    Apply book count changes, a mapping of (role, name) to delta.
+    Rows of the same delta are updated in one statement.
+    """
+    changes = {key: delta for key, delta in changes.items() if delta}
+    if not changes:
+        return
+    Contributor.objects.bulk_create(
+        [
+            Contributor(role=role, name=name, normalized_name=normalize_name(name))
+            for (role, name), delta in sorted(changes.items()) if delta > 0
+        ],
+        ignore_conflicts=True,
+    )
+    groups = {}
+    for (role, name), delta in sorted(changes.items()):
+        groups.setdefault((role, delta), []).append(name)
+    for (role, delta), names in groups.items():
+        Contributor.objects.filter(role=role, name__in=names).update(book_count=models.F('book_count') + delta)
+
+
+class BookQuerySet(models.QuerySet):
+
+    def by_isbn(self, value):
+        """
+        Books with the same ISBN in any form, looked up through the `isbn13` index.
+        Values that are not valid ISBN are matched literally.
+        """
+        try:
+            return self.filter(isbn13=to_isbn13(value))
+        except ValueError:
+            return self.filter(isbn=value)
+
+
 class Book(Resource):
     """
     Book entity class.
@@ -55,12 +128,21 @@ class Book(Resource):
     pub_house = models.CharField(_("publishing house"), blank=True, default='', max_length=200)
     pub_year = models.IntegerField(_("published year"), null=True, blank=True)
     pub_month = models.IntegerField(_("published month"), null=True, blank=True)
+    # derived from pub_year and pub_month on save, used for range filtering and ordering
+    pub_date = models.DateField(_("published date"), null=True, blank=True, editable=False, db_index=True)
     binding = models.CharField(_("binding"), blank=True, default='', max_length=50)
     # since data origin is not formatted and might be CNY USD or other currency, use char instead
     price = models.CharField(_("pricing"), blank=True, default='', max_length=50)
     pages = models.PositiveIntegerField(_("pages"), null=True, blank=True)
     isbn = models.CharField(_("ISBN"), blank=True, max_length=20, unique=True, db_index=True)
-    cover = models.ImageField(_("cover picture"), upload_to=book_cover_path, default='', blank=True)
+    # canonical form of isbn, null if isbn is not valid
+    isbn13 = models.CharField(_("ISBN-13"), null=True, blank=True, max_length=13, unique=True, editable=False)
+    # stored by content hash, identical covers share one file
+    cover = models.ImageField(
+        _("cover picture"), upload_to=book_cover_path, storage=content_storage, default='', blank=True
+    )
+
+    objects = BookQuerySet.as_manager()
 
     class Meta:
         # more info: https://docs.djangoproject.com/en/2.2/ref/models/options/
@@ -78,18 +160,148 @@ class Book(Resource):
             models.CheckConstraint(check=models.Q(pub_month__lte=12), name='pub_month_upperbound'),
             models.CheckConstraint(check=models.Q(pub_month__gte=1), name='pub_month_lowerbound'),
         ]
+        indexes = [
+            # change feed
+            models.Index(fields=['edited_time', 'id'], name='book_edited_time_idx'),
+            # leaderboards
+            models.Index(
+                fields=['-weighted_rating', 'id'],
+                name='book_weighted_rating_idx',
+                condition=models.Q(is_deleted=False, weighted_rating__isnull=False),
+            ),
+            models.Index(
+                fields=['language', '-weighted_rating', 'id'],
+                name='book_language_weighted_idx',
+                condition=models.Q(is_deleted=False, weighted_rating__isnull=False),
+            ),
+            # trending
+            models.Index(
+                fields=['-trending_score', 'id'],
+                name='book_trending_score_idx',
+                condition=models.Q(is_deleted=False, trending_score__isnull=False),
+            ),
+            # element lookups
+            GinIndex(fields=['author'], name='book_author_gin'),
+            GinIndex(fields=['translator'], name='book_translator_gin'),
+        ]
 
     def __str__(self):
         return self.title
 
+    def get_saved_contributors(self, lock=False):
+        """
+        contributors as saved, to count the difference on save.
+        With `lock`, read from the row locked until the transaction ends, so that
+        concurrent saves of the book don't count the same change twice.
+        """
+        if self._state.adding:
+            return set()
+        if not lock:
+            missing = object()
+            saved = {field: self.get_saved_value(field, missing) for field in CONTRIBUTOR_FIELDS}
+            if missing not in saved.values():
+                return get_contributors(**saved)
+        queryset = type(self)._default_manager.filter(pk=self.pk)
+        if lock:
+            queryset = queryset.select_for_update()
+        saved = queryset.values(*CONTRIBUTOR_FIELDS).first()
+        return get_contributors(**saved) if saved else set()
+
+    def save(self, *args, **kwargs):
+        self.pub_date = get_pub_date(self.pub_year, self.pub_month)
+        self.isbn13 = canonical_isbn(self.isbn)
+        # only changed columns are written, so contributors written by
+        # others are left alone when this save doesn't change them
+        contributors_changed = (
+            self._state.adding or getattr(self, '_saved_values', None) is None
+            or any(field in CONTRIBUTOR_FIELDS for field in self.get_dirty_fields())
+        )
+        with transaction.atomic():
+            if contributors_changed:
+                saved_contributors = self.get_saved_contributors(lock=True)
+            super().save(*args, **kwargs)
+            if contributors_changed:
+                contributors = get_contributors(self.author, self.translator, self.is_deleted)
+                changes = Counter({key: 1 for key in contributors - saved_contributors})
+                changes.update({key: -1 for key in saved_contributors - contributors})
+                update_contributors(changes)
+
+    def delete(self, *args, **kwargs):
+        with transaction.atomic():
+            saved_contributors = self.get_saved_contributors(lock=True)
+            result = super().delete(*args, **kwargs)
+            update_contributors({key: -1 for key in saved_contributors})
+        return result
+
 
 class BookComment(Comment):
 
     book = models.ForeignKey("books.Book", db_column="book_id", on_delete=models.CASCADE, related_name='comments')
 
+    partition_field = 'book'
+
     class Meta:
         db_table = 'bookcomment'
         constraints = [
             models.CheckConstraint(check=models.Q(rating__gte=0), name='book_comment_rating_lowerbound'),
             models.CheckConstraint(check=models.Q(rating__lte=5), name='book_comment_rating_upperbound'),
-        ]
\ No newline at end of file
+        ]
+        indexes = [
+            # change feed
+            models.Index(fields=['edited_time', 'id'], name='bookcomment_edited_time_idx'),
+        ]
+
+
+class Contributor(models.Model):
+    """
+    Distinct authors and translators with the number of books that are not deleted.
+    Maintained on book save and delete, rebuild with command `rebuild_contributors`.
+    """
+
+    ROLE_CHOICE = [('author', 'author'), ('translator', 'translator')]
+
+    role = models.CharField(_("role"), max_length=20, choices=ROLE_CHOICE)
+    name = models.CharField(_("name"), max_length=100)
+    # see `normalize_name`, for prefix search
+    normalized_name = models.CharField(_("normalized name"), max_length=100)
+    book_count = models.PositiveIntegerField(_("book count"), default=0)
+
+    class Meta:
+        db_table = 'contributor'
+        constraints = [
+            models.UniqueConstraint(fields=['role', 'name'], name='contributor_role_name_unique'),
+        ]
+        indexes = [
+            models.Index(
+                fields=['role', 'normalized_name'],
+                name='contributor_prefix_idx',
+                opclasses=['varchar_pattern_ops', 'varchar_pattern_ops'],
+            ),
+            models.Index(fields=['role', '-book_count', 'id'], name='contributor_book_count_idx'),
+        ]
+
+    def __str__(self):
+        return self.name
+
+
+class BookSimilarity(models.Model):
+    """
+    Books most similar to a book by co-rating, best first, one row per book so
+    that they are read by primary key.
+    Built offline by command `build_similar_books`.
+    """
+
+    book = models.OneToOneField(
+        "books.Book", db_column="book_id", primary_key=True, on_delete=models.CASCADE, related_name='+'
+    )
+    similar_ids = postgres.ArrayField(models.IntegerField(), default=list)
+    # cosine similarity of ratings, in the order of `similar_ids`
+    scores = postgres.ArrayField(models.FloatField(), default=list)
+    computed_time = models.DateTimeField(_("computed time"))
+
+    class Meta:
+        db_table = 'booksimilarity'
+        indexes = [
+            # rows listing a book, patched by incremental refresh
+            GinIndex(fields=['similar_ids'], name='booksimilarity_similar_gin'),
+        ]
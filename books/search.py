@@ -0,0 +1,65 @@
+"""
+Cache of book search results.
+Searches are keyed by their canonical filter spec, see `BookListCreate.get_filter_spec`,
+and the generation of `Book`, which is bumped by every book write. Ids of the
+matching books are cached with the total count, pages are then fetched by primary key.
+It is only used with a shared cache backend, see `common.cache.is_shared`, and only
+filled by requests reading from the primary, see `common.cache.can_fill`.
+"""
+
+from hashlib import sha1
+from django.conf import settings
+from django.core.cache import cache
+from common.cache import can_fill, get_generation
+
+
+def get_search_key(prefix, model, spec):
+    return f'{prefix}:{get_generation(model)}:' + sha1(repr(spec).encode()).hexdigest()
+
+
+def get_search_result(queryset, spec):
+    """
+    Return cached {'ids': [...], 'count': count} of the queryset.
+    At most `SEARCH_CACHE_MAX_IDS` ids are kept. Results read from a replica are not cached.
+    """
+    key = get_search_key('book_search', queryset.model, spec)
+    result = cache.get(key)
+    if result is not None:
+        return result
+
+    max_ids = getattr(settings, 'SEARCH_CACHE_MAX_IDS', 10000)
+    ids = list(queryset.values_list('id', flat=True)[:max_ids + 1])
+    if len(ids) <= max_ids:
+        # complete, counted without another query
+        count = len(ids)
+    else:
+        del ids[max_ids:]
+        count = queryset.order_by().count()
+    result = {'ids': ids, 'count': count}
+    if can_fill():
+        cache.set(key, result, getattr(settings, 'SEARCH_CACHE_TIMEOUT', 300))
+    return result
+
+
+class SearchResult:
+    """
+    Books of a cached search result, sliced by the paginator.
+    Its length is the total count. Slices within the cached ids are fetched by
+    primary key, the rest are read from the queryset.
+    """
+
+    def __init__(self, queryset, result):
+        self.queryset = queryset
+        self.ids = result['ids']
+        self.count = result['count']
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, index):
+        start, stop, _ = index.indices(self.count)
+        if stop > len(self.ids):
+            return list(self.queryset[start:stop])
+        ids = self.ids[start:stop]
+        books = self.queryset.model._default_manager.filter(is_deleted=False).in_bulk(ids)
+        return [books[pk] for pk in ids if pk in books]
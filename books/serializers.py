@@ -1,8 +1,10 @@
+from django.db import IntegrityError, transaction
 from rest_framework import serializers
-from .models import Book, BookComment
+from .models import Book, BookComment, Contributor
 from core.validators import ValidUniqueTogetherValidator
 from core.serializers import PrimayKeyHyperlinkField
 from common.serializers import Base64ImageField
+from .isbn import to_isbn13
 
 
 class BookSerializer(serializers.ModelSerializer):
@@ -27,6 +29,39 @@ class BookSerializer(serializers.ModelSerializer):
         )
         return serializer.data
 
+    def validate_isbn(self, value):
+        """
+        Check ISBN checksum, and that no other book has the same ISBN in any form.
+        An unchanged ISBN is let through, books saved before the checksum was
+        checked may have an invalid one.
+        """
+        if self.instance is not None and value == self.instance.isbn:
+            return value
+        try:
+            to_isbn13(value)
+        except ValueError as e:
+            raise serializers.ValidationError(str(e))
+        duplicates = Book.objects.by_isbn(value)
+        if self.instance is not None:
+            duplicates = duplicates.exclude(pk=self.instance.pk)
+        if duplicates.exists():
+            raise serializers.ValidationError("Book with this ISBN already exists.")
+        return value
+
+    def save(self, **kwargs):
+        """
+        Until `backfill_isbn13` has run, the canonical ISBN-13 of a book may be
+        taken by another book whose `isbn` is in another form, which is reported
+        as a duplicate instead of an error.
+        """
+        try:
+            with transaction.atomic():
+                return super().save(**kwargs)
+        except IntegrityError as e:
+            if 'isbn13' in str(e):
+                raise serializers.ValidationError({'isbn': ["Book with this ISBN already exists."]})
+            raise
+
     class Meta:
         model = Book
         fields = [
@@ -47,10 +82,13 @@ class BookSerializer(serializers.ModelSerializer):
             'other',
             'rating',
             'rating_number',
+            'weighted_rating',
+            'comments_count',
             'pages',
             'cover',
             'edited_time'
         ]
+        read_only_fields = ['weighted_rating', 'comments_count']
 
 
 class BookCommentSerializer(serializers.ModelSerializer):
@@ -78,4 +116,18 @@ class BookCommentSerializer(serializers.ModelSerializer):
                 queryset=BookComment.objects.all(),
                 fields=['user_id', 'book']
             )
-        ]
\ No newline at end of file
+        ]
+
+
+class ContributorSerializer(serializers.ModelSerializer):
+    """
+    Author or translator with number of books.
+    """
+
+    class Meta:
+        model = Contributor
+        fields = [
+            'name',
+            'role',
+            'book_count',
+        ]
@@ -0,0 +1,101 @@
+"""
+Item-item cosine similarity of books from comment ratings centered on the mean
+of each user, used offline by command `build_similar_books`. Requires numpy and scipy.
+Similarities of a chunk of books are one sparse product with the whole
+user x book matrix, so memory is bounded by the co-rated pairs of the chunk.
+"""
+
+from itertools import islice
+import numpy as np
+from scipy import sparse
+
+
+def build_rating_matrix(rows, chunk_size=100000):
+    """
+    Sparse users x books matrix from (user_id, book_id, rating), read in chunks
+    into compact arrays, with the ratings of each user centered on their mean.
+    Return the matrix in CSC and book ids of its columns.
+    """
+    users = {}
+    books = {}
+    user_chunks = []
+    book_chunks = []
+    value_chunks = []
+    rows = iter(rows)
+    while True:
+        chunk = list(islice(rows, chunk_size))
+        if not chunk:
+            break
+        user_chunks.append(np.fromiter(
+            (users.setdefault(user_id, len(users)) for user_id, _, _ in chunk), dtype=np.int32, count=len(chunk)
+        ))
+        book_chunks.append(np.fromiter(
+            (books.setdefault(book_id, len(books)) for _, book_id, _ in chunk), dtype=np.int32, count=len(chunk)
+        ))
+        value_chunks.append(np.fromiter((float(rating) for _, _, rating in chunk), dtype=np.float32, count=len(chunk)))
+        del chunk
+    if value_chunks:
+        user_index, book_index, values = (
+            np.concatenate(user_chunks), np.concatenate(book_chunks), np.concatenate(value_chunks)
+        )
+    else:
+        user_index = book_index = np.zeros(0, dtype=np.int32)
+        values = np.zeros(0, dtype=np.float32)
+    del user_chunks, book_chunks, value_chunks
+    matrix = sparse.csr_matrix((values, (user_index, book_index)), shape=(len(users), len(books)))
+    del user_index, book_index, values
+    center_rows(matrix)
+    # a rating at the mean of its user carries no signal for cosine similarity
+    matrix.eliminate_zeros()
+    book_ids = np.zeros(len(books), dtype=np.int64)
+    for book_id, column in books.items():
+        book_ids[column] = book_id
+    return matrix.tocsc(), book_ids
+
+
+def center_rows(matrix):
+    """
+    Subtract the mean of the stored ratings of every user in place.
+    Ratings are all positive, so without it nearly every co-rated pair is similar;
+    centered, books liked by the same users above their usual rating are.
+    """
+    counts = np.diff(matrix.indptr)
+    sums = np.asarray(matrix.sum(axis=1)).ravel()
+    means = np.divide(sums, counts, out=np.zeros_like(sums), where=counts > 0)
+    matrix.data -= np.repeat(means, counts).astype(matrix.dtype)
+
+
+def normalize_columns(matrix):
+    """ scale every column to unit length, so that dot products are cosine similarities """
+    norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=0)).ravel())
+    norms[norms == 0] = 1
+    return (matrix @ sparse.diags(1 / norms)).tocsc()
+
+
+def iter_similarities(normalized, columns, min_common=1):
+    """
+    Yield (column, neighbor columns, scores) of every given column, unordered,
+    without itself. Pairs rated by less than `min_common` users are left out.
+    """
+    chunk = normalized[:, columns]
+    scores = (chunk.T @ normalized).tocsr()
+    if min_common > 1:
+        binary = normalized.copy()
+        binary.data[:] = 1
+        common = (binary[:, columns].T @ binary).tocsr()
+        scores = scores.multiply(common >= min_common).tocsr()
+    for row, column in enumerate(columns):
+        start, end = scores.indptr[row], scores.indptr[row + 1]
+        neighbors = scores.indices[start:end]
+        values = scores.data[start:end]
+        keep = (neighbors != column) & (values > 0)
+        yield column, neighbors[keep], values[keep]
+
+
+def top_k(neighbors, values, k):
+    """ the k best neighbors and their scores, best first """
+    if len(values) > k:
+        best = np.argpartition(-values, k)[:k]
+        neighbors, values = neighbors[best], values[best]
+    order = np.argsort(-values, kind='stable')
+    return neighbors[order], values[order]
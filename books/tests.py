@@ -1,3 +1,784 @@
-from django.test import TestCase
+import re
+import shutil
+import tempfile
+from datetime import date, timedelta
+from decimal import Decimal
+from hashlib import sha256
+from io import StringIO
+from unittest import mock, skipIf
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.management import call_command
+from django.db import DatabaseError, IntegrityError, connection
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.exceptions import ParseError
+from rest_framework.test import APIRequestFactory, APITestCase
+from common import partitioning
+from common.models import Blob
+from core import routers
+from core.views import ConditionalRequestMixin
+from .facets import FACETS, parse_facets
+from .isbn import canonical_isbn, to_isbn13
+from .models import Book, BookComment, BookSimilarity, Contributor, get_pub_date
+from .search import get_search_result
+from .views import BookListCreate
 
-# Create your tests here.
+try:
+    from . import similarity
+except ImportError:
+    # numpy and scipy are optional
+    similarity = None
+
+
+@override_settings(COALESCE_RATING_UPDATES=False)
+class CommentAccountingTests(APITestCase):
+    """ comments count and rating of books kept by comment writes """
+
+    def setUp(self):
+        self.client.credentials(HTTP_SECRET_KEY=sha256(settings.SECRET_KEY.encode()).hexdigest())
+        self.book = Book.objects.create(title='A', isbn='9780306406157')
+        self.other = Book.objects.create(title='B', isbn='9780262033848')
+
+    def get_url(self, book, comment_id=None):
+        if comment_id is None:
+            return f'/books/{book.pk}/comments/'
+        return f'/books/{book.pk}/comments/{comment_id}/'
+
+    def create_comment(self, user_id, rating):
+        response = self.client.post(
+            self.get_url(self.book), {'user_id': user_id, 'rating': rating, 'content': 'text'}, format='json'
+        )
+        self.assertEqual(response.status_code, 201)
+        return response.data['id']
+
+    def assertAccounting(self, book, comments_count, rating_number, rating_total_score):
+        book.refresh_from_db()
+        self.assertEqual(
+            (book.comments_count, book.rating_number, book.rating_total_score),
+            (comments_count, rating_number, rating_total_score),
+        )
+
+    def test_create(self):
+        self.create_comment('u1', 4.5)
+        self.assertAccounting(self.book, 1, 1, 9)
+        self.assertEqual(self.book.rating, Decimal('4.5'))
+        self.create_comment('u2', None)
+        self.assertAccounting(self.book, 2, 1, 9)
+        self.create_comment('u3', 3)
+        self.assertAccounting(self.book, 3, 2, 15)
+        self.assertEqual(self.book.rating, Decimal('3.8'))
+
+    def test_update_rating(self):
+        comment_id = self.create_comment('u1', 4.5)
+        response = self.client.patch(self.get_url(self.book, comment_id), {'rating': 3}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertAccounting(self.book, 1, 1, 6)
+
+    def test_update_keeps_unspecified_rating(self):
+        comment_id = self.create_comment('u1', 4.5)
+        response = self.client.patch(self.get_url(self.book, comment_id), {'content': 'new'}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertAccounting(self.book, 1, 1, 9)
+
+    def test_update_clears_rating(self):
+        comment_id = self.create_comment('u1', 4.5)
+        response = self.client.patch(self.get_url(self.book, comment_id), {'rating': None}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertAccounting(self.book, 1, None, None)
+        self.assertIsNone(self.book.rating)
+
+    def test_move(self):
+        comment_id = self.create_comment('u1', 4.5)
+        self.create_comment('u2', 2)
+        response = self.client.patch(self.get_url(self.book, comment_id), {'book': self.other.pk}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertAccounting(self.book, 1, 1, 4)
+        self.assertAccounting(self.other, 1, 1, 9)
+
+    def test_move_and_rate(self):
+        comment_id = self.create_comment('u1', 4.5)
+        response = self.client.patch(
+            self.get_url(self.book, comment_id), {'book': self.other.pk, 'rating': 1}, format='json'
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertAccounting(self.book, 0, None, None)
+        self.assertAccounting(self.other, 1, 1, 2)
+
+    def test_soft_delete_and_restore(self):
+        comment_id = self.create_comment('u1', 4.5)
+        self.create_comment('u2', 3)
+        response = self.client.delete(self.get_url(self.book, comment_id) + '?hard=false')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(BookComment.objects.get(pk=comment_id).is_deleted)
+        self.assertAccounting(self.book, 1, 1, 6)
+
+        response = self.client.patch(self.get_url(self.book, comment_id), {}, format='json')
+        self.assertEqual(response.status_code, 404)
+        response = self.client.patch(self.get_url(self.book, comment_id) + '?restore=true', {}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(BookComment.objects.get(pk=comment_id).is_deleted)
+        self.assertAccounting(self.book, 2, 2, 15)
+
+    def test_hard_delete(self):
+        comment_id = self.create_comment('u1', 4.5)
+        response = self.client.delete(self.get_url(self.book, comment_id))
+        self.assertEqual(response.status_code, 204)
+        self.assertFalse(BookComment.objects.filter(pk=comment_id).exists())
+        self.assertAccounting(self.book, 0, None, None)
+
+    def test_hard_delete_after_soft_delete(self):
+        comment_id = self.create_comment('u1', 4.5)
+        self.create_comment('u2', 3)
+        self.client.delete(self.get_url(self.book, comment_id) + '?hard=false')
+        response = self.client.delete(self.get_url(self.book, comment_id))
+        self.assertEqual(response.status_code, 204)
+        self.assertAccounting(self.book, 1, 1, 6)
+
+
+class ListValidatorTests(SimpleTestCase):
+
+    def get_etag(self, books, count=None, path='/books/?page=1'):
+        mixin = ConditionalRequestMixin()
+        mixin.request = APIRequestFactory().get(path)
+        etag, last_modified = mixin.get_list_validators(Book, books, len(books) if count is None else count)
+        self.assertIsNone(last_modified)
+        return etag
+
+    def test_changes_with_edited_time(self):
+        now = timezone.now()
+        books = [Book(pk=1, edited_time=now), Book(pk=2, edited_time=now)]
+        etag = self.get_etag(books)
+        self.assertEqual(self.get_etag(books), etag)
+        # e.g. by a maintenance command bumping `edited_time`
+        books[1].edited_time = now + timedelta(microseconds=1)
+        self.assertNotEqual(self.get_etag(books), etag)
+
+    def test_changes_with_page_and_count(self):
+        now = timezone.now()
+        books = [Book(pk=1, edited_time=now), Book(pk=2, edited_time=now)]
+        etag = self.get_etag(books)
+        self.assertNotEqual(self.get_etag(books[:1]), etag)
+        self.assertNotEqual(self.get_etag(books, count=3), etag)
+        self.assertNotEqual(self.get_etag(books, path='/books/?page=2'), etag)
+
+
+class PubDateTests(SimpleTestCase):
+
+    def test_first_day_of_month(self):
+        self.assertEqual(get_pub_date(2019, 5), date(2019, 5, 1))
+        self.assertEqual(get_pub_date(9999, 12), date(9999, 12, 1))
+
+    def test_missing_or_invalid_month_is_january(self):
+        for month in [None, 0, 13]:
+            self.assertEqual(get_pub_date(2019, month), date(2019, 1, 1))
+
+    def test_missing_or_invalid_year(self):
+        for year in [None, 0, 10000]:
+            self.assertIsNone(get_pub_date(year, 5))
+
+
+class PubDateFilterTests(APITestCase):
+
+    def setUp(self):
+        self.client.credentials(HTTP_SECRET_KEY=sha256(settings.SECRET_KEY.encode()).hexdigest())
+        for pub_year, pub_month in [(2018, 12), (2019, None), (2019, 4), (2019, 5), (2019, 6), (2019, 12), (2020, None)]:
+            title = f'{pub_year}-{pub_month}' if pub_month else str(pub_year)
+            Book.objects.create(title=title, isbn=title, pub_year=pub_year, pub_month=pub_month)
+
+    def get_titles(self, **params):
+        response = self.client.get('/books/', params)
+        self.assertEqual(response.status_code, 200)
+        return sorted(book['title'] for book in response.data['results'])
+
+    def test_after_year(self):
+        self.assertEqual(
+            self.get_titles(after='2019'), ['2019', '2019-12', '2019-4', '2019-5', '2019-6', '2020']
+        )
+
+    def test_after_month_is_exclusive(self):
+        self.assertEqual(self.get_titles(after='2019-05'), ['2019-12', '2019-6', '2020'])
+
+    def test_after_december(self):
+        self.assertEqual(self.get_titles(after='2019-12'), ['2020'])
+
+    def test_before_year(self):
+        self.assertEqual(
+            self.get_titles(before='2019'), ['2018-12', '2019', '2019-12', '2019-4', '2019-5', '2019-6']
+        )
+
+    def test_before_month_is_exclusive(self):
+        # books without month are considered published in January
+        self.assertEqual(self.get_titles(before='2019-05'), ['2018-12', '2019', '2019-4'])
+
+    def test_between(self):
+        self.assertEqual(self.get_titles(after='2019-04', before='2019-12'), ['2019-5', '2019-6'])
+
+    def test_invalid_month(self):
+        response = self.client.get('/books/', {'after': '2019-13'})
+        self.assertEqual(response.status_code, 400)
+
+
+class ParseFacetsTests(SimpleTestCase):
+
+    def test_names(self):
+        self.assertEqual(parse_facets('language,decade'), ['language', 'decade'])
+
+    def test_whitespace_and_duplicates(self):
+        self.assertEqual(parse_facets(' rating_band , language,rating_band'), ['rating_band', 'language'])
+
+    def test_all(self):
+        self.assertEqual(parse_facets('all'), list(FACETS))
+        self.assertEqual(parse_facets(' all '), list(FACETS))
+
+    def test_unknown(self):
+        with self.assertRaisesMessage(ValueError, 'price'):
+            parse_facets('language,price')
+        with self.assertRaises(ValueError):
+            parse_facets('')
+
+
+class IsbnTests(SimpleTestCase):
+
+    def test_isbn10_converted(self):
+        self.assertEqual(to_isbn13('0306406152'), '9780306406157')
+        self.assertEqual(to_isbn13('0262033844'), '9780262033848')
+
+    def test_separators_and_case_ignored(self):
+        for value in ['0-306-40615-2', '0 306 40615 2', '978-0-306-40615-7', ' 9780306406157 ']:
+            self.assertEqual(to_isbn13(value), '9780306406157')
+        self.assertEqual(to_isbn13('080442957X'), '9780804429573')
+        self.assertEqual(to_isbn13('080442957x'), '9780804429573')
+
+    def test_invalid_checksum(self):
+        for value in ['0306406153', '9780306406158', '7-5327-1234-x']:
+            with self.assertRaises(ValueError):
+                to_isbn13(value)
+
+    def test_invalid_format(self):
+        for value in ['', '12345', 'X306406152', '1234567890123', '97803064061570']:
+            with self.assertRaises(ValueError):
+                to_isbn13(value)
+
+    def test_canonical_isbn(self):
+        self.assertEqual(canonical_isbn('0-306-40615-2'), '9780306406157')
+        self.assertIsNone(canonical_isbn('0306406153'))
+        self.assertIsNone(canonical_isbn('unknown'))
+
+
+class FilterSpecTests(SimpleTestCase):
+
+    def get_spec(self, params):
+        view = BookListCreate()
+        view.request = view.initialize_request(APIRequestFactory().get('/books/', params))
+        return view.get_filter_spec()
+
+    def test_order_case_and_whitespace_ignored(self):
+        self.assertEqual(
+            self.get_spec({'title': 'Foo bar', 'Author': 'Lu  Xun', 'pub_house': 'Press'}),
+            self.get_spec({'pub_house': 'press', 'author': 'lu xun', 'TITLE': ' bar foo foo'}),
+        )
+
+    def test_isbn_forms(self):
+        self.assertEqual(self.get_spec({'isbn': '0-306-40615-2'}), (('isbn', ('isbn13', '9780306406157')),))
+        self.assertEqual(self.get_spec({'isbn': '0306406152'}), self.get_spec({'isbn': '978-0-306-40615-7'}))
+        self.assertEqual(self.get_spec({'isbn': 'unknown'}), (('isbn', ('isbn', 'unknown')),))
+
+    def test_numbers(self):
+        self.assertEqual(self.get_spec({'higher_than': '4.50'}), self.get_spec({'higher_than': ' 4.5'}))
+        self.assertEqual(self.get_spec({'after': '2019-5'}), (('after', (2019, 5)),))
+        self.assertEqual(self.get_spec({'min_comments': '10'}), (('min_comments', 10),))
+
+    def test_empty_and_unknown_params_ignored(self):
+        self.assertEqual(self.get_spec({'title': '  ', 'after': '', 'foo': 'bar'}), ())
+
+    def test_invalid(self):
+        for params in [{'after': '2019-13'}, {'higher_than': 'nan'}, {'min_comments': 'x'}, {'author': 'a'}]:
+            with self.assertRaises(ParseError):
+                self.get_spec(params)
+
+
+class LimitTests(APITestCase):
+
+    def setUp(self):
+        self.client.credentials(HTTP_SECRET_KEY=sha256(settings.SECRET_KEY.encode()).hexdigest())
+
+    def assertLimitRejected(self, path):
+        for limit in ['-1', '0', 'x']:
+            response = self.client.get(path, {'limit': limit})
+            self.assertEqual(response.status_code, 400, limit)
+
+    def test_change_feed(self):
+        self.assertLimitRejected('/books/changes/')
+        self.assertEqual(self.client.get('/books/changes/', {'limit': '1'}).status_code, 200)
+
+    def test_leaderboard(self):
+        self.assertLimitRejected('/books/top/')
+        self.assertEqual(self.client.get('/books/top/', {'limit': '1'}).status_code, 200)
+
+    def test_trending(self):
+        self.assertLimitRejected('/books/trending/')
+        self.assertEqual(self.client.get('/books/trending/', {'limit': '1'}).status_code, 200)
+
+
+class ContributorTests(APITestCase):
+
+    def setUp(self):
+        self.client.credentials(HTTP_SECRET_KEY=sha256(settings.SECRET_KEY.encode()).hexdigest())
+
+    def get_counts(self, role='author'):
+        return dict(Contributor.objects.filter(role=role).values_list('name', 'book_count'))
+
+    def get_titles(self, **params):
+        response = self.client.get('/books/', params)
+        self.assertEqual(response.status_code, 200)
+        return sorted(book['title'] for book in response.data['results'])
+
+    def test_create(self):
+        Book.objects.create(title='A', isbn='a', author=['Lu Xun', 'Zhou Zuoren'], translator=['Yang Xianyi'])
+        Book.objects.create(title='B', isbn='b', author=['Lu Xun', ' '])
+        self.assertEqual(self.get_counts(), {'Lu Xun': 2, 'Zhou Zuoren': 1})
+        self.assertEqual(self.get_counts('translator'), {'Yang Xianyi': 1})
+
+    def test_author_change(self):
+        book = Book.objects.create(title='A', isbn='a', author=['Lu Xun'])
+        book.author = ['Lao She']
+        book.save()
+        self.assertEqual(self.get_counts(), {'Lu Xun': 0, 'Lao She': 1})
+        book = Book.objects.get(pk=book.pk)
+        book.author.append('Ba Jin')
+        book.save()
+        self.assertEqual(self.get_counts(), {'Lu Xun': 0, 'Lao She': 1, 'Ba Jin': 1})
+
+    def test_other_change(self):
+        book = Book.objects.create(title='A', isbn='a', author=['Lu Xun'])
+        book = Book.objects.get(pk=book.pk)
+        book.title = 'B'
+        book.save()
+        self.assertEqual(self.get_counts(), {'Lu Xun': 1})
+
+    def test_soft_delete_and_restore(self):
+        book = Book.objects.create(title='A', isbn='a', author=['Lu Xun'])
+        book.is_deleted = True
+        book.save()
+        self.assertEqual(self.get_counts(), {'Lu Xun': 0})
+        book.is_deleted = False
+        book.save()
+        self.assertEqual(self.get_counts(), {'Lu Xun': 1})
+
+    def test_hard_delete(self):
+        book = Book.objects.create(title='A', isbn='a', author=['Lu Xun'])
+        Book.objects.create(title='B', isbn='b', author=['Lu Xun'])
+        Book.objects.get(pk=book.pk).delete()
+        self.assertEqual(self.get_counts(), {'Lu Xun': 1})
+
+    def test_hard_delete_after_soft_delete(self):
+        book = Book.objects.create(title='A', isbn='a', author=['Lu Xun'])
+        book.is_deleted = True
+        book.save()
+        book.delete()
+        self.assertEqual(self.get_counts(), {'Lu Xun': 0})
+
+    def test_author_prefix(self):
+        Book.objects.create(title='A', isbn='a', author=['Lu Xun'])
+        Book.objects.create(title='B', isbn='b', author=['Lao She'], translator=['Lu Xun'])
+        Book.objects.create(title='C', isbn='c', author=['Xun Zi'])
+        self.assertEqual(self.get_titles(author='lu  x'), ['A'])
+        self.assertEqual(self.get_titles(author='LU'), ['A'])
+        # prefix of the name, not any substring
+        self.assertEqual(self.get_titles(author='xun'), ['C'])
+        self.assertEqual(self.get_titles(translator='lu xun'), ['B'])
+        self.assertEqual(self.get_titles(author_exact='Lu Xun'), ['A'])
+
+    def test_author_prefix_too_short(self):
+        Book.objects.create(title='A', isbn='a', author=['Lu Xun'])
+        for params in [{'author': 'l'}, {'author': ' L '}, {'translator': 'l'}]:
+            response = self.client.get('/books/', params)
+            self.assertEqual(response.status_code, 400, params)
+
+    def test_contributor_list(self):
+        Book.objects.create(title='A', isbn='a', author=['Lu Xun', 'Lao She'])
+        Book.objects.create(title='B', isbn='b', author=['Lu Xun'], is_deleted=True)
+        response = self.client.get('/books/authors/', {'prefix': 'l'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [(contributor['name'], contributor['book_count']) for contributor in response.data['results']],
+            [('Lao She', 1), ('Lu Xun', 1)],
+        )
+
+
+class CoverReferenceTests(APITestCase):
+
+    def setUp(self):
+        self.client.credentials(HTTP_SECRET_KEY=sha256(settings.SECRET_KEY.encode()).hexdigest())
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root)
+        media_root = override_settings(MEDIA_ROOT=root)
+        media_root.enable()
+        self.addCleanup(media_root.disable)
+        self.book = Book.objects.create(title='A', isbn='a', cover=ContentFile(b'cover', name='a.jpg'))
+        self.cover = self.book.cover.name
+
+    def get_ref_count(self):
+        return Blob.objects.get(name=self.cover).ref_count
+
+    def test_update_releases_cover(self):
+        response = self.client.put(f'/books/{self.book.pk}/', {'title': 'B', 'isbn': 'a'}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.get_ref_count(), 0)
+
+    def test_failed_update_keeps_cover(self):
+        with mock.patch.object(Book, 'save', side_effect=IntegrityError('duplicate key value "book_isbn13_key"')):
+            response = self.client.put(f'/books/{self.book.pk}/', {'title': 'B', 'isbn': 'a'}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.get_ref_count(), 1)
+
+    def test_hard_delete_releases_cover(self):
+        response = self.client.delete(f'/books/{self.book.pk}/')
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(self.get_ref_count(), 0)
+
+    def test_failed_hard_delete_keeps_cover(self):
+        with mock.patch.object(Book, 'delete', side_effect=DatabaseError), self.assertRaises(DatabaseError):
+            self.client.delete(f'/books/{self.book.pk}/')
+        self.assertEqual(self.get_ref_count(), 1)
+
+
+class BulkUpdateTests(APITestCase):
+
+    def setUp(self):
+        self.client.credentials(HTTP_SECRET_KEY=sha256(settings.SECRET_KEY.encode()).hexdigest())
+        self.a = Book.objects.create(title='A', isbn='0306406152', author=['Lu Xun'], pub_year=2019)
+        self.b = Book.objects.create(title='B', isbn='b')
+
+    def patch(self, items):
+        return self.client.patch('/books/bulk/', items, format='json')
+
+    def test_all_updated(self):
+        response = self.patch([{'id': self.a.pk, 'changes': {'title': 'A2'}}])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, {'updated': 1, 'results': [{'index': 0, 'id': self.a.pk, 'fields': ['title']}]})
+        self.assertEqual(Book.objects.get(pk=self.a.pk).title, 'A2')
+
+    def test_results_of_each_item(self):
+        response = self.patch([
+            {'id': self.a.pk, 'changes': {'title': 'A2'}},
+            {'id': 999999, 'changes': {'title': 'X'}},
+            {'id': self.b.pk, 'changes': {'cover': None}},
+            {'id': 'b', 'changes': {}},
+            'x',
+            {'id': self.a.pk, 'changes': {'title': 'A3'}},
+            {'id': self.b.pk, 'changes': {'pub_month': 'May'}},
+        ])
+        self.assertEqual(response.status_code, 207)
+        self.assertEqual(response.data['updated'], 1)
+        results = response.data['results']
+        self.assertEqual([result['index'] for result in results], list(range(7)))
+        self.assertEqual(results[0], {'index': 0, 'id': self.a.pk, 'fields': ['title']})
+        self.assertEqual(results[1], {'index': 1, 'id': 999999, 'errors': {'id': ["Not found."]}})
+        self.assertEqual(list(results[2]['errors']), ['cover'])
+        self.assertEqual(list(results[3]['errors']), ['id'])
+        self.assertNotIn('id', results[3])
+        self.assertEqual(list(results[4]['errors']), ['detail'])
+        self.assertEqual(results[5]['errors'], {'id': ["Duplicated book in the request."]})
+        self.assertEqual(list(results[6]['errors']), ['pub_month'])
+        self.assertEqual(Book.objects.get(pk=self.a.pk).title, 'A2')
+
+    def test_isbn_taken_by_other_book(self):
+        response = self.patch([{'id': self.b.pk, 'changes': {'isbn': '978-0-306-40615-7'}}])
+        self.assertEqual(response.status_code, 207)
+        self.assertEqual(list(response.data['results'][0]['errors']), ['isbn'])
+        self.assertEqual(Book.objects.get(pk=self.b.pk).isbn, 'b')
+
+    def test_isbn_taken_within_request(self):
+        response = self.patch([
+            {'id': self.a.pk, 'changes': {'isbn': '9780262033848'}},
+            {'id': self.b.pk, 'changes': {'isbn': '0-262-03384-4'}},
+        ])
+        self.assertEqual(response.status_code, 207)
+        self.assertEqual(response.data['results'][0]['fields'], ['isbn', 'isbn13'])
+        self.assertEqual(response.data['results'][1]['errors'], {'isbn': ["Book with this ISBN already exists."]})
+        self.assertEqual(Book.objects.get(pk=self.a.pk).isbn13, '9780262033848')
+        self.assertIsNone(Book.objects.get(pk=self.b.pk).isbn13)
+
+    def test_derived_fields(self):
+        edited_time = Book.objects.get(pk=self.a.pk).edited_time
+        response = self.patch([{
+            'id': self.a.pk,
+            'changes': {'pub_year': 2020, 'pub_month': 5, 'isbn': '0262033844', 'author': ['Lao She']},
+        }])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            response.data['results'][0]['fields'],
+            ['author', 'isbn', 'isbn13', 'pub_date', 'pub_month', 'pub_year'],
+        )
+        book = Book.objects.get(pk=self.a.pk)
+        self.assertEqual(book.pub_date, date(2020, 5, 1))
+        self.assertEqual(book.isbn13, '9780262033848')
+        self.assertGreater(book.edited_time, edited_time)
+        self.assertEqual(
+            dict(Contributor.objects.filter(role='author').values_list('name', 'book_count')),
+            {'Lu Xun': 0, 'Lao She': 1},
+        )
+
+    def test_unchanged(self):
+        edited_time = Book.objects.get(pk=self.a.pk).edited_time
+        response = self.patch([{'id': self.a.pk, 'changes': {'title': 'A', 'pub_year': 2019}}])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['results'][0]['fields'], [])
+        self.assertEqual(Book.objects.get(pk=self.a.pk).edited_time, edited_time)
+
+
+class SearchCacheTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.book = Book.objects.create(title='A', isbn='a')
+        self.queryset = Book.objects.filter(is_deleted=False).order_by('id')
+
+    def test_filled_from_primary(self):
+        self.assertEqual(get_search_result(self.queryset, ()), {'ids': [self.book.pk], 'count': 1})
+        # the generation is bumped on commit, which never comes in a test case
+        Book.objects.create(title='B', isbn='b')
+        self.assertEqual(get_search_result(self.queryset, ()), {'ids': [self.book.pk], 'count': 1})
+
+    def test_not_filled_from_replica(self):
+        with mock.patch.object(routers, 'replicas_enabled', return_value=True):
+            self.assertEqual(get_search_result(self.queryset, ())['count'], 1)
+        Book.objects.create(title='B', isbn='b')
+        self.assertEqual(get_search_result(self.queryset, ())['count'], 2)
+
+
+@skipIf(similarity is None, "numpy and scipy are required.")
+class SimilarityTests(SimpleTestCase):
+    """
+    Ratings of every user average 3, so centered they are
+    u1: A +2, B +2, C -2, D -2
+    u2: A +1, B +1, C -1, D -1
+    u3: A +1, E +1, C -2, F 0
+    u4: B -1, E +1
+    """
+
+    rows = [
+        ('u1', 1, Decimal('5.0')), ('u1', 2, Decimal('5.0')), ('u1', 3, Decimal('1.0')), ('u1', 4, Decimal('1.0')),
+        ('u2', 1, Decimal('4.0')), ('u2', 2, Decimal('4.0')), ('u2', 3, Decimal('2.0')), ('u2', 4, Decimal('2.0')),
+        ('u3', 1, Decimal('4.0')), ('u3', 5, Decimal('4.0')), ('u3', 3, Decimal('1.0')), ('u3', 6, Decimal('3.0')),
+        ('u4', 2, Decimal('2.0')), ('u4', 5, Decimal('4.0')),
+    ]
+
+    def get_similar(self, k=10, min_common=1):
+        # chunks smaller than a user's ratings
+        matrix, book_ids = similarity.build_rating_matrix(self.rows, chunk_size=3)
+        normalized = similarity.normalize_columns(matrix)
+        similar = {}
+        for column, neighbors, scores in similarity.iter_similarities(
+            normalized, list(range(len(book_ids))), min_common=min_common
+        ):
+            neighbors, scores = similarity.top_k(neighbors, scores, k)
+            similar[int(book_ids[column])] = ([int(book_ids[neighbor]) for neighbor in neighbors], list(scores))
+        return similar
+
+    def test_rating_matrix(self):
+        matrix, book_ids = similarity.build_rating_matrix(self.rows, chunk_size=3)
+        self.assertEqual(list(book_ids), [1, 2, 3, 4, 5, 6])
+        self.assertEqual(matrix.shape, (4, 6))
+        # the rating at the mean of its user is dropped
+        self.assertEqual(matrix.nnz, 13)
+        self.assertEqual(matrix.toarray()[0].tolist(), [2, 2, -2, -2, 0, 0])
+        self.assertEqual(matrix.toarray()[3].tolist(), [0, -1, 0, 0, 1, 0])
+
+    def test_empty(self):
+        matrix, book_ids = similarity.build_rating_matrix([])
+        self.assertEqual(matrix.shape, (0, 0))
+        self.assertEqual(len(book_ids), 0)
+
+    def test_ranking(self):
+        similar = self.get_similar()
+        ids, scores = similar[1]
+        self.assertEqual(ids, [2, 5])
+        self.assertAlmostEqual(scores[0], 5 / 6, places=5)
+        self.assertAlmostEqual(scores[1], 1 / 12 ** 0.5, places=5)
+        # negatively correlated books are left out
+        self.assertEqual(similar[2][0], [1])
+        self.assertEqual(similar[3][0], [4])
+        self.assertEqual(similar[4][0], [3])
+        self.assertEqual(similar[5][0], [1])
+        self.assertEqual(similar[6][0], [])
+
+    def test_top_k(self):
+        self.assertEqual(self.get_similar(k=1)[1][0], [2])
+        self.assertEqual(self.get_similar(k=0)[1][0], [])
+
+    def test_min_common(self):
+        # A and E are rated by u3 only
+        self.assertEqual(self.get_similar(min_common=2)[1][0], [2])
+
+
+class SimilarListTests(APITestCase):
+
+    def setUp(self):
+        self.client.credentials(HTTP_SECRET_KEY=sha256(settings.SECRET_KEY.encode()).hexdigest())
+        self.book = Book.objects.create(title='A', isbn='a')
+        BookSimilarity.objects.create(
+            book=self.book, similar_ids=[3, 2, 4], scores=[0.9, 0.5, 0.1], computed_time=timezone.now()
+        )
+
+    def get_ids(self, **params):
+        response = self.client.get(f'/books/{self.book.pk}/similar/', params)
+        self.assertEqual(response.status_code, 200)
+        return [result['id'] for result in response.data['results']]
+
+    def test_best_first(self):
+        self.assertEqual(self.get_ids(), [3, 2, 4])
+
+    def test_limit(self):
+        self.assertEqual(self.get_ids(limit=2), [3, 2])
+        self.assertEqual(self.get_ids(limit=0), [])
+        self.assertEqual(self.get_ids(limit=-1), [])
+
+    def test_not_built(self):
+        other = Book.objects.create(title='B', isbn='b')
+        response = self.client.get(f'/books/{other.pk}/similar/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['results'], [])
+        self.assertEqual(self.client.get('/books/999999/similar/').status_code, 404)
+
+
+class CommentPartitionTests(TestCase):
+    """ updates and deletes of a comment filter by its book, so that one partition is scanned """
+
+    def setUp(self):
+        self.book = Book.objects.create(title='A', isbn='a')
+        self.other = Book.objects.create(title='B', isbn='b')
+        self.comment = BookComment.objects.create(book=self.book, user_id='u1', content='text')
+
+    def get_statements(self, func, verb):
+        with CaptureQueriesContext(connection) as queries:
+            func()
+        return [query['sql'] for query in queries.captured_queries if query['sql'].startswith(verb)]
+
+    def test_update(self):
+        comment = BookComment.objects.get(pk=self.comment.pk)
+        comment.content = 'new'
+        updates = self.get_statements(comment.save, 'UPDATE')
+        self.assertEqual(len(updates), 1)
+        self.assertRegex(updates[0], rf'WHERE .*"book_id" = {self.book.pk}\b')
+        self.assertEqual(BookComment.objects.get(pk=comment.pk).content, 'new')
+
+    def test_update_after_create(self):
+        self.comment.content = 'new'
+        updates = self.get_statements(self.comment.save, 'UPDATE')
+        self.assertRegex(updates[0], rf'WHERE .*"book_id" = {self.book.pk}\b')
+
+    def test_move(self):
+        comment = BookComment.objects.get(pk=self.comment.pk)
+        comment.book = self.other
+        updates = self.get_statements(comment.save, 'UPDATE')
+        # found in the partition it is stored in
+        self.assertRegex(updates[0], rf'WHERE .*"book_id" = {self.book.pk}\b')
+        self.assertEqual(BookComment.objects.get(pk=comment.pk).book_id, self.other.pk)
+        comment.content = 'new'
+        updates = self.get_statements(comment.save, 'UPDATE')
+        self.assertRegex(updates[0], rf'WHERE .*"book_id" = {self.other.pk}\b')
+
+    def test_delete(self):
+        comment = BookComment.objects.get(pk=self.comment.pk)
+        deletes = self.get_statements(comment.delete, 'DELETE')
+        self.assertEqual(len(deletes), 1)
+        self.assertRegex(deletes[0], rf'WHERE .*"book_id" = {self.book.pk}\b')
+        self.assertFalse(BookComment.objects.filter(pk=self.comment.pk).exists())
+
+    def test_partition_comments_keeps_rows(self):
+        if connection.pg_version < 110000:
+            self.skipTest("Hash partitioning requires PostgreSQL 11+.")
+        BookComment.objects.create(book=self.other, user_id='u2', rating=Decimal('4.5'), content='more')
+        BookComment.objects.create(book=self.other, user_id='u3', is_deleted=True)
+        fields = ['id', 'book_id', 'user_id', 'rating', 'content', 'edited_time', 'is_deleted']
+        rows = list(BookComment.objects.order_by('id').values_list(*fields))
+
+        call_command('partition_comments', 'books.Book', partitions=4, batch_size=1, stdout=StringIO())
+        self.assertTrue(partitioning.is_partitioned(connection, BookComment._meta.db_table))
+        self.assertEqual(list(BookComment.objects.order_by('id').values_list(*fields)), rows)
+        # ids keep coming from the sequence
+        self.assertGreater(BookComment.objects.create(book=self.book, user_id='u4').pk, rows[-1][0])
+
+
+class DirtyFieldsTests(TestCase):
+    """ only changed columns are written, see `common.models.DirtyFieldsModel` """
+
+    def setUp(self):
+        book = Book.objects.create(title='A', isbn='a', author=['Lu Xun'], other={'tags': ['novel']})
+        self.book = Book.objects.get(pk=book.pk)
+
+    def get_updates(self, instance):
+        with CaptureQueriesContext(connection) as queries:
+            instance.save()
+        table = connection.ops.quote_name(instance._meta.db_table)
+        return [query['sql'] for query in queries.captured_queries if query['sql'].startswith(f'UPDATE {table} ')]
+
+    def get_set_clause(self, sql):
+        return sql[sql.index(' SET ') + 5:sql.index(' WHERE ')]
+
+    def test_no_change(self):
+        edited_time = self.book.edited_time
+        self.assertEqual(self.get_updates(self.book), [])
+        self.assertEqual(self.book.written_fields, [])
+        self.assertEqual(Book.objects.get(pk=self.book.pk).edited_time, edited_time)
+
+    def test_same_value_assigned(self):
+        self.book.title = 'A'
+        self.book.author = ['Lu Xun']
+        self.assertEqual(self.get_updates(self.book), [])
+
+    def test_changed_columns_only(self):
+        edited_time = self.book.edited_time
+        self.book.title = 'B'
+        updates = self.get_updates(self.book)
+        self.assertEqual(len(updates), 1)
+        columns = re.findall(r'"(\w+)" = ', self.get_set_clause(updates[0]))
+        self.assertEqual(sorted(columns), ['edited_time', 'title'])
+        self.assertEqual(sorted(self.book.written_fields), ['edited_time', 'title'])
+        book = Book.objects.get(pk=self.book.pk)
+        self.assertEqual(book.title, 'B')
+        self.assertGreater(book.edited_time, edited_time)
+
+    def test_saved_once(self):
+        self.book.title = 'B'
+        self.get_updates(self.book)
+        self.assertEqual(self.get_updates(self.book), [])
+
+    def test_changed_in_place(self):
+        self.book.author.append('Zhou Zuoren')
+        updates = self.get_updates(self.book)
+        self.assertEqual(len(updates), 1)
+        self.assertIn('"author" = ', self.get_set_clause(updates[0]))
+        self.assertEqual(Book.objects.get(pk=self.book.pk).author, ['Lu Xun', 'Zhou Zuoren'])
+
+        self.book.other['tags'].append('classic')
+        updates = self.get_updates(self.book)
+        self.assertEqual(len(updates), 1)
+        self.assertIn('"other" = ', self.get_set_clause(updates[0]))
+        self.assertEqual(Book.objects.get(pk=self.book.pk).other, {'tags': ['novel', 'classic']})
+
+    def test_refresh_from_db(self):
+        Book.objects.filter(pk=self.book.pk).update(title='C')
+        self.book.refresh_from_db()
+        self.assertEqual(self.book.title, 'C')
+        self.assertEqual(self.get_updates(self.book), [])
+
+        self.book.title = 'D'
+        self.book.refresh_from_db(fields=['title'])
+        self.assertEqual(self.get_updates(self.book), [])
+
+    def test_comment(self):
+        comment = BookComment.objects.create(book=self.book, user_id='u1', content='text')
+        comment = BookComment.objects.get(pk=comment.pk)
+        self.assertEqual(self.get_updates(comment), [])
+        comment.content = 'new'
+        updates = self.get_updates(comment)
+        self.assertEqual(len(updates), 1)
+        self.assertEqual(sorted(re.findall(r'"(\w+)" = ', self.get_set_clause(updates[0]))), ['content', 'edited_time'])
+        self.assertRegex(updates[0], rf'WHERE .*"book_id" = {self.book.pk}\b')
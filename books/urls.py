@@ -3,12 +3,28 @@ from .views import BookListCreate
 from .views import BookRetrieveUpdateDestroy
 from .views import BookCommentListCreate
 from .views import BookCommentRetrieveUpdateDestroy
+from .views import BookChangeFeed
+from .views import BookLeaderboard
+from .views import BookContributorList
+from .views import BookCommentChangeFeed
+from .views import BookCommentBulkCreate
+from .views import BookBulkUpdate
+from .views import BookSimilarList
+from .views import BookTrending
 
 
 app_name = 'books'
 urlpatterns = [
     path('', BookListCreate.as_view(), name="book_list_create"),
+    path('changes/', BookChangeFeed.as_view(), name="book_change_feed"),
+    path('bulk/', BookBulkUpdate.as_view(), name="book_bulk_update"),
+    path('top/', BookLeaderboard.as_view(), name="book_leaderboard"),
+    path('trending/', BookTrending.as_view(), name="book_trending"),
+    path('authors/', BookContributorList.as_view(), name="book_contributor_list"),
+    path('comments/changes/', BookCommentChangeFeed.as_view(), name="book_comment_change_feed"),
+    path('comments/bulk/', BookCommentBulkCreate.as_view(), name="book_comment_bulk_create"),
     path('<int:book_id>/', BookRetrieveUpdateDestroy.as_view(), name="book_retrieve_update_delete"),
+    path('<int:book_id>/similar/', BookSimilarList.as_view(), name="book_similar_list"),
     path('<int:book_id>/comments/', BookCommentListCreate.as_view(), name="book_comment_list_create"),
     path('<int:book_id>/comments/<int:comment_id>/', BookCommentRetrieveUpdateDestroy.as_view(), name="book_retrieve_update_delete"),
 ]
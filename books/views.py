@@ -1,40 +1,197 @@
 import re
+from collections import Counter
+from datetime import date
+from decimal import Decimal, InvalidOperation
 from core import views
 from common.views import *
-from .models import Book, BookComment
-from .serializers import BookSerializer, BookCommentSerializer
-from django.db.models import Q
-from django.core.exceptions import ObjectDoesNotExist
-from rest_framework.exceptions import ParseError
+from .facets import get_facets, parse_facets
+from .isbn import canonical_isbn, to_isbn13
+from .models import (
+    Book, BookComment, BookSimilarity, Contributor, get_contributors, get_pub_date, normalize_name,
+    update_contributors
+)
+from .search import SearchResult, get_search_key, get_search_result
+from .serializers import BookSerializer, BookCommentSerializer, ContributorSerializer
+from common.cache import bump_generation, can_fill, is_shared
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.contrib.postgres import fields as postgres
+from django.db.models import CharField, F, Func, Q, Subquery
+from django.http import Http404
+from django.utils import timezone
+from rest_framework import generics
+from rest_framework import status
+from rest_framework.exceptions import ParseError, ValidationError
+from rest_framework.response import Response
+from rest_framework.reverse import reverse
 
 
 class BookListCreate(views.ListCreateView):
     serializer_class = BookSerializer
+    # fields accepted by query string param `ordering`
+    ordering_fields = ['comments_count', 'pub_date', 'rating', 'weighted_rating']
+
+    def list(self, request, *args, **kwargs):
+        """
+        Pages and validators are served from the cached search result, see `books.search`,
+        so repeated searches don't scan the book table. The queryset runs no query
+        until it is evaluated, so a cache hit costs one cache read and the page.
+        Attach facet counts of the filtered books when `facets` is specified.
+        """
+        queryset = self.get_queryset().filter(is_deleted=False)
+        if not queryset.ordered:
+            queryset = queryset.order_by('id')
+        spec = self.get_search_spec()
+        if is_shared():
+            books = SearchResult(queryset, get_search_result(queryset, spec))
+        else:
+            # generations are per process, cached results would outlive writes of other processes
+            books = queryset
+
+        page = self.paginate_queryset(books)
+        etag, last_modified = self.get_list_validators(Book, page, self.paginator.page.paginator.count)
+        not_modified = self.evaluate_preconditions(request, etag, last_modified)
+        if not_modified is not None:
+            return not_modified
+
+        serializer = self.get_serializer(page, many=True)
+        response = self.get_paginated_response(serializer.data)
+        views.set_validator_headers(response, etag, last_modified)
+
+        facets = dict((k.lower(), v) for k, v in request.query_params.items()).get('facets')
+        if facets:
+            response.data['facets'] = self.get_facets(queryset, spec, facets)
+        return response
+
+    def get_facets(self, queryset, spec, value):
+        """
+        Facet counts are cached by canonical filter spec for `FACET_CACHE_TIMEOUT` seconds,
+        and invalidated by book writes, with a shared cache backend only.
+        Counts read from a replica are not cached.
+        """
+        try:
+            names = parse_facets(value)
+        except ValueError as e:
+            raise ParseError({'detail': f"Unknown facet `{e}`."})
+        if not is_shared():
+            return get_facets(queryset, names)
+        key = get_search_key('book_facets', Book, (spec[0], names))
+        facets = cache.get(key)
+        if facets is None:
+            facets = get_facets(queryset, names)
+            if can_fill():
+                cache.set(key, facets, getattr(settings, 'FACET_CACHE_TIMEOUT', 60))
+        return facets
 
     def create(self, request, *args, **kwargs):
         """
         Handle isbn unique constraint.
         """
         assert 'isbn' in request.data, "isbn not in create book post."
-        try:
-            former_book = Book.objects.get(isbn=request.data['isbn'])
-            if former_book.is_deleted:
-                msg = f"Book with the same isbn `{former_book.isbn}` already" + \
-                "exists in the database, but it is marked as deleted. You must" + \
-                "delete the old one with `hard=ture` first."
-                raise ParseError({'detail': msg})
-        except ObjectDoesNotExist:
-            pass
+        # any form of the isbn, e.g. ISBN-10 or hyphenated, is the same book
+        former_book = Book.objects.by_isbn(request.data['isbn']).first()
+        if former_book is not None and former_book.is_deleted:
+            msg = f"Book with the same isbn `{former_book.isbn}` already" + \
+            "exists in the database, but it is marked as deleted. You must" + \
+            "delete the old one with `hard=ture` first."
+            raise ParseError({'detail': msg})
         return super().create(request, *args, **kwargs)
 
+    def get_search_spec(self):
+        """ canonical filter spec and ordering of the request, as cache key """
+        value = dict((k.lower(), v) for k, v in self.request.query_params.items()).get('ordering')
+        ordering = tuple(field.strip() for field in value.split(',')) if value else ()
+        return self.get_filter_spec(), ordering
+
+    def get_filter_spec(self):
+        """
+        Canonical form of filter params, a sorted tuple of (name, value).
+        Searches matching the same books have the same spec regardless of
+        param order, keyword order, case and whitespace.
+        Parsed once per request.
+        """
+        if getattr(self, '_filter_spec', None) is not None:
+            return self._filter_spec
+        def keywords(value):
+            return tuple(sorted(set(value.lower().split()))) or None
+
+        def isbn(value):
+            try:
+                return ('isbn13', to_isbn13(value))
+            except ValueError:
+                return ('isbn', value)
+
+        def parse_pub_month(value):
+            """ parse `%Y-%m` or `%Y` into (year, month) """
+            numbers = [int(number) for number in re.findall(r'\d+', value)]
+            if len(numbers) > 2:
+                raise ParseError({'detail': "Wrong format."})
+            elif len(numbers) == 0:
+                return None
+            year = numbers[0]
+            month = numbers[1] if len(numbers) == 2 else None
+            if not 1 <= year <= 9999 or (month is not None and not 1 <= month <= 12):
+                raise ParseError({'detail': "Wrong format."})
+            return year, month
+
+        def parse_rating(value):
+            try:
+                rating = Decimal(value.strip())
+            except InvalidOperation:
+                raise ParseError({'detail': "Wrong format."})
+            if not rating.is_finite():
+                raise ParseError({'detail': "Wrong format."})
+            return rating.normalize()
+
+        def parse_int(value):
+            try:
+                return int(value)
+            except ValueError:
+                raise ParseError({'detail': "Wrong format."})
+
+        def contributor_prefix(value):
+            """ a short prefix would expand to most of the contributor table """
+            prefix = normalize_name(value)
+            min_length = getattr(settings, 'CONTRIBUTOR_PREFIX_MIN_LENGTH', 2)
+            if len(prefix) < min_length:
+                raise ParseError({'detail': f"Author and translator need at least {min_length} characters."})
+            return prefix
+
+        canonical = {
+            'title': keywords,
+            'author': contributor_prefix,
+            'translator': contributor_prefix,
+            'author_exact': str,
+            'translator_exact': str,
+            'pub_house': str.lower,
+            'after': parse_pub_month,
+            'before': parse_pub_month,
+            'isbn': isbn,
+            'higher_than': parse_rating,
+            'lower_than': parse_rating,
+            'min_comments': parse_int,
+            'max_comments': parse_int,
+        }
+
+        # undefined query params will be ignored
+        query_params = dict((k.lower(), v) for k, v in self.request.query_params.items())
+        spec = []
+        for k, v in query_params.items():
+            if k in canonical:
+                value = canonical[k](v)
+                if value is not None:
+                    spec.append((k, value))
+        self._filter_spec = tuple(sorted(spec))
+        return self._filter_spec
+
     def get_queryset(self):
         """
-        filter objects according to query string.
+        filter objects according to the filter spec of query string.
         pagination is handled in `self.list()`
         """
-        def title(value, query_args):
+        def title(keywords, query_args):
             q = Q()
-            keywords = value.split()
             for keyword in keywords:
                 q = q | Q(title__icontains=keyword)
                 q = q | Q(subtitle__istartswith=keyword)
@@ -42,48 +199,54 @@ class BookListCreate(views.ListCreateView):
             query_args.append(q)
 
         def author(value, query_args):
-            query_args.append(Q(author__icontains=value))
+            query_args.append(Q(author__overlap=contributor_names('author', value)))
 
         def translator(value, query_args):
-            query_args.append(Q(translator__icontains=value))
+            query_args.append(Q(translator__overlap=contributor_names('translator', value)))
+
+        def author_exact(value, query_args):
+            query_args.append(Q(author__contains=[value]))
+
+        def translator_exact(value, query_args):
+            query_args.append(Q(translator__contains=[value]))
+
+        def contributor_names(role, normalized_name):
+            """
+            names starting with value ignoring case and whitespace, resolved from index
+            by a subquery, so that nothing is queried until the books are.
+            At most `CONTRIBUTOR_PREFIX_MAX_NAMES` names with the most books are matched.
+            """
+            names = Contributor.objects.filter(
+                role=role,
+                normalized_name__startswith=normalized_name,
+            ).order_by('-book_count', 'name').values('name')
+            names = names[:getattr(settings, 'CONTRIBUTOR_PREFIX_MAX_NAMES', 1000)]
+            return Func(Subquery(names), function='ARRAY', output_field=postgres.ArrayField(CharField()))
 
         def pub_house(value, query_args):
             query_args.append(Q(pub_house__icontains=value))
 
-        def after(value, query_args):
-            """ publishing date lower bound """
-            numbers = re.findall(r'\d+', value)
-            if len(numbers) > 2:
-                raise ParseError({'detail': "Wrong format."})
-            elif len(numbers) == 2:
-                # year less than month
-                if numbers[0] < numbers[1]:
-                    raise ParseError({'detail': "Wrong format."})
-                query_args.append(
-                    Q(pub_year__gte=numbers[0]) &\
-                    ~( Q(pub_year=numbers[0]) & Q(pub_month__lte=numbers[1]) )
-                )
-            elif len(numbers) == 1:
-                query_args.append(Q(pub_year__gte=numbers[0]))
-
-        def before(value, query_args):
-            """ publishing date upper bound """
-            numbers = re.findall(r'\d+', value)
-            if len(numbers) > 2:
-                raise ParseError({'detail': "Wrong format."})
-            elif len(numbers) == 2:
-                # year less than month
-                if numbers[0] < numbers[1]:
-                    raise ParseError({'detail': "Wrong format."})
-                query_args.append(
-                    Q(pub_year__lte=numbers[0]) &\
-                    ~( Q(pub_year=numbers[0]) & Q(pub_month__gte=numbers[1]) )
-                )
-            elif len(numbers) == 1:
-                query_args.append(Q(pub_year__lte=numbers[0]))
+        def after(bound, query_args):
+            """ publishing date lower bound, exclusive when month is specified """
+            year, month = bound
+            if month is None:
+                query_args.append(Q(pub_date__gte=date(year, 1, 1)))
+            elif month == 12:
+                query_args.append(Q(pub_date__gt=date(year, 12, 1)))
+            else:
+                query_args.append(Q(pub_date__gte=date(year, month + 1, 1)))
+
+        def before(bound, query_args):
+            """ publishing date upper bound, exclusive when month is specified """
+            year, month = bound
+            if month is None:
+                query_args.append(Q(pub_date__lte=date(year, 12, 1)))
+            else:
+                query_args.append(Q(pub_date__lt=date(year, month, 1)))
 
         def isbn(value, query_args):
-            query_args.append(Q(isbn=value))
+            field, value = value
+            query_args.append(Q(**{field: value}))
 
         def higher_than(value, query_args):
             """ rating lower bound """
@@ -94,30 +257,69 @@ class BookListCreate(views.ListCreateView):
             """ rating upper bound """
             query_args.append(Q(rating__lte=value))
 
+        def min_comments(value, query_args):
+            """ comments count lower bound """
+            query_args.append(Q(comments_count__gte=value))
+
+        def max_comments(value, query_args):
+            """ comments count upper bound """
+            query_args.append(Q(comments_count__lte=value))
+
         handler = {
             'title': title,
             'author': author,
             'translator': translator,
+            'author_exact': author_exact,
+            'translator_exact': translator_exact,
             'pub_house': pub_house,
             'after': after,
             'before': before,
             'isbn': isbn,
             'higher_than': higher_than,
             'lower_than': lower_than,
+            'min_comments': min_comments,
+            'max_comments': max_comments,
         }
 
-        # undefined query params will be ignored
-        query_params = dict((k.lower(), v) for k, v in self.request.query_params.items())
         query_args = []
-        for k, v in query_params.items():
-            if k in handler:
-                handler[k](v, query_args)
+        for k, v in self.get_filter_spec():
+            handler[k](v, query_args)
 
         queryset = Book.objects.filter(*query_args)
+        query_params = dict((k.lower(), v) for k, v in self.request.query_params.items())
+        ordering = self.get_ordering(query_params.get('ordering'))
+        if ordering:
+            queryset = queryset.order_by(*ordering)
         return queryset
 
+    def get_ordering(self, value):
+        """
+        Parse `ordering` like `-comments_count,id`,
+        `id` is appended to make pagination stable.
+        Null values are always put last.
+        """
+        if not value:
+            return []
+        ordering = []
+        names = []
+        for field in value.split(','):
+            field = field.strip()
+            name = field.lstrip('-')
+            if name not in self.ordering_fields + ['id']:
+                raise ParseError({'detail': f"Can't order by `{field}`."})
+            if not field.startswith('-'):
+                ordering.append(F(name).asc())
+            elif Book._meta.get_field(name).null:
+                ordering.append(F(name).desc(nulls_last=True))
+            else:
+                ordering.append(F(name).desc())
+            names.append(name)
+        if 'id' not in names:
+            ordering.append(F('id').asc())
+        return ordering
 
-class BookRetrieveUpdateDestroy(UpdateLocalFileMixin ,views.RetrieveUpdateDestroyView):
+
+class BookRetrieveUpdateDestroy(UpdateLocalFileMixin, ExactRatingMixin, views.RetrieveUpdateDestroyView):
     """
     It is strongly recommended delete book object with `hard=true`
     """
@@ -127,6 +329,259 @@ class BookRetrieveUpdateDestroy(UpdateLocalFileMixin ,views.RetrieveUpdateDestro
     file_fields = 'cover'
 
 
+class BookBulkUpdate(generics.GenericAPIView):
+    """
+    Patch many books in one request, see `bulk_update_books`.
+    Request body is a list of `{"id": id, "changes": {...}}`.
+    """
+    queryset = Book.objects.filter(is_deleted=False)
+    serializer_class = BookSerializer
+    max_items = 5000
+
+    def patch(self, request, *args, **kwargs):
+        if not isinstance(request.data, list):
+            raise ValidationError({'detail': "Expected a list of changes."})
+        if len(request.data) > self.max_items:
+            raise ValidationError({'detail': f"At most {self.max_items} books in one request."})
+        results = bulk_update_books(self.get_queryset(), request.data, self.get_serializer_context())
+        updated = sum(1 for result in results if 'errors' not in result)
+        code = status.HTTP_200_OK if updated == len(results) else status.HTTP_207_MULTI_STATUS
+        return Response({'updated': updated, 'results': results}, status=code)
+
+
+def bulk_update_books(queryset, items, serializer_context, batch_size=1000):
+    """
+    Validate each item with `BookSerializer` in partial mode and write the valid
+    ones in one transaction, with one `bulk_update` per set of changed fields.
+    Derived fields and contributor counts are maintained like `Book.save()`,
+    and `edited_time` of changed books is bumped.
+    Return a result for each item, `{'index': i, 'id': pk, 'fields': [...]}` when valid,
+    or `{'index': i, 'id': pk, 'errors': {...}}` when rejected.
+    """
+    results = {}
+    changes = {}
+    requested = set()
+    for index, item in enumerate(items):
+        if not isinstance(item, dict) or not isinstance(item.get('changes'), dict):
+            results[index] = {'index': index, 'errors': {'detail': "Item must be an object with `id` and `changes`."}}
+            continue
+        pk = item.get('id')
+        if type(pk) is not int:
+            results[index] = {'index': index, 'errors': {'id': ["A valid integer is required."]}}
+        elif 'cover' in item['changes']:
+            results[index] = {'index': index, 'id': pk, 'errors': {'cover': ["Cover can't be changed in bulk."]}}
+        elif pk in requested:
+            results[index] = {'index': index, 'id': pk, 'errors': {'id': ["Duplicated book in the request."]}}
+        else:
+            requested.add(pk)
+            changes[index] = (pk, item['changes'])
+
+    now = timezone.now()
+    groups = {}
+    contributor_changes = Counter()
+    taken_isbn13 = set()
+    with transaction.atomic():
+        # lock in pk order, like the comment writes that lock books
+        books = {
+            book.pk: book
+            for book in queryset.select_for_update().filter(pk__in=[pk for pk, _ in changes.values()]).order_by('pk')
+        }
+        for index, (pk, data) in changes.items():
+            book = books.get(pk)
+            if book is None:
+                results[index] = {'index': index, 'id': pk, 'errors': {'id': ["Not found."]}}
+                continue
+            serializer = BookSerializer(book, data=data, partial=True, context=serializer_context)
+            if not serializer.is_valid():
+                results[index] = {'index': index, 'id': pk, 'errors': serializer.errors}
+                continue
+            # validated one by one, so isbn has to be unique among the items as well
+            if 'isbn' in serializer.validated_data:
+                isbn13 = canonical_isbn(serializer.validated_data['isbn'])
+                if isbn13 in taken_isbn13:
+                    results[index] = {
+                        'index': index, 'id': pk, 'errors': {'isbn': ["Book with this ISBN already exists."]}
+                    }
+                    continue
+                taken_isbn13.add(isbn13)
+
+            for attr, value in serializer.validated_data.items():
+                setattr(book, attr, value)
+            for attr, value in derive_book_fields(book).items():
+                setattr(book, attr, value)
+            fields = book.get_dirty_fields()
+            if 'isbn13' in fields and book.isbn13 is not None and (
+                Book.objects.filter(isbn13=book.isbn13).exclude(pk=pk).exists()
+            ):
+                # a book not backfilled yet may collide even with its isbn unchanged
+                results[index] = {
+                    'index': index, 'id': pk, 'errors': {'isbn': ["Book with this ISBN already exists."]}
+                }
+                continue
+            results[index] = {'index': index, 'id': pk, 'fields': sorted(fields)}
+            if not fields:
+                continue
+
+            saved_contributors = book.get_saved_contributors()
+            contributors = get_contributors(book.author, book.translator, book.is_deleted)
+            contributor_changes.update({key: 1 for key in contributors - saved_contributors})
+            contributor_changes.update({key: -1 for key in saved_contributors - contributors})
+            book.edited_time = now
+            groups.setdefault(frozenset(fields) | {'edited_time'}, []).append(book)
+
+        for fields, group in groups.items():
+            Book.objects.bulk_update(group, sorted(fields), batch_size=batch_size)
+            for book in group:
+                book.reset_dirty_fields()
+        update_contributors(contributor_changes)
+        if groups:
+            bump_generation(Book)
+
+    return [results[index] for index in sorted(results)]
+
+
+def derive_book_fields(book):
+    """ values of fields derived on `Book.save()` """
+    rating, weighted_rating = book.rating, book.weighted_rating
+    book.update_rating()
+    derived = {
+        'pub_date': get_pub_date(book.pub_year, book.pub_month),
+        'isbn13': canonical_isbn(book.isbn),
+        'rating': book.rating,
+        'weighted_rating': book.weighted_rating,
+    }
+    book.rating, book.weighted_rating = rating, weighted_rating
+    return derived
+
+
+class BookLeaderboard(generics.GenericAPIView):
+    """
+    Top rated books ranked by `weighted_rating`, overall or in one language.
+    Only ids and scores are read, so the partial indexes on `weighted_rating`
+    can serve it with an index-only scan.
+    """
+    queryset = Book.objects.filter(is_deleted=False, weighted_rating__isnull=False)
+    default_limit = 100
+    max_limit = 1000
+
+    def get(self, request, *args, **kwargs):
+        cleaned_params = dict((k.lower(), v) for k, v in request.query_params.items())
+        queryset = self.get_queryset()
+
+        language = cleaned_params.get('language')
+        if language is not None:
+            if language not in dict(Book.LANGUAGE_CHOICE):
+                raise ParseError({'detail': f"Unknown language `{language}`."})
+            queryset = queryset.filter(language=language)
+        try:
+            limit = int(cleaned_params.get('limit', self.default_limit))
+        except ValueError:
+            raise ParseError({'detail': "`limit` must be an integer."})
+        if limit < 1:
+            raise ParseError({'detail': "`limit` must be positive."})
+        limit = min(limit, self.max_limit)
+
+        ranking = queryset.order_by('-weighted_rating', 'id').values_list('id', 'weighted_rating')[:limit]
+        results = [
+            {
+                'id': pk,
+                'weighted_rating': weighted_rating,
+                'url': reverse('books:book_retrieve_update_delete', kwargs={'book_id': pk}, request=request),
+            }
+            for pk, weighted_rating in ranking
+        ]
+        return Response({'language': language, 'results': results})
+
+
+class BookTrending(generics.GenericAPIView):
+    """
+    Books with the most comment activity lately, ranked by `trending_score`,
+    which decays over time, see `common.trending`. Read from its partial index.
+    """
+    queryset = Book.objects.filter(is_deleted=False, trending_score__isnull=False)
+    default_limit = 100
+    max_limit = 1000
+
+    def get(self, request, *args, **kwargs):
+        cleaned_params = dict((k.lower(), v) for k, v in request.query_params.items())
+        try:
+            limit = int(cleaned_params.get('limit', self.default_limit))
+        except ValueError:
+            raise ParseError({'detail': "`limit` must be an integer."})
+        if limit < 1:
+            raise ParseError({'detail': "`limit` must be positive."})
+        limit = min(limit, self.max_limit)
+
+        ranking = self.get_queryset().order_by('-trending_score', 'id').values_list('id', 'trending_score')[:limit]
+        results = [
+            {
+                'id': pk,
+                'trending_score': trending_score,
+                'url': reverse('books:book_retrieve_update_delete', kwargs={'book_id': pk}, request=request),
+            }
+            for pk, trending_score in ranking
+        ]
+        return Response({'results': results})
+
+
+class BookSimilarList(generics.GenericAPIView):
+    """
+    Books rated alike by the same readers, most similar first.
+    Read from the precomputed row of the book, built by command `build_similar_books`.
+    """
+    queryset = BookSimilarity.objects.all()
+    lookup_url_kwarg = 'book_id'
+    default_limit = 20
+
+    def get(self, request, *args, **kwargs):
+        cleaned_params = dict((k.lower(), v) for k, v in request.query_params.items())
+        try:
+            limit = int(cleaned_params.get('limit', self.default_limit))
+        except ValueError:
+            raise ParseError({'detail': "`limit` must be an integer."})
+
+        book_id = self.kwargs[self.lookup_url_kwarg]
+        row = self.get_queryset().filter(book_id=book_id).values_list('similar_ids', 'scores').first()
+        if row is None:
+            if not Book.objects.filter(pk=book_id, is_deleted=False).exists():
+                raise Http404
+            row = ([], [])
+        results = [
+            {
+                'id': pk,
+                'score': score,
+                'url': reverse('books:book_retrieve_update_delete', kwargs={'book_id': pk}, request=request),
+            }
+            for pk, score in list(zip(*row))[:max(limit, 0)]
+        ]
+        return Response({'id': book_id, 'results': results})
+
+
+class BookContributorList(generics.ListAPIView):
+    """
+    Distinct authors or translators with their book counts,
+    read from `Contributor` instead of scanning books.
+    """
+    serializer_class = ContributorSerializer
+
+    def get_queryset(self):
+        cleaned_params = dict((k.lower(), v) for k, v in self.request.query_params.items())
+        role = cleaned_params.get('role', 'author')
+        if role not in dict(Contributor.ROLE_CHOICE):
+            raise ParseError({'detail': f"Unknown role `{role}`."})
+        queryset = Contributor.objects.filter(role=role, book_count__gt=0)
+        prefix = cleaned_params.get('prefix')
+        if prefix:
+            queryset = queryset.filter(normalized_name__startswith=normalize_name(prefix))
+            return queryset.order_by('normalized_name', 'id')
+        return queryset.order_by('-book_count', 'id')
+
+
+class BookChangeFeed(views.ChangeFeedView):
+    queryset = Book.objects.all()
+    serializer_class = BookSerializer
+
+
 # book comment classes
 class BookCommentListCreate(CommentListCreateView):
     queryset = BookComment.objects.all()
@@ -139,3 +594,13 @@ class BookCommentRetrieveUpdateDestroy(CommentRetrieveUpdateDestroyView):
     serializer_class = BookCommentSerializer
     lookup_url_kwarg = 'comment_id'
     resource_name = 'book'
+
+
+class BookCommentBulkCreate(CommentBulkCreateView):
+    queryset = BookComment.objects.all()
+    resource_name = 'book'
+
+
+class BookCommentChangeFeed(views.ChangeFeedView):
+    queryset = BookComment.objects.all()
+    serializer_class = BookCommentSerializer
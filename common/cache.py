@@ -0,0 +1,54 @@
+"""
+Generation counters of models, for caches derived from many rows.
+Cache keys built with the current generation of a model are abandoned at once
+when it is bumped by a write, instead of being deleted one by one.
+A bump is only seen by the processes sharing the cache backend, so caches relying
+on generations must check `is_shared()`, and are off with per-process backends.
+They are filled only by `can_fill()` requests, rows read from a lagging replica
+may predate a write whose generation bump is already visible.
+"""
+
+import time
+from django.core.cache import cache, caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import transaction
+from core import routers
+
+
+def is_shared():
+    """ whether the default cache backend is shared by all processes """
+    return not isinstance(caches['default'], (LocMemCache, DummyCache))
+
+
+def can_fill():
+    """ whether rows read by the current thread may be cached, only those read from the primary """
+    return not routers.replicas_enabled()
+
+
+def generation_key(model):
+    return f'generation:{model._meta.label_lower}'
+
+
+def get_generation(model):
+    generation = cache.get(generation_key(model))
+    if generation is None:
+        # start from the current time rather than 1, so that keys built before
+        # the counter was evicted are not reused
+        cache.add(generation_key(model), int(time.time() * 1000), None)
+        generation = cache.get(generation_key(model), 0)
+    return generation
+
+
+def bump_generation(model):
+    """
+    Bump the generation once the current transaction commits,
+    so that no reader caches rows not yet committed under the new generation.
+    """
+    def bump():
+        try:
+            cache.incr(generation_key(model))
+        except ValueError:
+            # evicted, a fresh start invalidates as well
+            get_generation(model)
+    transaction.on_commit(bump)
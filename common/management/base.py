@@ -0,0 +1,30 @@
+from django.apps import apps
+from django.core.management.base import BaseCommand, CommandError
+from common.models import Resource, get_resource_models
+
+
+class ResourceCommand(BaseCommand):
+    """
+    Command working on resource models given as positional arguments,
+    all resource models by default.
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'models', nargs='*',
+            help="Resource models as `app_label.ModelName`, all resource models by default."
+        )
+
+    def get_models(self, options):
+        if not options['models']:
+            return get_resource_models()
+        models = []
+        for label in options['models']:
+            try:
+                model = apps.get_model(label)
+            except (LookupError, ValueError):
+                raise CommandError(f"Unknown model `{label}`.")
+            if not issubclass(model, Resource):
+                raise CommandError(f"`{model._meta.label}` is not a resource model.")
+            models.append(model)
+        return models
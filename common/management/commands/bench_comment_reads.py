@@ -0,0 +1,60 @@
+import random
+import time
+from django.core.management.base import CommandError
+from django.db import connections, router
+from common.management.base import ResourceCommand
+
+
+class Command(ResourceCommand):
+    help = (
+        "Time reads of the comments of one resource, like a comment list page, "
+        "and show the partitions scanned. Run it before and after `partition_comments`."
+    )
+
+    def add_arguments(self, parser):
+        super().add_arguments(parser)
+        parser.add_argument('--requests', type=int, default=1000)
+        parser.add_argument('--page-size', type=int, default=100)
+        parser.add_argument('--seed', type=int, default=0, help="Same seed reads the same resources.")
+
+    def handle(self, *args, **options):
+        for model in self.get_models(options):
+            relation = model._meta.get_field('comments')
+            comment_model = relation.related_model
+            fk_name = relation.field.name
+            manager = comment_model._default_manager
+
+            resource_ids = list(
+                manager.filter(is_deleted=False).values_list(fk_name, flat=True)
+                .distinct().order_by(fk_name)[:100000]
+            )
+            if not resource_ids:
+                raise CommandError(f"No comment of `{model._meta.label}`.")
+            rng = random.Random(options['seed'])
+            picked = [rng.choice(resource_ids) for _ in range(options['requests'])]
+
+            def page(pk):
+                return manager.filter(**{fk_name: pk, 'is_deleted': False}).order_by('pk')[:options['page_size']]
+
+            connection = connections[router.db_for_read(comment_model)]
+            with connection.cursor() as cursor:
+                sql, params = page(picked[0]).query.sql_with_params()
+                cursor.execute(f"EXPLAIN {sql}", params)
+                plan = [row[0] for row in cursor.fetchall()]
+            scans = [line.strip() for line in plan if ' on ' in line and 'Scan' in line]
+
+            samples = []
+            for pk in picked:
+                started = time.perf_counter()
+                list(page(pk))
+                samples.append(time.perf_counter() - started)
+            samples.sort()
+            self.stdout.write(f"{comment_model._meta.db_table}: {len(scans)} scans in plan")
+            for scan in scans:
+                self.stdout.write(f"  {scan}")
+            self.stdout.write(
+                f"  {len(samples)} reads, "
+                f"p50 {samples[len(samples) // 2] * 1000:.2f} ms, "
+                f"p99 {samples[min(len(samples) - 1, len(samples) * 99 // 100)] * 1000:.2f} ms, "
+                f"total {sum(samples):.2f} s"
+            )
@@ -0,0 +1,54 @@
+import math
+from collections import defaultdict
+from django.db import transaction
+from common.management.base import ResourceCommand
+from common.models import ActivityBucket
+from common.trending import add_scores, get_activity_score, get_window_start
+
+
+class Command(ResourceCommand):
+    help = (
+        "Drop activity buckets older than `TRENDING_WINDOW_HOURS` and recompute `trending_score` "
+        "of resources from the rest, so resources without recent activity leave the trending list. "
+        "Run it hourly or so, and after changing `TRENDING_HALF_LIFE_HOURS`."
+    )
+
+    def add_arguments(self, parser):
+        super().add_arguments(parser)
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        window_start = get_window_start()
+        for model in self.get_models(options):
+            buckets = ActivityBucket.objects.filter(resource_type=model._meta.label_lower)
+            dropped, _ = buckets.filter(hour__lt=window_start).delete()
+
+            manager = model._default_manager
+            pks = set(manager.filter(trending_score__isnull=False).values_list('pk', flat=True))
+            pks.update(buckets.values_list('resource_id', flat=True).distinct())
+            pks = sorted(pks)
+            changed = 0
+            for start in range(0, len(pks), options['batch_size']):
+                changed += self.recompute(model, buckets, pks[start:start + options['batch_size']])
+            self.stdout.write(f"{model._meta.label}: {dropped} buckets dropped, {changed} scores changed.")
+
+    def recompute(self, model, buckets, pks):
+        """ recompute scores of a batch of resources, return how many changed """
+        with transaction.atomic():
+            # lock in pk order, buckets are added by comment writes holding the same locks
+            resources = list(model._default_manager.select_for_update().filter(pk__in=pks).order_by('pk'))
+            scores = defaultdict(list)
+            for resource_id, hour, count in buckets.filter(resource_id__in=pks).values_list(
+                'resource_id', 'hour', 'count'
+            ):
+                scores[resource_id].append(get_activity_score(count, hour))
+            changed = []
+            for resource in resources:
+                score = add_scores(*scores.get(resource.pk, ()))
+                if (score is None) != (resource.trending_score is None) or (
+                    score is not None and not math.isclose(score, resource.trending_score, rel_tol=1e-9)
+                ):
+                    resource.trending_score = score
+                    changed.append(resource)
+            model._default_manager.bulk_update(changed, ['trending_score'])
+        return len(changed)
@@ -0,0 +1,82 @@
+import time
+from collections import Counter, defaultdict
+from django.apps import apps
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+from common.cache import bump_generation
+from common.models import RatingDelta
+from common.trending import get_hour
+
+
+class Command(BaseCommand):
+    help = (
+        "Fold rating deltas appended by comment writes into comments count and rating of "
+        "resources, when `COALESCE_RATING_UPDATES` is on. Run it with `--interval` to keep "
+        "flushing, which bounds how stale ratings are. Several flushers may run at once."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=10000)
+        parser.add_argument(
+            '--interval', type=float, default=None,
+            help="Keep flushing every this many seconds instead of exiting when nothing is left."
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            flushed = 0
+            while True:
+                count = self.flush(options['batch_size'])
+                flushed += count
+                if count < options['batch_size']:
+                    break
+            if options['interval'] is None:
+                self.stdout.write(f"{flushed} deltas flushed.")
+                return
+            time.sleep(options['interval'])
+
+    def flush(self, batch_size):
+        """ fold one batch of deltas, return how many """
+        with transaction.atomic():
+            # rows taken by another flusher are skipped, not waited for
+            deltas = list(
+                RatingDelta.objects.select_for_update(skip_locked=True).order_by('id')[:batch_size]
+            )
+            if not deltas:
+                return 0
+            totals = defaultdict(lambda: defaultdict(lambda: [0, 0, 0]))
+            # every delta is one comment write, counted in the hour it's appended
+            activity = defaultdict(lambda: defaultdict(Counter))
+            for delta in deltas:
+                total = totals[delta.resource_type][delta.resource_id]
+                total[0] += delta.comments_count
+                total[1] += delta.rating_number
+                total[2] += delta.rating_total_score
+                activity[delta.resource_type][delta.resource_id][get_hour(delta.created_time)] += 1
+
+            now = timezone.now()
+            for resource_type, resource_totals in totals.items():
+                model = apps.get_model(resource_type)
+                # lock in pk order, the same rows are locked by single comment writes
+                resources = model._default_manager.select_for_update().filter(
+                    pk__in=list(resource_totals)
+                ).order_by('pk')
+                changed = []
+                for resource in resources:
+                    resource.apply_delta(*resource_totals[resource.pk])
+                    for hour, count in activity[resource_type][resource.pk].items():
+                        resource.record_activity(count, hour)
+                    resource.edited_time = now
+                    changed.append(resource)
+                model._default_manager.bulk_update(
+                    changed,
+                    [
+                        'comments_count', 'rating_number', 'rating_total_score', 'rating', 'weighted_rating',
+                        'trending_score', 'edited_time',
+                    ],
+                    batch_size=1000,
+                )
+                bump_generation(model)
+            RatingDelta.objects.filter(pk__in=[delta.pk for delta in deltas]).delete()
+        return len(deltas)
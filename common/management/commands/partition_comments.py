@@ -0,0 +1,69 @@
+from django.core.management.base import CommandError
+from django.db import connections, router, transaction
+from django.db.models import Max
+from common import partitioning
+from common.management.base import ResourceCommand
+
+
+class Command(ResourceCommand):
+    help = (
+        "Convert comment tables of resources into tables hash partitioned by resource id, "
+        "copying existing rows. Writes are blocked only while the tables are swapped. "
+        "Requires PostgreSQL 11+."
+    )
+
+    def add_arguments(self, parser):
+        super().add_arguments(parser)
+        parser.add_argument('--partitions', type=int, default=16)
+        parser.add_argument('--batch-size', type=int, default=100000)
+        parser.add_argument(
+            '--sql', action='store_true',
+            help="Only print the statements creating the partitioned copy of the table, for review.",
+        )
+        parser.add_argument('--drop-old', action='store_true', help="Drop the original table after swapping.")
+
+    def handle(self, *args, **options):
+        if options['partitions'] < 2:
+            raise CommandError("At least 2 partitions.")
+        for model in self.get_models(options):
+            comment_model = model._meta.get_field('comments').related_model
+            if comment_model.partition_field is None:
+                raise CommandError(f"`{comment_model._meta.label}` has no `partition_field`.")
+            self.partition(comment_model, options)
+
+    def partition(self, model, options):
+        connection = connections[router.db_for_write(model)]
+        if connection.vendor != 'postgresql':
+            raise CommandError("Partitioning requires PostgreSQL.")
+        table = model._meta.db_table
+        new_table = table + '_partitioned'
+        statements, warnings = partitioning.get_partition_sql(connection, model, options['partitions'], new_table)
+        for warning in warnings:
+            self.stdout.write(self.style.WARNING(warning))
+        if options['sql']:
+            for statement in statements:
+                self.stdout.write(statement + ';')
+            return
+        if partitioning.is_partitioned(connection, table):
+            self.stdout.write(f"{table} is partitioned already.")
+            return
+
+        with transaction.atomic(using=connection.alias), connection.cursor() as cursor:
+            cursor.execute("SELECT now()")
+            started = cursor.fetchone()[0]
+            for statement in statements:
+                cursor.execute(statement)
+        last_id = model._base_manager.using(connection.alias).aggregate(last_id=Max('pk'))['last_id'] or 0
+        copied = 0
+        for copied in partitioning.copy_rows(
+            connection, table, new_table, model._meta.pk.column, 0, last_id, options['batch_size']
+        ):
+            self.stdout.write(f"{table}: {copied}/{last_id}", ending='\r')
+        partitioning.swap_tables(connection, model, new_table, copied, started)
+        self.stdout.write(f"\n{table} is partitioned into {options['partitions']} tables.")
+
+        if options['drop_old']:
+            with connection.cursor() as cursor:
+                cursor.execute(f"DROP TABLE {connection.ops.quote_name(table + '_unpartitioned')}")
+        else:
+            self.stdout.write(f"The original table is kept as {table}_unpartitioned.")
@@ -0,0 +1,25 @@
+from django.db.models import Count, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce, Now
+from common.cache import bump_generation
+from common.management.base import ResourceCommand
+
+
+class Command(ResourceCommand):
+    help = "Rebuild `comments_count` of resources from their comment tables."
+
+    def handle(self, *args, **options):
+        models = self.get_models(options)
+
+        for model in models:
+            relation = model._meta.get_field('comments')
+            fk_name = relation.field.name
+            counts = relation.related_model._default_manager.filter(
+                **{fk_name: OuterRef('pk'), 'is_deleted': False}
+            ).order_by().values(fk_name).annotate(count=Count('pk')).values('count')
+            actual = Coalesce(Subquery(counts, output_field=IntegerField()), 0)
+            # only rewrite rows that are out of sync, bumping `edited_time` as the count is serialized
+            updated = model._default_manager.exclude(comments_count=actual).update(
+                comments_count=actual, edited_time=Now()
+            )
+            bump_generation(model)
+            self.stdout.write(f"{model._meta.label}: {updated} rows fixed.")
@@ -0,0 +1,39 @@
+from decimal import Decimal
+from django.conf import settings
+from django.db.models import DecimalField, F, Func, Value
+from django.db.models.functions import Now
+from common.cache import bump_generation
+from common.management.base import ResourceCommand
+
+
+class Command(ResourceCommand):
+    help = (
+        "Recompute `weighted_rating` of all resources, "
+        "run it after `RATING_PRIOR_MEAN` or `RATING_PRIOR_WEIGHT` is changed."
+    )
+
+    def handle(self, *args, **options):
+        models = self.get_models(options)
+
+        # keep consistent with `common.models.get_weighted_rating`
+        prior_mean = Decimal(str(settings.RATING_PRIOR_MEAN))
+        prior_weight = settings.RATING_PRIOR_WEIGHT
+        weighted_rating = Func(
+            (Value(prior_mean * prior_weight) + F('rating_total_score') / Value(Decimal(2)))
+            / (Value(prior_weight) + F('rating_number')),
+            Value(4),
+            function='ROUND',
+            output_field=DecimalField(max_digits=5, decimal_places=4),
+        )
+
+        for model in models:
+            manager = model._default_manager
+            # only rewrite rows that change, bumping `edited_time` as the rating is serialized
+            updated = manager.filter(rating_number__gt=0).exclude(weighted_rating=weighted_rating).update(
+                weighted_rating=weighted_rating, edited_time=Now()
+            )
+            updated += manager.exclude(rating_number__gt=0).exclude(weighted_rating=None).update(
+                weighted_rating=None, edited_time=Now()
+            )
+            bump_generation(model)
+            self.stdout.write(f"{model._meta.label}: {updated} rows refreshed.")
@@ -0,0 +1,126 @@
+import os
+import re
+from collections import Counter
+from datetime import timedelta
+from django.apps import apps
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import FileField
+from django.utils import timezone
+from common.models import Blob
+from common.storage import ContentAddressedStorage, content_storage
+
+
+class Command(BaseCommand):
+    help = (
+        "Delete content addressed files that have not been referenced for "
+        "`BLOB_SWEEP_GRACE_SECONDS`. Files on disk without reference count, e.g. "
+        "saved by a request that rolled back, are adopted and deleted the same way. "
+        "Run it periodically, e.g. by cron."
+    )
+
+    # `<upload_to>/<2 hex>/<sha256>.<ext>`, see `ContentAddressedStorage.get_content_name`
+    content_name = re.compile(r'^(?P<prefix>[0-9a-f]{2})/(?P=prefix)[0-9a-f]{62}(\.\w+)?$')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--grace-seconds', type=int, default=None)
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument(
+            '--recount', action='store_true',
+            help="Rebuild reference counts from file fields first. Run it while no file is uploaded."
+        )
+
+    def handle(self, *args, **options):
+        if options['recount']:
+            self.recount()
+        self.adopt_orphans(options['batch_size'])
+
+        grace = options['grace_seconds']
+        if grace is None:
+            grace = getattr(settings, 'BLOB_SWEEP_GRACE_SECONDS', 3600)
+        threshold = timezone.now() - timedelta(seconds=grace)
+
+        swept = 0
+        while True:
+            names = list(
+                Blob.objects.filter(ref_count__lte=0, orphaned_time__lt=threshold)
+                .values_list('name', flat=True)[:options['batch_size']]
+            )
+            if not names:
+                break
+            for name in names:
+                with transaction.atomic():
+                    # re-check under the row lock, the file may be referenced again
+                    blob = Blob.objects.select_for_update().filter(name=name, ref_count__lte=0).first()
+                    if blob is None:
+                        continue
+                    content_storage.purge(name)
+                    blob.delete()
+                    swept += 1
+            if len(names) < options['batch_size']:
+                break
+        self.stdout.write(f"{swept} files deleted.")
+
+    def adopt_orphans(self, batch_size):
+        """
+        Add a blob without reference for every file that has none, so that it is
+        deleted after the grace period. Blob rows are created in the request
+        transaction but files are not, so a rolled back upload leaves its file behind.
+        """
+        now = timezone.now()
+        adopted = 0
+        batch = []
+        for name in self.iter_content_names():
+            batch.append(name)
+            if len(batch) >= batch_size:
+                adopted += self.adopt(batch, now)
+                batch = []
+        if batch:
+            adopted += self.adopt(batch, now)
+        if adopted:
+            self.stdout.write(f"{adopted} files without reference count found.")
+
+    def adopt(self, names, now):
+        existing = set(Blob.objects.filter(name__in=names).values_list('name', flat=True))
+        orphans = [
+            Blob(name=name, ref_count=0, orphaned_time=now)
+            for name in names if name not in existing
+        ]
+        # conflicts with uploads acquiring the same name concurrently wait for them,
+        # then keep their rows
+        Blob.objects.bulk_create(orphans, ignore_conflicts=True)
+        return len(orphans)
+
+    def iter_content_names(self):
+        root = content_storage.location
+        for directory, _, filenames in os.walk(root):
+            for filename in filenames:
+                name = os.path.relpath(os.path.join(directory, filename), root).replace(os.sep, '/')
+                # the last two path segments are the hash directory and the file
+                tail = '/'.join(name.split('/')[-2:])
+                if self.content_name.match(tail):
+                    yield name
+
+    def recount(self):
+        references = Counter()
+        for model in apps.get_models():
+            for field in model._meta.get_fields():
+                if isinstance(field, FileField) and isinstance(field.storage, ContentAddressedStorage):
+                    names = model._base_manager.exclude(**{field.name: ''}).values_list(field.name, flat=True)
+                    references.update(name for name in names if name)
+
+        now = timezone.now()
+        with transaction.atomic():
+            blobs = {blob.name: blob for blob in Blob.objects.select_for_update()}
+            for name, count in references.items():
+                blob = blobs.pop(name, None)
+                if blob is None:
+                    Blob.objects.create(name=name, ref_count=count)
+                elif blob.ref_count != count:
+                    Blob.objects.filter(pk=blob.pk).update(ref_count=count, orphaned_time=None)
+            # not referenced by any record
+            for blob in blobs.values():
+                if blob.ref_count != 0 or blob.orphaned_time is None:
+                    Blob.objects.filter(pk=blob.pk).update(ref_count=0, orphaned_time=blob.orphaned_time or now)
+        self.stdout.write(f"{len(references)} referenced files recounted.")
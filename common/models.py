@@ -1,20 +1,148 @@
-from django.db import models
+from django.apps import apps
+from django.conf import settings
+from django.db import IntegrityError, models, router, transaction
+from django.db.models import Case, F, When
+from django.utils import timezone
 from decimal import *
 from django.utils.translation import ugettext_lazy as _
 import django.contrib.postgres.fields as postgres
+from django.core.files import File
 from django.core.serializers.json import DjangoJSONEncoder
+from .cache import bump_generation
+from .trending import add_scores, get_activity_score, get_hour
 
 PREVIEW_LENGTH = 20
 
-class Comment(models.Model):
+
+class DirtyFieldsModel(models.Model):
+    """
+    Track field values as loaded or last saved, so that `save()` of a loaded
+    instance only writes the changed columns, and skips the database when nothing changed.
+    `auto_now` fields are written along with any change, and count as a change
+    only when assigned explicitly.
+    Names of the fields written by the last `save()` are kept in `written_fields`,
+    empty when it was skipped.
+    """
+
+    written_fields = None
+
+    class Meta:
+        abstract = True
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance.reset_dirty_fields()
+        return instance
+
+    def reset_dirty_fields(self):
+        """ take the current values as saved, call it after writing the row by other means """
+        self._saved_values = {
+            field.attname: snapshot_value(self.__dict__[field.attname])
+            for field in self._meta.concrete_fields
+            if field.attname in self.__dict__
+        }
+
+    def get_saved_value(self, attname, default=None):
+        """
+        value of a field as loaded or last saved, lists and dicts are not copied,
+        and are only reliable if they are replaced rather than changed in place
+        """
+        value = getattr(self, '_saved_values', {}).get(attname, default)
+        return value.value if isinstance(value, MutableSnapshot) else value
+
+    def get_dirty_fields(self):
+        """ names of fields changed since loaded or last saved, all fields if unknown """
+        saved_values = getattr(self, '_saved_values', None)
+        fields = []
+        for field in self._meta.concrete_fields:
+            if field.primary_key or field.attname not in self.__dict__:
+                # deferred and never assigned
+                continue
+            value = self.__dict__[field.attname]
+            if (
+                saved_values is None
+                or field.attname not in saved_values
+                or not getattr(value, '_committed', True)
+                or snapshot_value(value) != saved_values[field.attname]
+            ):
+                fields.append(field.name)
+        return fields
+
+    def refresh_from_db(self, using=None, fields=None):
+        super().refresh_from_db(using=using, fields=fields)
+        saved_values = getattr(self, '_saved_values', {})
+        for field in self._meta.concrete_fields:
+            if field.attname in self.__dict__ and (fields is None or field.name in fields or field.attname in fields):
+                saved_values[field.attname] = snapshot_value(self.__dict__[field.attname])
+        self._saved_values = saved_values
+
+    def save(self, force_insert=False, force_update=False, using=None, update_fields=None):
+        if (
+            update_fields is None and not force_insert and not self._state.adding
+            and getattr(self, '_saved_values', None) is not None
+        ):
+            update_fields = self.get_dirty_fields()
+            if not update_fields:
+                self.written_fields = []
+                return
+            update_fields += [
+                field.name for field in self._meta.concrete_fields
+                if getattr(field, 'auto_now', False) and field.name not in update_fields
+            ]
+        super().save(force_insert=force_insert, force_update=force_update, using=using, update_fields=update_fields)
+        if update_fields is None:
+            self.reset_dirty_fields()
+            self.written_fields = [field.name for field in self._meta.concrete_fields]
+        else:
+            saved_values = getattr(self, '_saved_values', {})
+            for name in update_fields:
+                attname = self._meta.get_field(name).attname
+                saved_values[attname] = snapshot_value(self.__dict__.get(attname))
+            self._saved_values = saved_values
+            self.written_fields = list(update_fields)
+
+
+class MutableSnapshot:
+    """
+    Saved list or dict, compared by its repr, which is several times cheaper
+    than a deep copy for every JSON and array field of every loaded row.
+    """
+
+    __slots__ = ('value', 'key')
+
+    def __init__(self, value):
+        self.value = value
+        self.key = repr(value)
+
+    def __eq__(self, other):
+        return isinstance(other, MutableSnapshot) and self.key == other.key
+
+
+def snapshot_value(value):
+    """ comparable form of a field value, files are compared by name """
+    if isinstance(value, File):
+        return value.name
+    if isinstance(value, (list, dict)):
+        return MutableSnapshot(value)
+    return value
+
+
+class Comment(DirtyFieldsModel):
 
     id = models.AutoField(_("id"), primary_key=True, db_index=True)
     user_id = models.CharField(_("user id"), max_length=200)
     rating = models.DecimalField(_("rating"), null=True, blank=True, max_digits=2, decimal_places=1)
     content = models.TextField(_("comment content"), blank=True, default='')
-    edited_time = models.DateTimeField(_("edited time"), auto_now_add=True)
+    # bumped on every change, including soft deletion
+    edited_time = models.DateTimeField(_("edited time"), auto_now=True)
     is_deleted = models.BooleanField(_("is valid"), null=True, blank=True, default=False)
 
+    # name of the foreign key to the resource, by which the table may be hash
+    # partitioned, see `common.partitioning`. Updates and deletes of a row then
+    # filter by it as well, so that only one partition is scanned.
+    partition_field = None
+
     class Meta:
         verbose_name = _("comment")
         verbose_name_plural = _("comments")
@@ -23,16 +151,50 @@ class Comment(models.Model):
     def __str__(self):
         return f"[{self.user_id}]" + self.content[:20] + '...' if len(self.content) > 20 else self.content
 
+    def get_partition_key(self):
+        """ the partition the row is stored in, even if the foreign key is changed later """
+        if self.partition_field is None:
+            return None
+        return self.get_saved_value(self._meta.get_field(self.partition_field).attname)
 
-class Resource(models.Model):
+    def filter_partition(self, queryset):
+        """ narrow a queryset of this row to the partition it is stored in, when known """
+        partition_key = self.get_partition_key()
+        if partition_key is None:
+            return queryset
+        return queryset.filter(**{self._meta.get_field(self.partition_field).attname: partition_key})
+
+    def _do_update(self, base_qs, *args, **kwargs):
+        return super()._do_update(self.filter_partition(base_qs), *args, **kwargs)
+
+    def delete(self, using=None, keep_parents=False):
+        if self.get_partition_key() is None:
+            return super().delete(using=using, keep_parents=keep_parents)
+        # nothing refers to comments, so the queryset is deleted by one statement
+        using = using or router.db_for_write(self.__class__, instance=self)
+        queryset = self.filter_partition(type(self)._base_manager.using(using).filter(pk=self.pk))
+        result = queryset.delete()
+        self.pk = None
+        return result
+
+
+class Resource(DirtyFieldsModel):
 
     id = models.AutoField(primary_key=True, db_index=True)
     other = postgres.JSONField(_("other information"), blank=True, null=True, encoder=DjangoJSONEncoder, default=dict)
     rating_total_score = models.PositiveIntegerField(null=True, blank=True)
     rating_number = models.PositiveIntegerField(null=True, blank=True)
     rating = models.DecimalField(_("rating"), null=True, blank=True, max_digits=2, decimal_places=1)
-    # the time when the entity is edited
-    edited_time = models.DateTimeField(_("edited time"), auto_now_add=True)
+    # bayesian average of ratings, used for ranking, maintained on save
+    weighted_rating = models.DecimalField(
+        _("weighted rating"), null=True, blank=True, max_digits=5, decimal_places=4, editable=False
+    )
+    # number of comments that are not deleted, maintained by comment views
+    comments_count = models.PositiveIntegerField(_("comments count"), default=0, db_index=True)
+    # decayed comment activity in log space, null without recent activity, see `common.trending`
+    trending_score = models.FloatField(_("trending score"), null=True, blank=True, editable=False)
+    # the time when the entity or its comments are edited, bumped on every change
+    edited_time = models.DateTimeField(_("edited time"), auto_now=True)
     is_deleted = models.BooleanField(_("is deleted"), null=False, blank=True, default=False)
 
     # every resource model should have a comments field
@@ -47,7 +209,184 @@ class Resource(models.Model):
 
     def save(self, *args, **kwargs):
         """ update rating before save to db """
+        self.update_rating()
+        super().save(*args, **kwargs)
+        if self.written_fields:
+            bump_generation(type(self))
+
+    def delete(self, *args, **kwargs):
+        result = super().delete(*args, **kwargs)
+        bump_generation(type(self))
+        return result
+
+    def apply_delta(self, comments_count, rating_number, rating_total_score):
+        """
+        Add changes of comments count, rating number and doubled rating total score,
+        then derive rating fields. The caller saves the resource.
+        """
+        self.comments_count += comments_count
+        rating_number = (self.rating_number or 0) + rating_number
+        if rating_number > 0:
+            self.rating_number = rating_number
+            self.rating_total_score = (self.rating_total_score or 0) + rating_total_score
+        else:
+            self.rating = None
+            self.rating_number = None
+            self.rating_total_score = None
+        self.update_rating()
+
+    def apply_pending_deltas(self):
+        """
+        Apply rating deltas not yet flushed to this instance without saving it,
+        for reading exact values when `COALESCE_RATING_UPDATES` is on.
+        `edited_time` is moved to the latest pending delta.
+        """
+        pending = RatingDelta.objects.filter(
+            resource_type=self._meta.label_lower, resource_id=self.pk
+        ).aggregate(
+            comments_count=models.Sum('comments_count'),
+            rating_number=models.Sum('rating_number'),
+            rating_total_score=models.Sum('rating_total_score'),
+            last_created=models.Max('created_time'),
+        )
+        if pending['last_created'] is None:
+            return
+        self.apply_delta(pending['comments_count'], pending['rating_number'], pending['rating_total_score'])
+        self.edited_time = max(self.edited_time, pending['last_created'])
+
+    def record_activity(self, count, time):
+        """
+        Count comment writes at `time` into its hourly bucket and the trending score.
+        The caller saves the resource.
+        """
+        hour = get_hour(time)
+        ActivityBucket.add(self, hour, count)
+        self.trending_score = add_scores(self.trending_score, get_activity_score(count, hour))
+
+    def update_rating(self):
+        """
+        Derive rating fields from `rating_number` and `rating_total_score`,
+        call it before bulk updates which bypass `save()`.
+        """
         # NOTE need test here
-        if self.rating_number and self.rating_total_score:
+        if self.rating_number and self.rating_total_score is not None:
             self.rating = Decimal(str(round(self.rating_total_score  / (self.rating_number * 2), 1)))
-        super().save(*args, **kwargs)
\ No newline at end of file
+        self.weighted_rating = get_weighted_rating(self.rating_number, self.rating_total_score)
+
+
+class RatingDelta(models.Model):
+    """
+    Change of comments count and rating of a resource by a comment write,
+    appended instead of locking the resource row when `COALESCE_RATING_UPDATES` is on.
+    Folded into resources by command `flush_rating_deltas`.
+    """
+
+    # `app_label.modelname` of the resource
+    resource_type = models.CharField(_("resource type"), max_length=100)
+    resource_id = models.IntegerField(_("resource id"))
+    comments_count = models.IntegerField(_("comments count"), default=0)
+    rating_number = models.IntegerField(_("rating number"), default=0)
+    # doubled, like `Resource.rating_total_score`
+    rating_total_score = models.IntegerField(_("rating total score"), default=0)
+    created_time = models.DateTimeField(_("created time"), auto_now_add=True)
+
+    class Meta:
+        db_table = 'ratingdelta'
+        indexes = [
+            models.Index(fields=['resource_type', 'resource_id'], name='ratingdelta_resource_idx'),
+        ]
+
+
+class ActivityBucket(models.Model):
+    """
+    Comment writes to a resource in one hour, for recomputing trending scores.
+    Buckets older than `TRENDING_WINDOW_HOURS` are dropped by command `compact_activity`.
+    """
+
+    # `app_label.modelname` of the resource
+    resource_type = models.CharField(_("resource type"), max_length=100)
+    resource_id = models.IntegerField(_("resource id"))
+    hour = models.DateTimeField(_("hour"))
+    count = models.PositiveIntegerField(_("count"), default=0)
+
+    class Meta:
+        db_table = 'activitybucket'
+        constraints = [
+            models.UniqueConstraint(fields=['resource_type', 'resource_id', 'hour'], name='activitybucket_unique'),
+        ]
+        indexes = [
+            models.Index(fields=['hour'], name='activitybucket_hour_idx'),
+        ]
+
+    @classmethod
+    def add(cls, resource, hour, count=1):
+        """ add activity to the bucket, which is created if not exists """
+        fields = {'resource_type': resource._meta.label_lower, 'resource_id': resource.pk, 'hour': hour}
+        while True:
+            if cls.objects.filter(**fields).update(count=F('count') + count):
+                return
+            try:
+                with transaction.atomic():
+                    cls.objects.create(count=count, **fields)
+                return
+            except IntegrityError:
+                # created concurrently, increase it instead
+                continue
+
+
+class Blob(models.Model):
+    """
+    Reference count of a file in `common.storage.ContentAddressedStorage`.
+    Files without reference are deleted by command `sweep_blobs`.
+    """
+
+    name = models.CharField(_("name"), max_length=255, unique=True)
+    ref_count = models.IntegerField(_("reference count"), default=0)
+    # the time when the last reference is released
+    orphaned_time = models.DateTimeField(_("orphaned time"), null=True, blank=True, db_index=True)
+
+    class Meta:
+        db_table = 'blob'
+
+    def __str__(self):
+        return self.name
+
+    @classmethod
+    def acquire(cls, name):
+        """ add a reference, the row is created if not exists """
+        while True:
+            if cls.objects.filter(name=name).update(ref_count=F('ref_count') + 1, orphaned_time=None):
+                return
+            try:
+                with transaction.atomic():
+                    cls.objects.create(name=name, ref_count=1)
+                return
+            except IntegrityError:
+                # created concurrently, increase it instead
+                continue
+
+    @classmethod
+    def release(cls, name):
+        """ remove a reference, files never acquired are ignored """
+        cls.objects.filter(name=name, ref_count__gt=0).update(
+            ref_count=F('ref_count') - 1,
+            orphaned_time=Case(When(ref_count=1, then=timezone.now()), default=F('orphaned_time')),
+        )
+
+
+def get_weighted_rating(rating_number, rating_total_score):
+    """
+    Bayesian average, ratings of resources with few votes are pulled towards
+    `RATING_PRIOR_MEAN` as if it had `RATING_PRIOR_WEIGHT` extra votes.
+    """
+    if not rating_number or rating_total_score is None:
+        return None
+    prior_mean = Decimal(str(settings.RATING_PRIOR_MEAN))
+    prior_weight = settings.RATING_PRIOR_WEIGHT
+    score = (prior_mean * prior_weight + Decimal(rating_total_score) / 2) / (prior_weight + rating_number)
+    return score.quantize(Decimal('0.0001'))
+
+
+def get_resource_models():
+    """ all concrete models derived from `Resource` """
+    return [model for model in apps.get_models() if issubclass(model, Resource)]
@@ -0,0 +1,162 @@
+"""
+Hash partitioning of comment tables by resource id, PostgreSQL 11+.
+A partitioned copy of the table is created, existing rows are copied in batches
+of id range, then rows changed meanwhile are synchronized and the tables are
+swapped under a lock that still allows reads. The original table is kept as
+`<table>_unpartitioned`.
+The primary key of a partitioned table must include the partition key,
+so it becomes (id, resource id), while ids stay unique by the sequence.
+"""
+
+import re
+from datetime import timedelta
+from django.db import transaction
+
+
+def get_partition_column(model):
+    assert model.partition_field is not None, (
+        "`%s` has no `partition_field`." % model.__name__
+    )
+    return model._meta.get_field(model.partition_field).column
+
+
+def is_partitioned(connection, table):
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass(%s)", [table])
+        row = cursor.fetchone()
+    return row is not None and row[0] == 'p'
+
+
+def get_partition_sql(connection, model, partitions, new_table):
+    """
+    Return statements creating an empty table partitioned by hash of the
+    partition field into `partitions` tables, with the columns, checks, foreign
+    keys and indexes of the table of `model`, and warnings of what can't be kept.
+    Indexes are created with `_p` suffix, see `swap_tables`.
+    """
+    qn = connection.ops.quote_name
+    table = model._meta.db_table
+    key = get_partition_column(model)
+    pk = model._meta.pk.column
+    statements = [
+        f"CREATE TABLE {qn(new_table)} (LIKE {qn(table)} INCLUDING DEFAULTS INCLUDING CONSTRAINTS) "
+        f"PARTITION BY HASH ({qn(key)})",
+        f"ALTER TABLE {qn(new_table)} ADD CONSTRAINT {qn(partition_name(table + '_pkey'))} "
+        f"PRIMARY KEY ({qn(pk)}, {qn(key)})",
+    ]
+    statements += [
+        f"CREATE TABLE {qn(f'{table}_p{remainder}')} PARTITION OF {qn(new_table)} "
+        f"FOR VALUES WITH (MODULUS {partitions}, REMAINDER {remainder})"
+        for remainder in range(partitions)
+    ]
+    warnings = []
+
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint "
+            "WHERE conrelid = to_regclass(%s) AND contype = 'f'",
+            [table],
+        )
+        for name, definition in cursor.fetchall():
+            statements.append(f"ALTER TABLE {qn(new_table)} ADD CONSTRAINT {qn(name)} {definition}")
+
+        cursor.execute(
+            "SELECT i.relname, pg_get_indexdef(i.oid), x.indisunique, x.indisprimary, "
+            "%s = ANY(SELECT attname FROM pg_attribute WHERE attrelid = x.indrelid AND attnum = ANY(x.indkey)) "
+            "FROM pg_index x JOIN pg_class i ON i.oid = x.indexrelid "
+            "WHERE x.indrelid = to_regclass(%s)",
+            [key, table],
+        )
+        for name, definition, unique, primary, has_key in cursor.fetchall():
+            if primary:
+                continue
+            if unique and not has_key:
+                warnings.append(f"Unique index `{name}` doesn't include `{key}` and is not kept.")
+                continue
+            # CREATE [UNIQUE] INDEX name ON [ONLY] table USING ...
+            match = re.match(r'^CREATE (UNIQUE )?INDEX \S+ ON (?:ONLY )?\S+ (USING .*)$', definition)
+            statements.append(
+                f"CREATE {match.group(1) or ''}INDEX {qn(partition_name(name))} "
+                f"ON {qn(new_table)} {match.group(2)}"
+            )
+    return statements, warnings
+
+
+def partition_name(name):
+    """ temporary name of an index of the partitioned table, within the 63 chars limit """
+    return name[:61] + '_p'
+
+
+def old_name(name):
+    return name[:59] + '_old'
+
+
+def copy_rows(connection, table, new_table, pk, start, end, batch_size):
+    """ copy rows with pk in (start, end] in batches, yield the last copied pk """
+    qn = connection.ops.quote_name
+    for lower in range(start, end, batch_size):
+        upper = min(lower + batch_size, end)
+        with transaction.atomic(using=connection.alias), connection.cursor() as cursor:
+            cursor.execute(
+                f"INSERT INTO {qn(new_table)} SELECT * FROM {qn(table)} WHERE {qn(pk)} > %s AND {qn(pk)} <= %s",
+                [lower, upper],
+            )
+        yield upper
+
+
+def swap_tables(connection, model, new_table, copied, started):
+    """
+    Synchronize rows inserted after `copied` or edited since `started`, and the
+    ones hard deleted meanwhile, then swap the tables and their index names.
+    Writes to the table are blocked until it commits.
+    """
+    qn = connection.ops.quote_name
+    table = model._meta.db_table
+    pk = model._meta.pk.column
+    edited_time = model._meta.get_field('edited_time').column
+    # `edited_time` is set by application servers, allow for their clock skew
+    edited_since = started - timedelta(minutes=1)
+
+    with transaction.atomic(using=connection.alias), connection.cursor() as cursor:
+        cursor.execute(f"LOCK TABLE {qn(table)} IN EXCLUSIVE MODE")
+        cursor.execute(
+            f"DELETE FROM {qn(new_table)} n USING {qn(table)} o "
+            f"WHERE n.{qn(pk)} = o.{qn(pk)} AND o.{qn(edited_time)} >= %s",
+            [edited_since],
+        )
+        cursor.execute(
+            f"INSERT INTO {qn(new_table)} SELECT * FROM {qn(table)} "
+            f"WHERE {qn(pk)} > %s OR {qn(edited_time)} >= %s",
+            [copied, edited_since],
+        )
+        cursor.execute(
+            f"DELETE FROM {qn(new_table)} n WHERE NOT EXISTS "
+            f"(SELECT 1 FROM {qn(table)} o WHERE o.{qn(pk)} = n.{qn(pk)})"
+        )
+
+        cursor.execute("SELECT pg_get_serial_sequence(%s, %s)", [table, pk])
+        sequence = cursor.fetchone()[0]
+        cursor.execute(
+            "SELECT i.relname FROM pg_index x JOIN pg_class i ON i.oid = x.indexrelid "
+            "WHERE x.indrelid = to_regclass(%s)",
+            [table],
+        )
+        old_indexes = [row[0] for row in cursor.fetchall()]
+        cursor.execute(
+            "SELECT i.relname FROM pg_index x JOIN pg_class i ON i.oid = x.indexrelid "
+            "WHERE x.indrelid = to_regclass(%s)",
+            [new_table],
+        )
+        new_indexes = [row[0] for row in cursor.fetchall()]
+
+        cursor.execute(f"ALTER TABLE {qn(table)} RENAME TO {qn(table + '_unpartitioned')}")
+        for name in old_indexes:
+            cursor.execute(f"ALTER INDEX {qn(name)} RENAME TO {qn(old_name(name))}")
+        cursor.execute(f"ALTER TABLE {qn(new_table)} RENAME TO {qn(table)}")
+        originals = {partition_name(name): name for name in old_indexes}
+        for name in new_indexes:
+            if name in originals:
+                cursor.execute(f"ALTER INDEX {qn(name)} RENAME TO {qn(originals[name])}")
+        if sequence:
+            # keep the sequence when the old table is dropped
+            cursor.execute(f"ALTER SEQUENCE {sequence} OWNED BY {qn(table)}.{qn(pk)}")
@@ -37,3 +37,14 @@ class Base64ImageField(Base64FieldMixin, serializers.ImageField):
 
 class Base64FileField(Base64FieldMixin, serializers.FileField):
     pass
+
+
+class BulkCommentSerializer(serializers.Serializer):
+    """
+    Field validation of one comment in bulk creation, without database access.
+    `resource` is the pk of the commented resource.
+    """
+    resource = serializers.IntegerField()
+    user_id = serializers.CharField(max_length=200)
+    rating = serializers.DecimalField(max_digits=2, decimal_places=1, required=False, allow_null=True)
+    content = serializers.CharField(required=False, allow_blank=True, default='')
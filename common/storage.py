@@ -0,0 +1,55 @@
+import os
+from hashlib import sha256
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+from django.utils.deconstruct import deconstructible
+from common.models import Blob
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    """
+    Files are named by the sha256 of their content, under the directory given
+    by `upload_to`, so identical uploads are stored once.
+    References are counted in `common.models.Blob`. Deleting a file only
+    releases a reference, files without reference are removed later by
+    command `sweep_blobs` instead of inside the request. A file written by a
+    request that rolls back loses its reference row, and is found on disk by the sweep.
+    """
+
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        if not hasattr(content, 'chunks'):
+            content = File(content, name)
+        name = self.get_content_name(name, content)
+
+        # acquire before checking existence, a sweep holding the row lock
+        # either finishes deleting first or sees the new reference
+        Blob.acquire(name)
+        if self.exists(name):
+            return name
+        saved_name = super().save(name, content, max_length=max_length)
+        if saved_name != name:
+            # an identical file is saved concurrently, keep only one copy
+            self.purge(saved_name)
+        return name
+
+    def get_content_name(self, name, content):
+        hasher = sha256()
+        for chunk in content.chunks():
+            hasher.update(chunk)
+        digest = hasher.hexdigest()
+        directory, filename = os.path.split(name)
+        ext = os.path.splitext(filename)[1].lower()
+        return os.path.join(directory, digest[:2], digest + ext)
+
+    def delete(self, name):
+        Blob.release(name)
+
+    def purge(self, name):
+        """ delete the file from disk """
+        super().delete(name)
+
+
+content_storage = ContentAddressedStorage()
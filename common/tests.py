@@ -1,3 +1,202 @@
-from django.test import TestCase
+import math
+import os
+import shutil
+import tempfile
+from datetime import datetime, timedelta
+from decimal import Decimal
+from hashlib import sha256
+from io import StringIO
+from django.core.files.base import ContentFile
+from django.core.management import call_command
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+from rest_framework.exceptions import ValidationError
+from .models import Blob
+from .storage import content_storage
+from .trending import EPOCH, add_scores, get_activity_score, get_hour, get_window_start
+from .views import get_rating_delta, validate_rating, validate_ratings
 
-# Create your tests here.
+
+class ValidateRatingsTests(SimpleTestCase):
+
+    def test_valid(self):
+        self.assertEqual(validate_ratings([None, Decimal('0.0'), Decimal('2.5'), Decimal('5.0')]), [])
+
+    def test_invalid_indexes(self):
+        ratings = [Decimal('4.5'), Decimal('4.3'), None, Decimal('5.5'), Decimal('-0.5')]
+        self.assertEqual(validate_ratings(ratings), [1, 3, 4])
+
+    def test_agrees_with_validate_rating(self):
+        ratings = [Decimal(tenths).scaleb(-1) for tenths in range(-5, 56)]
+        invalid = set(validate_ratings(ratings))
+        self.assertEqual(len(invalid), len(ratings) - 11)
+        for index, rating in enumerate(ratings):
+            if index in invalid:
+                with self.assertRaises(ValidationError):
+                    validate_rating(rating)
+            else:
+                self.assertTrue(validate_rating(rating))
+
+
+class RatingDeltaTests(SimpleTestCase):
+
+    def test_rated(self):
+        self.assertEqual(get_rating_delta(None, Decimal('4.5')), (1, 9))
+        # zero is a rating
+        self.assertEqual(get_rating_delta(None, Decimal('0.0')), (1, 0))
+
+    def test_unrated(self):
+        self.assertEqual(get_rating_delta(Decimal('4.5'), None), (-1, -9))
+
+    def test_changed(self):
+        self.assertEqual(get_rating_delta(Decimal('4.5'), Decimal('2.0')), (0, -5))
+
+    def test_unchanged(self):
+        self.assertEqual(get_rating_delta(None, None), (0, 0))
+        self.assertEqual(get_rating_delta(Decimal('3.5'), Decimal('3.5')), (0, 0))
+
+    def test_deltas_add_up(self):
+        ratings = [None, Decimal('4.5'), Decimal('2.0'), None, Decimal('5.0')]
+        deltas = [get_rating_delta(old, new) for old, new in zip(ratings, ratings[1:])]
+        self.assertEqual(tuple(map(sum, zip(*deltas))), (1, 10))
+
+
+@override_settings(TRENDING_HALF_LIFE_HOURS=24, TRENDING_WINDOW_HOURS=48)
+class TrendingTests(SimpleTestCase):
+
+    def test_activity_score(self):
+        self.assertEqual(get_activity_score(1, EPOCH), 0)
+        self.assertAlmostEqual(get_activity_score(3, EPOCH), math.log(3))
+
+    def test_decay(self):
+        # activity a half-life later counts double
+        self.assertAlmostEqual(get_activity_score(1, EPOCH + timedelta(hours=24)), get_activity_score(2, EPOCH))
+        self.assertAlmostEqual(get_activity_score(1, EPOCH + timedelta(hours=240)), math.log(2) * 10)
+
+    @override_settings(TRENDING_HALF_LIFE_HOURS=12)
+    def test_half_life_setting(self):
+        self.assertAlmostEqual(get_activity_score(1, EPOCH + timedelta(hours=24)), math.log(4))
+
+    def test_recent_activity_ranks_higher(self):
+        now = EPOCH + timedelta(days=100)
+        recent = get_activity_score(10, get_hour(now - timedelta(hours=1)))
+        self.assertGreater(recent, get_activity_score(10, get_hour(now - timedelta(hours=48))))
+        # four times the activity two half-lives earlier ranks the same
+        self.assertAlmostEqual(get_activity_score(40, get_hour(now - timedelta(hours=49))), recent)
+
+    def test_add_scores(self):
+        self.assertIsNone(add_scores())
+        self.assertIsNone(add_scores(None, None))
+        self.assertEqual(add_scores(1.5), 1.5)
+        self.assertAlmostEqual(add_scores(None, math.log(2)), math.log(2))
+        self.assertAlmostEqual(add_scores(math.log(1), math.log(2)), math.log(3))
+        self.assertAlmostEqual(add_scores(0.0, 0.0, 0.0), math.log(3))
+
+    def test_add_scores_out_of_float_range(self):
+        # exp() of these overflows
+        self.assertAlmostEqual(add_scores(1000.0, 1000.0), 1000 + math.log(2))
+        self.assertAlmostEqual(add_scores(1000.0, -1000.0), 1000.0)
+
+    def test_incremental_sum(self):
+        # a score kept by adding one write at a time is the score of the summed buckets
+        hours = [EPOCH + timedelta(hours=hours) for hours in (0, 5, 5, 30, 400)]
+        score = None
+        for hour in hours:
+            score = add_scores(score, get_activity_score(1, hour))
+        expected = math.log(sum(2 ** ((hour - EPOCH) / timedelta(hours=24)) for hour in hours))
+        self.assertAlmostEqual(score, expected)
+        buckets = [(0, 1), (5, 2), (30, 1), (400, 1)]
+        self.assertAlmostEqual(
+            add_scores(*(get_activity_score(count, EPOCH + timedelta(hours=hours)) for hours, count in buckets)),
+            expected,
+        )
+
+    def test_get_hour(self):
+        time = datetime(2020, 5, 6, 7, 8, 9, 10, tzinfo=timezone.utc)
+        self.assertEqual(get_hour(time), datetime(2020, 5, 6, 7, tzinfo=timezone.utc))
+
+    def test_window_start(self):
+        now = datetime(2020, 5, 6, 7, 8, tzinfo=timezone.utc)
+        self.assertEqual(get_window_start(now), datetime(2020, 5, 4, 7, tzinfo=timezone.utc))
+
+
+class ContentAddressedStorageTests(TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+        media_root = override_settings(MEDIA_ROOT=self.root)
+        media_root.enable()
+        self.addCleanup(media_root.disable)
+
+    def save(self, content, name='book/cover/a.jpg'):
+        return content_storage.save(name, ContentFile(content))
+
+    def sweep(self, **options):
+        call_command('sweep_blobs', stdout=StringIO(), **options)
+
+    def age(self, name):
+        Blob.objects.filter(name=name).update(orphaned_time=timezone.now() - timedelta(hours=2))
+
+    def test_named_by_content(self):
+        digest = sha256(b'cover').hexdigest()
+        name = self.save(b'cover', 'book/cover/a.JPG')
+        self.assertEqual(name, f'book/cover/{digest[:2]}/{digest}.jpg')
+        self.assertTrue(content_storage.exists(name))
+
+    def test_identical_files_stored_once(self):
+        name = self.save(b'cover', 'book/cover/a.jpg')
+        self.assertEqual(self.save(b'cover', 'book/cover/b.jpg'), name)
+        self.assertEqual(os.listdir(os.path.dirname(content_storage.path(name))), [os.path.basename(name)])
+        self.assertEqual(Blob.objects.get(name=name).ref_count, 2)
+        self.assertNotEqual(self.save(b'other'), name)
+
+    def test_delete_releases_reference(self):
+        name = self.save(b'cover')
+        self.save(b'cover')
+        content_storage.delete(name)
+        blob = Blob.objects.get(name=name)
+        self.assertEqual((blob.ref_count, blob.orphaned_time), (1, None))
+        content_storage.delete(name)
+        blob = Blob.objects.get(name=name)
+        self.assertEqual(blob.ref_count, 0)
+        self.assertIsNotNone(blob.orphaned_time)
+        # never below zero
+        content_storage.delete(name)
+        self.assertEqual(Blob.objects.get(name=name).ref_count, 0)
+        self.assertTrue(content_storage.exists(name))
+
+    def test_sweep_after_grace_period(self):
+        kept = self.save(b'kept')
+        released = self.save(b'released')
+        content_storage.delete(released)
+        self.sweep(grace_seconds=3600)
+        self.assertTrue(content_storage.exists(released))
+
+        self.age(released)
+        self.sweep(grace_seconds=3600)
+        self.assertFalse(content_storage.exists(released))
+        self.assertFalse(Blob.objects.filter(name=released).exists())
+        self.assertTrue(content_storage.exists(kept))
+
+    def test_sweep_spares_files_referenced_again(self):
+        name = self.save(b'cover')
+        content_storage.delete(name)
+        self.age(name)
+        self.save(b'cover')
+        self.sweep(grace_seconds=3600)
+        self.assertTrue(content_storage.exists(name))
+        self.assertEqual(Blob.objects.get(name=name).ref_count, 1)
+
+    def test_sweep_adopts_files_without_reference_count(self):
+        name = self.save(b'cover')
+        # as left by an upload that rolled back
+        Blob.objects.filter(name=name).delete()
+        self.sweep(grace_seconds=3600)
+        blob = Blob.objects.get(name=name)
+        self.assertEqual(blob.ref_count, 0)
+        self.assertTrue(content_storage.exists(name))
+
+        self.age(name)
+        self.sweep(grace_seconds=3600)
+        self.assertFalse(content_storage.exists(name))
@@ -0,0 +1,43 @@
+"""
+Trending score of resources from comment activity.
+Activity counted in hourly buckets decays by half every `TRENDING_HALF_LIFE_HOURS`,
+so at time t a resource is worth sum(count * 2 ** ((hour - t) / half life)).
+The factor of t is the same for every resource, so they rank alike by
+log(sum(count * 2 ** ((hour - EPOCH) / half life))), which is kept as
+`Resource.trending_score`. It is updated by adding the activity of one
+comment write without touching other rows, and stays in float range as it's
+in log space.
+"""
+
+import math
+from datetime import datetime, timedelta
+from django.conf import settings
+from django.utils import timezone
+
+EPOCH = datetime(2020, 1, 1, tzinfo=timezone.utc)
+
+
+def get_hour(time):
+    """ start of the activity bucket of `time` """
+    return time.replace(minute=0, second=0, microsecond=0)
+
+
+def get_window_start(now=None):
+    """ buckets before it are aged out, see command `compact_activity` """
+    hours = getattr(settings, 'TRENDING_WINDOW_HOURS', 7 * 24)
+    return get_hour(now or timezone.now()) - timedelta(hours=hours)
+
+
+def get_activity_score(count, hour):
+    """ log of `count` activity in the bucket of `hour`, decayed to `EPOCH` """
+    half_life = getattr(settings, 'TRENDING_HALF_LIFE_HOURS', 24) * 3600
+    return math.log(count) + math.log(2) * (hour - EPOCH).total_seconds() / half_life
+
+
+def add_scores(*scores):
+    """ score of the summed activity, None scores are no activity """
+    scores = [score for score in scores if score is not None]
+    if not scores:
+        return None
+    top = max(scores)
+    return top + math.log(sum(math.exp(score - top) for score in scores))
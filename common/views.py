@@ -1,7 +1,15 @@
+from collections import defaultdict
 from django.db import IntegrityError
 from django.db import transaction
+from django.conf import settings
+from django.http import Http404
 from django.utils import timezone
 from core import views
+from common.cache import bump_generation
+from common.models import RatingDelta
+from common.serializers import BulkCommentSerializer
+from rest_framework import generics
+from rest_framework import status
 from rest_framework.exceptions import ValidationError
 from rest_framework.response import Response
 
@@ -22,6 +30,14 @@ class CommentListCreateView(views.ListCreateView):
         if self.resource_url_kwarg is None:
             self.resource_url_kwarg = self.resource_name + '_id'
 
+    def get_queryset(self):
+        """
+        Comments of the resource in url, which also prunes partitions
+        of a partitioned comment table.
+        """
+        pk = self.kwargs.get(self.resource_url_kwarg)
+        return filter_by_resource(super().get_queryset(), self.resource_name, pk)
+
     def create(self, request, *args, **kwargs):
         """
         Get resource id from url params, before passing the request to serializers,
@@ -46,11 +62,12 @@ class CommentListCreateView(views.ListCreateView):
         """
         Handle rating constraints
         """
+        rating = serializer.validated_data.get('rating', None)
+        validate_rating(rating)
         try:
             with transaction.atomic():
                 resource = serializer.validated_data.get(self.resource_name)
-                rating = serializer.validated_data.get('rating', None)
-                self.update_resource_rating(resource, rating)
+                update_resource(resource, 1, *get_rating_delta(None, rating))
                 try:
                     serializer.save()
                 except IntegrityError as e:
@@ -64,27 +81,12 @@ class CommentListCreateView(views.ListCreateView):
                 "Integrity error occurred when creating new comment. " + e.__str__()
             )
 
-    def update_resource_rating(self, resource, rating):
-        validate_rating(rating)
-        assert hasattr(resource, 'comments'), (
-            "`%s` has no field `comments`."
-            % resource.__class__.__name__
-        )
-        if rating is None:
-            return
-        if resource.rating is not None:
-            resource.rating_number += 1
-            resource.rating_total_score += int(rating * 2)
-        else:
-            resource.rating_number = 1
-            resource.rating_total_score = int(rating * 2)
-        resource.save()
-
 
 class CommentRetrieveUpdateDestroyView(views.RetrieveUpdateDestroyView):
     """
-    Handle rating.
+    Handle rating and comments count.
     DELETE PATCH UPDATE will change rating.
+    A deleted comment can only be updated with `restore=true`, which restores it.
     """
 
     # for example book/file/record
@@ -97,6 +99,11 @@ class CommentRetrieveUpdateDestroyView(views.RetrieveUpdateDestroyView):
         if self.resource_url_kwarg is None:
             self.resource_url_kwarg = self.resource_name + '_id'
 
+    def get_queryset(self):
+        """ look up the comment under the resource in url, see `CommentListCreateView.get_queryset` """
+        pk = self.kwargs.get(self.resource_url_kwarg)
+        return filter_by_resource(super().get_queryset(), self.resource_name, pk)
+
     def perform_destroy(self, instance):
         resource = getattr(instance, self.resource_name)
         assert hasattr(resource, 'comments'), (
@@ -105,8 +112,7 @@ class CommentRetrieveUpdateDestroyView(views.RetrieveUpdateDestroyView):
         )
         try:
             with transaction.atomic():
-                if instance.rating:
-                    self.decrease_resource_rating(resource, instance.rating)
+                update_resource(resource, -1, *get_rating_delta(instance.rating, None))
                 instance.is_deleted = True
                 instance.save()
         except IntegrityError as e:
@@ -122,8 +128,9 @@ class CommentRetrieveUpdateDestroyView(views.RetrieveUpdateDestroyView):
         )
         try:
             with transaction.atomic():
-                if instance.rating:
-                    self.decrease_resource_rating(resource, instance.rating)
+                # rating and count of deleted comment have been substracted already
+                if not instance.is_deleted:
+                    update_resource(resource, -1, *get_rating_delta(instance.rating, None))
                 instance.delete()
         except IntegrityError as e:
             raise IntegrityError(
@@ -135,8 +142,16 @@ class CommentRetrieveUpdateDestroyView(views.RetrieveUpdateDestroyView):
         partial = kwargs.pop('partial', False)
         instance = self.get_object()
 
+        views.check_is_deleted_field(instance._meta.model)
+        cleaned_params = dict((k.lower(), v) for k, v in request.query_params.items())
+        if instance.is_deleted and cleaned_params.get('restore') != 'true':
+            raise Http404
+
+        precondition_failed = self.evaluate_preconditions(request, *self.get_validators(instance))
+        if precondition_failed is not None:
+            return precondition_failed
+
         views.check_edited_time_field(instance._meta.model)
-        instance.edited_time = timezone.now()
 
         # for PUT method, get resource id from url
         if not partial and request.data.get(self.resource_name, None) is None:
@@ -150,15 +165,51 @@ class CommentRetrieveUpdateDestroyView(views.RetrieveUpdateDestroyView):
             # forcibly invalidate the prefetch cache on the instance.
             instance._prefetched_objects_cache = {}
 
-        return Response(serializer.data)
+        response = Response(serializer.data)
+        views.set_validator_headers(response, *self.get_validators(instance))
+        return response
 
     def perform_update(self, serializer, instance):
+        # the resource is left untouched by a request that changes nothing
+        changed = instance.is_deleted or any(
+            getattr(instance, attr) != value for attr, value in serializer.validated_data.items()
+        )
+        if instance.is_deleted:
+            # restore, rating of the deleted comment has been substracted
+            comments_count = 1
+            old_rating = None
+            new_rating = serializer.validated_data.get('rating', instance.rating)
+            instance.is_deleted = False
+        else:
+            comments_count = 0
+            old_rating = instance.rating
+            # specified null rating and non-specified rating will both be cleaned
+            # to be None by serializer's validation. Access request data to distinguish.
+            # Assume rating is not mandatory, PUT and PATCH will have the same effect
+            # on rating field.
+            new_rating = serializer.validated_data.get('rating', None)
+            rating_cleared = 'rating' in self.request.data and self.request.data.get('rating') is None
+            if new_rating is None and not rating_cleared:
+                new_rating = old_rating
+        validate_rating(new_rating)
+
+        old_resource = getattr(instance, self.resource_name)
+        new_resource = serializer.validated_data.get(self.resource_name, old_resource)
+        if new_resource.pk == old_resource.pk:
+            changes = [(old_resource, comments_count, *get_rating_delta(old_rating, new_rating))]
+        else:
+            # moved, the comment leaves the old resource and joins the new one
+            changes = [
+                (old_resource, comments_count - 1, *get_rating_delta(old_rating, None)),
+                (new_resource, 1, *get_rating_delta(None, new_rating)),
+            ]
         try:
             with transaction.atomic():
-                resource = getattr(instance, self.resource_name)
-                new_rating = serializer.validated_data.get('rating', None)
-                old_rating = instance.rating
-                self.update_resource_rating(resource, old_rating, new_rating, serializer.partial)
+                if changed:
+                    # even without rating change, so that `edited_time` of the resource is bumped;
+                    # lock in pk order, like bulk writes
+                    for resource, *delta in sorted(changes, key=lambda change: change[0].pk):
+                        update_resource(resource, *delta)
                 try:
                     serializer.save()
                 except IntegrityError as e:
@@ -172,78 +223,228 @@ class CommentRetrieveUpdateDestroyView(views.RetrieveUpdateDestroyView):
                 "Integrity error occurred when updating comment. " + e.__str__()
             )
 
-    def decrease_resource_rating(self, resource, old_rating):
-        """ adjust the rating of resource when deleting comment """
-        assert hasattr(resource, 'comments'), (
-            "`%s` has no field `comments`."
-            % resource.__class__.__name__
-        )
-        if resource.rating_number == 1:
-            resource.rating = None
-            resource.rating_number = None
-            resource.rating_total_score = None
-        elif resource.rating_number >= 2:
-            resource.rating_number -= 1;
-            resource.rating_total_score -= int(old_rating * 2)
-        resource.save()
-
-    def update_resource_rating(self, resource, old_rating, new_rating, partial):
-        """ update the resource rating when update or partially update """
-        validate_rating(new_rating)
-        assert hasattr(resource, 'comments'), (
-            "`%s` has no field `comments`."
-            % resource.__class__.__name__
+
+def filter_by_resource(queryset, resource_name, pk):
+    if pk is None:
+        return queryset
+    return queryset.filter(**{resource_name: pk})
+
+
+def get_rating_delta(old_rating, new_rating):
+    """ change of rating number and doubled rating total score when a comment rating changes """
+    rating_number = (new_rating is not None) - (old_rating is not None)
+    rating_total_score = (
+        (int(new_rating * 2) if new_rating is not None else 0)
+        - (int(old_rating * 2) if old_rating is not None else 0)
+    )
+    return rating_number, rating_total_score
+
+
+def update_resource(resource, comments_count, rating_number, rating_total_score):
+    """
+    Apply changes of a comment write to its resource, must be called inside a transaction.
+    The resource row is locked and saved, or with `COALESCE_RATING_UPDATES` on,
+    the changes are appended to `RatingDelta` for command `flush_rating_deltas`,
+    so that writes to a hot resource don't queue on its row lock.
+    """
+    if getattr(settings, 'COALESCE_RATING_UPDATES', False):
+        # activity is counted by the flusher as well
+        RatingDelta.objects.create(
+            resource_type=resource._meta.label_lower,
+            resource_id=resource.pk,
+            comments_count=comments_count,
+            rating_number=rating_number,
+            rating_total_score=rating_total_score,
         )
+        return
+    resource = lock_resource(resource)
+    resource.apply_delta(comments_count, rating_number, rating_total_score)
+    now = timezone.now()
+    resource.record_activity(1, now)
+    # a change of any comment is a change of the resource
+    resource.edited_time = now
+    resource.save()
 
-        if old_rating == new_rating:
-            return
-        if new_rating is not None:
-            # # exclude "deleted" objects to keep integrity
-            # rating_quantity = resource.comments.filter(is_deleted=False).exclude(rating=None).count()
-            # # XOR conditions to test integrity of db
-            # if (resource.rating is not None and rating_quantity == 0)\
-            # or (resource.rating is None and rating_quantity != 0):
-            #     raise IntegrityError("comment rating and resource rating don't match.")
-            if resource.rating is None:
-                resource.rating_total_score = int(new_rating * 2)
-                resource.rating_number = 1
-            else:
-                # add new rating to resource
-                if old_rating is None:
-                    resource.rating_number += 1
-                    resource.rating_total_score += int(new_rating * 2)
-                # update rating
-                else:
-                    resource.rating_total_score += int((new_rating - old_rating) * 2)
-            resource.save()
-        else:
-            # old_rating is not None and new_rating is None, substract rating from resource.
 
-            # specified null rating and non-specified rating will both be cleaned
-            # to be None by serializer's validation. Access request data to distinguish.
-            # Assume rating is not mandatory, PUT and PATCH will have the same effect
-            # on rating field.
-            if 'rating' in self.request.data and self.request.data.get('rating') is None:
-                self.decrease_resource_rating(resource, old_rating)
+def lock_resource(resource):
+    """
+    Reload the resource with a row lock, so that concurrent comment writes
+    don't overwrite each other's rating and count.
+    Must be called inside a transaction.
+    """
+    return resource.__class__._default_manager.select_for_update().get(pk=resource.pk)
+
+
+RATING_CHOICES = [str(x / 10) for x in range(0, 55, 5)]
+_RATING_CHOICE_SET = frozenset(RATING_CHOICES)
 
 
 def validate_rating(rating):
     """
     Check if input rating is in str sequence 0.0, 0.5, ..., 5.0.
     """
-    if rating is None:
-        return True
-    valid_choices = [str(x / 10) for x in range(0, 55, 5)]
-    if str(rating) in valid_choices:
+    if rating is None or str(rating) in _RATING_CHOICE_SET:
         return True
     else:
-        msg = {'detail': "Rating must be one of %s" % str([float(x) for x in valid_choices])}
+        msg = {'detail': "Rating must be one of %s" % str([float(x) for x in RATING_CHOICES])}
         raise ValidationError(msg)
 
 
+def validate_ratings(ratings):
+    """
+    Batch version of `validate_rating`, return indexes of invalid ratings.
+    """
+    return [
+        index for index, rating in enumerate(ratings)
+        if rating is not None and str(rating) not in _RATING_CHOICE_SET
+    ]
+
+
+class CommentBulkCreateView(generics.GenericAPIView):
+    """
+    Create many comments in one request, see `bulk_create_comments`.
+    Request body is a list of comments, each of which has resource id specified.
+    """
+
+    # for example book/file/record
+    resource_name = None
+    max_items = 10000
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        assert self.resource_name is not None, "`resource_name` required."
+
+    def post(self, request, *args, **kwargs):
+        if not isinstance(request.data, list):
+            raise ValidationError({'detail': "Expected a list of comments."})
+        if len(request.data) > self.max_items:
+            raise ValidationError({'detail': f"At most {self.max_items} comments in one request."})
+        model = self.get_queryset().model
+        results = bulk_create_comments(model, self.resource_name, request.data)
+        created = sum(1 for result in results if 'id' in result)
+        code = status.HTTP_201_CREATED if created == len(results) else status.HTTP_207_MULTI_STATUS
+        return Response({'created': created, 'results': results}, status=code)
+
+
+def bulk_create_comments(comment_model, resource_name, items, batch_size=1000):
+    """
+    Create comments from dicts with keys `resource_name`, `user_id`, `rating` and `content`.
+    Return a result for each item, `{'index': i, 'id': pk}` when created,
+    or `{'index': i, 'errors': {...}}` when rejected.
+    """
+    resource_field = comment_model._meta.get_field(resource_name)
+    resource_model = resource_field.related_model
+    errors = {}
+    valid = {}
+
+    # field validation, no database access
+    for index, item in enumerate(items):
+        if not isinstance(item, dict):
+            errors[index] = {'detail': "Comment must be an object."}
+            continue
+        data = dict(item)
+        data['resource'] = data.pop(resource_name, None)
+        serializer = BulkCommentSerializer(data=data)
+        if serializer.is_valid():
+            valid[index] = serializer.validated_data
+        else:
+            errors[index] = {
+                (resource_name if key == 'resource' else key): value
+                for key, value in serializer.errors.items()
+            }
+
+    indexes = list(valid)
+    for position in validate_ratings([valid[index].get('rating') for index in indexes]):
+        index = indexes[position]
+        errors[index] = {'rating': ["Rating must be one of %s" % str([float(x) for x in RATING_CHOICES])]}
+        del valid[index]
+
+    resource_ids = sorted({data['resource'] for data in valid.values()})
+    with transaction.atomic():
+        # lock in pk order, the same rows are locked by single comment writes
+        resources = {
+            resource.pk: resource
+            for resource in resource_model._default_manager.select_for_update()
+            .filter(pk__in=resource_ids, is_deleted=False).order_by('pk')
+        }
+        existing = set(
+            comment_model._default_manager.filter(
+                **{f'{resource_name}__in': list(resources)},
+                user_id__in={data['user_id'] for data in valid.values()},
+                is_deleted=False,
+            ).values_list(resource_field.attname, 'user_id')
+        )
+
+        comments = []
+        created_indexes = []
+        for index, data in valid.items():
+            key = (data['resource'], data['user_id'])
+            if data['resource'] not in resources:
+                errors[index] = {resource_name: [f"Invalid pk \"{data['resource']}\" - object does not exist."]}
+            elif key in existing:
+                errors[index] = {'non_field_errors': [f"The fields user_id, {resource_name} must make a unique set."]}
+            else:
+                existing.add(key)
+                comments.append(comment_model(
+                    **{resource_field.attname: data['resource']},
+                    user_id=data['user_id'],
+                    rating=data.get('rating'),
+                    content=data.get('content', ''),
+                ))
+                created_indexes.append(index)
+        comment_model._default_manager.bulk_create(comments, batch_size=batch_size)
+
+        # aggregate rating and count per resource, then one bulk update
+        deltas = defaultdict(lambda: [0, 0, 0])
+        for comment in comments:
+            delta = deltas[getattr(comment, resource_field.attname)]
+            delta[0] += 1
+            if comment.rating is not None:
+                delta[1] += 1
+                delta[2] += int(comment.rating * 2)
+        now = timezone.now()
+        changed = []
+        for pk, (count, rating_number, rating_total_score) in deltas.items():
+            resource = resources[pk]
+            resource.apply_delta(count, rating_number, rating_total_score)
+            resource.record_activity(count, now)
+            resource.edited_time = now
+            changed.append(resource)
+        resource_model._default_manager.bulk_update(
+            changed,
+            [
+                'comments_count', 'rating_number', 'rating_total_score', 'rating', 'weighted_rating',
+                'trending_score', 'edited_time',
+            ],
+            batch_size=batch_size,
+        )
+        bump_generation(resource_model)
+
+    results = [{'index': index, 'errors': error} for index, error in errors.items()]
+    results += [{'index': index, 'id': comment.pk} for index, comment in zip(created_indexes, comments)]
+    return sorted(results, key=lambda result: result['index'])
+
+
+class ExactRatingMixin:
+    """
+    With `COALESCE_RATING_UPDATES` on, `GET` with `exact=true` applies rating
+    deltas not yet flushed to the returned resource, see `update_resource`.
+    """
+
+    def get_object(self):
+        instance = super().get_object()
+        if self.request.method == 'GET' and getattr(settings, 'COALESCE_RATING_UPDATES', False):
+            cleaned_params = dict((k.lower(), v) for k, v in self.request.query_params.items())
+            if cleaned_params.get('exact') == 'true':
+                instance.apply_pending_deltas()
+        return instance
+
+
 class UpdateLocalFileMixin:
     """
     Used to delete the previous local file when resource changes.
+    With `common.storage.ContentAddressedStorage` deleting only releases a
+    reference, the file is removed later by command `sweep_blobs`.
     """
     # NOTE make sure in MRO this mixin is prior to other so that
     # the methods can overwrite
@@ -265,22 +466,23 @@ class UpdateLocalFileMixin:
             )
 
     def perform_hard_destroy(self, instance):
-        """ handle DELETE """
+        """ handle DELETE, references are released along with the deletion """
         self.check_file_fields(instance)
-        for file_field in self.file_fields:
-            getattr(instance, file_field).delete(save=False)
-        instance.delete()
+        with transaction.atomic():
+            for file_field in self.file_fields:
+                getattr(instance, file_field).delete(save=False)
+            instance.delete()
 
     def perform_update(self, serializer):
-        """ handle PUT and PATCH """
-        # TODO do something to ensure integrity
+        """ handle PUT and PATCH, references are released only if the save succeeds """
         self.check_file_fields(serializer.instance)
-        if serializer.partial:
-            for file_field in self.file_fields:
-                if serializer.validated_data.get(file_field) is not None:
-                    getattr(serializer.instance, file_field).delete(save=False)
-        else:
-            for file_field in self.file_fields:
-                if serializer.validated_data.get(file_field) is None:
-                    getattr(serializer.instance, file_field).delete(save=False)
-        serializer.save()
+        with transaction.atomic():
+            if serializer.partial:
+                for file_field in self.file_fields:
+                    if serializer.validated_data.get(file_field) is not None:
+                        getattr(serializer.instance, file_field).delete(save=False)
+            else:
+                for file_field in self.file_fields:
+                    if serializer.validated_data.get(file_field) is None:
+                        getattr(serializer.instance, file_field).delete(save=False)
+            serializer.save()
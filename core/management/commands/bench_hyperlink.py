@@ -0,0 +1,59 @@
+import time
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework import serializers
+from rest_framework.relations import PKOnlyObject
+from rest_framework.request import Request
+from rest_framework.reverse import reverse
+from rest_framework.test import APIRequestFactory
+from core.serializers import PrimayKeyHyperlinkField
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare the time to render hyperlinks of `PrimayKeyHyperlinkField` "
+        "with calling `reverse()` for every value, and check that both give the same urls."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--view-name', default='books:book_retrieve_update_delete')
+        parser.add_argument('--lookup-url-kwarg', default='book_id')
+        parser.add_argument('--count', type=int, default=100000, help="Hyperlinks rendered per round.")
+        parser.add_argument('--rounds', type=int, default=5)
+
+    def handle(self, *args, **options):
+        view_name = options['view_name']
+        lookup_url_kwarg = options['lookup_url_kwarg']
+        request = Request(APIRequestFactory().get('/books/', SERVER_NAME='localhost'))
+
+        class HyperlinkSerializer(serializers.Serializer):
+            link = PrimayKeyHyperlinkField(
+                read_only=True, view_name=view_name, lookup_url_kwarg=lookup_url_kwarg
+            )
+
+        field = HyperlinkSerializer(context={'request': request}).fields['link']
+        values = [PKOnlyObject(pk=pk) for pk in range(1, options['count'] + 1)]
+
+        expected = [reverse(view_name, kwargs={lookup_url_kwarg: value.pk}, request=request) for value in values]
+        actual = [str(field.to_representation(value)) for value in values]
+        if actual != expected:
+            index = next(i for i, (a, b) in enumerate(zip(actual, expected)) if a != b)
+            raise CommandError(f"Url mismatch: `{actual[index]}` != `{expected[index]}`.")
+
+        def compiled():
+            for value in values:
+                field.to_representation(value)
+
+        def reversed_():
+            for value in values:
+                reverse(view_name, kwargs={lookup_url_kwarg: value.pk}, request=request)
+
+        for name, func in (('reverse', reversed_), ('compiled', compiled)):
+            timings = []
+            for _ in range(options['rounds']):
+                started = time.perf_counter()
+                func()
+                timings.append(time.perf_counter() - started)
+            best = min(timings)
+            self.stdout.write(
+                f"{name:<10}{best * 1000:>10.1f} ms{best / len(values) * 1e6:>10.2f} us/link"
+            )
@@ -0,0 +1,156 @@
+import time
+from contextlib import ExitStack
+from hashlib import sha1
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import OperationalError, connections
+from rest_framework.permissions import SAFE_METHODS
+from core import profiling, routers, slowquery
+
+
+class ReplicaRoutingMiddleware:
+    """
+    Let safe-method requests read from replicas.
+    After a write the client is pinned to the primary for `REPLICA_PIN_SECONDS`,
+    so it never misses its own writes because of replication lag. The pin is
+    returned as a cookie and as header `X-Primary-Pin`, which clients without
+    cookies send back, and is also kept in the cache for clients sending header
+    `X-Client-Id`. Clients are not told apart by address, behind a proxy or NAT
+    one write would pin everybody.
+    A replica is chosen per request, and a safe-method request failing on it is
+    run again on the primary.
+    """
+
+    cookie_name = 'primary_pin'
+    header_name = 'X-Primary-Pin'
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        is_write = request.method not in SAFE_METHODS
+        pinned = is_write or self.is_pinned(request)
+        routers.use_replicas(not pinned)
+        try:
+            response = self.get_response(request)
+        finally:
+            routers.use_replicas(False)
+
+        if is_write:
+            pin_seconds = getattr(settings, 'REPLICA_PIN_SECONDS', 15)
+            expires = int(time.time()) + pin_seconds
+            response.set_cookie(self.cookie_name, '1', max_age=pin_seconds, httponly=True)
+            response[self.header_name] = str(expires)
+            client_key = self.get_client_key(request)
+            if client_key is not None:
+                cache.set(client_key, expires, pin_seconds)
+        return response
+
+    def is_pinned(self, request):
+        if request.COOKIES.get(self.cookie_name) is not None:
+            return True
+        try:
+            if int(request.META.get('HTTP_X_PRIMARY_PIN', 0)) > time.time():
+                return True
+        except ValueError:
+            pass
+        client_key = self.get_client_key(request)
+        return client_key is not None and cache.get(client_key) is not None
+
+    def get_client_key(self, request):
+        """ cache key of the pin of the client, None if it doesn't identify itself """
+        client = request.META.get('HTTP_X_CLIENT_ID')
+        if not client:
+            return None
+        return 'primary_pin:' + sha1(client.encode()).hexdigest()
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request.replica_view = (view_func, view_args, view_kwargs)
+
+    def process_exception(self, request, exception):
+        """ run the view again on the primary when a replica fails, reads are safe to repeat """
+        if not isinstance(exception, OperationalError) or not routers.replicas_enabled():
+            return None
+        failed = routers.get_used_replicas()
+        if not failed or getattr(request, 'replica_view', None) is None:
+            return None
+        for alias in failed:
+            routers.mark_unhealthy(alias)
+        routers.use_replicas(False)
+        view_func, view_args, view_kwargs = request.replica_view
+        return view_func(request, *view_args, **view_kwargs)
+
+
+class SlowQueryMiddleware:
+    """
+    Time every query of a request on all databases, and record those slower than
+    `SLOW_QUERY_THRESHOLD_MS` with the view name, see `core.slowquery`.
+    Disabled when the threshold is None.
+    """
+
+    def __init__(self, get_response):
+        threshold = getattr(settings, 'SLOW_QUERY_THRESHOLD_MS', None)
+        if threshold is None:
+            raise MiddlewareNotUsed
+        self.threshold = threshold / 1000
+        self.get_response = get_response
+
+    def __call__(self, request):
+        timer = slowquery.QueryTimer(self.threshold)
+        request.slow_query_view = None
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(timer))
+            response = self.get_response(request)
+
+        if timer.queries:
+            slowquery.record(timer.queries, request.slow_query_view, request.method, request.get_full_path())
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        match = request.resolver_match
+        request.slow_query_view = match.view_name if match else view_func.__name__
+
+
+class ProfilerMiddleware:
+    """
+    Profile requests asked for by admins with header `Profile: true`, and a sample
+    of `PROFILE_SAMPLE_RATE` of the others, see `core.profiling`. Profiles are
+    dumped tagged with the view class, and requests asked for get the top
+    `PROFILE_SUMMARY_SIZE` functions in header `Profile-Summary`.
+    Disabled when neither admins nor sampling can trigger it.
+    """
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'ADMIN_SECRET_KEY', None) and not getattr(settings, 'PROFILE_SAMPLE_RATE', 0):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        requested = profiling.is_requested(request)
+        if not requested and not profiling.is_sampled():
+            return self.get_response(request)
+        profiler = profiling.start()
+        if profiler is None:
+            return self.get_response(request)
+
+        request.profile_view = None
+        started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            profiler.disable()
+        duration = time.perf_counter() - started
+
+        name = profiling.dump(profiler, request.profile_view, request.method, duration)
+        if requested:
+            response['Profile-Summary'] = profiling.summarize(
+                profiler, getattr(settings, 'PROFILE_SUMMARY_SIZE', 10)
+            )
+            if name is not None:
+                response['Profile-File'] = name
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request.profile_view = profiling.get_view_tag(view_func)
@@ -0,0 +1,18 @@
+import hmac
+from hashlib import sha256
+from django.conf import settings
+from rest_framework import permissions
+
+
+class IsAdmin(permissions.BasePermission):
+    """
+    Allow requests carrying SHA256 encrypted `ADMIN_SECRET_KEY` in http header 'Admin-Key'.
+    Nobody is allowed when `ADMIN_SECRET_KEY` is not set.
+    """
+
+    def has_permission(self, request, view):
+        admin_key = getattr(settings, 'ADMIN_SECRET_KEY', None)
+        key = request.META.get('HTTP_ADMIN_KEY')
+        if not admin_key or not key:
+            return False
+        return hmac.compare_digest(key.lower(), sha256(admin_key.encode()).hexdigest())
@@ -0,0 +1,94 @@
+"""
+Per-request profiling with cProfile, see `core.middleware.ProfilerMiddleware`.
+A request is profiled when it carries header `Profile: true` with a valid
+`Admin-Key`, or by a sample of `PROFILE_SAMPLE_RATE`. Stats are dumped to
+`PROFILE_DIR` as `.pstats` files named after the view, which snakeviz,
+flameprof or gprof2dot can render, and only the latest `PROFILE_MAX_FILES`
+are kept. Only requests profiled on demand get the summary in response headers.
+"""
+
+import cProfile
+import logging
+import os
+import pstats
+import random
+import re
+from django.conf import settings
+from django.utils import timezone
+from core.permissions import IsAdmin
+from core.slowquery import TokenBucket
+
+
+logger = logging.getLogger('core.profiling')
+
+sample_bucket = TokenBucket(getattr(settings, 'PROFILE_MAX_PER_MINUTE', 6))
+
+
+def is_requested(request):
+    """ whether the request asks to be profiled, and is allowed to """
+    return request.META.get('HTTP_PROFILE', '').lower() == 'true' and IsAdmin().has_permission(request, None)
+
+
+def is_sampled():
+    sample_rate = getattr(settings, 'PROFILE_SAMPLE_RATE', 0)
+    return sample_rate > 0 and random.random() < sample_rate and sample_bucket.consume()
+
+
+def start():
+    """ return an enabled profiler, or None if another one is active in this process """
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError:
+        # since Python 3.12 only one profiler can be active at a time
+        return None
+    return profiler
+
+
+def get_view_tag(view_func):
+    """ class name of class based views, function name of the others """
+    return getattr(view_func, 'view_class', view_func).__name__
+
+
+def summarize(profiler, size):
+    """ the top functions by cumulative time, as `file:line(function)=ms/calls` joined by commas """
+    stats = pstats.Stats(profiler)
+    rows = sorted(stats.stats.items(), key=lambda item: -item[1][3])[:size]
+    summary = ', '.join(
+        f"{os.path.basename(filename)}:{line}({function})={cumulative * 1000:.1f}ms/{calls}"
+        for (filename, line, function), (_, calls, _, cumulative, _) in rows
+    )
+    # header values are latin-1
+    return summary.encode('ascii', 'replace').decode()
+
+
+def dump(profiler, view_tag, method, duration):
+    """ write the stats of a request to `PROFILE_DIR`, return the file name or None """
+    directory = getattr(settings, 'PROFILE_DIR', None)
+    if not directory:
+        return None
+    name = '{}-{}-{}-{}ms.pstats'.format(
+        timezone.now().strftime('%Y%m%dT%H%M%S%f'),
+        re.sub(r'[^\w.]', '_', view_tag or 'unknown'),
+        method,
+        round(duration * 1000),
+    )
+    try:
+        os.makedirs(directory, exist_ok=True)
+        profiler.dump_stats(os.path.join(directory, name))
+        prune(directory, getattr(settings, 'PROFILE_MAX_FILES', 100))
+    except OSError:
+        logger.exception("Failed to dump profile.")
+        return None
+    return name
+
+
+def prune(directory, max_files):
+    """ delete the oldest dumps beyond `max_files`, names start with the time """
+    names = sorted(name for name in os.listdir(directory) if name.endswith('.pstats'))
+    for name in names[:max(len(names) - max_files, 0)]:
+        try:
+            os.remove(os.path.join(directory, name))
+        except FileNotFoundError:
+            # pruned by another process
+            pass
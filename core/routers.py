@@ -0,0 +1,102 @@
+"""
+Database router sending reads to replicas and writes to the primary.
+Whether a read may go to a replica is decided per request by
+`core.middleware.ReplicaRoutingMiddleware`; outside of a request (management
+commands, shell) every query goes to the primary.
+"""
+
+import random
+import threading
+import time
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.db.utils import DatabaseError
+
+
+_state = threading.local()
+
+# alias => (healthy, checked at)
+_health = {}
+
+
+def use_replicas(enabled=True):
+    """
+    Allow or forbid reads from replicas for the current thread, and forget replicas used so far.
+    One replica is chosen for all the reads, so that they see the same replication lag.
+    """
+    _state.replica = choose_replica() if enabled else DEFAULT_DB_ALIAS
+    _state.used = set()
+
+
+def replicas_enabled():
+    """ whether reads of the current thread go to a replica """
+    return getattr(_state, 'replica', DEFAULT_DB_ALIAS) != DEFAULT_DB_ALIAS
+
+
+def get_used_replicas():
+    """ replicas read from by the current thread since `use_replicas` """
+    return set(getattr(_state, 'used', ()))
+
+
+def mark_unhealthy(alias):
+    """ skip the replica until it is checked again """
+    connections[alias].close()
+    _health[alias] = (False, time.monotonic())
+
+
+def get_replicas():
+    return [alias for alias in getattr(settings, 'REPLICA_DATABASES', []) if alias in settings.DATABASES]
+
+
+def is_healthy(alias):
+    """
+    Check replica connectivity, results are cached for
+    `REPLICA_HEALTH_CHECK_INTERVAL` seconds.
+    """
+    interval = getattr(settings, 'REPLICA_HEALTH_CHECK_INTERVAL', 10)
+    now = time.monotonic()
+    healthy, checked_at = _health.get(alias, (None, 0))
+    if healthy is not None and now - checked_at < interval:
+        return healthy
+    connection = connections[alias]
+    try:
+        connection.ensure_connection()
+        healthy = connection.is_usable()
+    except DatabaseError:
+        healthy = False
+    if not healthy:
+        connection.close()
+    _health[alias] = (healthy, now)
+    return healthy
+
+
+def choose_replica():
+    """ pick a healthy replica at random, fall back to the primary """
+    candidates = get_replicas()
+    random.shuffle(candidates)
+    for alias in candidates:
+        if is_healthy(alias):
+            return alias
+    return DEFAULT_DB_ALIAS
+
+
+class PrimaryReplicaRouter:
+    """
+    Replicas are expected to hold the same data as the primary, which is the
+    only database that is written to and migrated.
+    """
+
+    def db_for_read(self, model, **hints):
+        alias = getattr(_state, 'replica', DEFAULT_DB_ALIAS)
+        if alias != DEFAULT_DB_ALIAS:
+            _state.used.add(alias)
+        return alias
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == DEFAULT_DB_ALIAS
@@ -1,11 +1,40 @@
 from rest_framework import serializers
 from rest_framework.serializers import Hyperlink
 from rest_framework.reverse import reverse
-from django.urls import NoReverseMatch
+from rest_framework.settings import api_settings
+from django.urls import NoReverseMatch, get_script_prefix, get_urlconf
+from django.urls import reverse as django_reverse
 from django.core.exceptions import ImproperlyConfigured
+from django.utils.encoding import iri_to_uri
+
+
+# placeholder lookup value to compile a url into prefix and suffix,
+# acceptable by both `int` and `str` path converters
+URL_PLACEHOLDER = 7239058120937461
+
+# (urlconf, script prefix, view name, lookup url kwarg) => (prefix, suffix) or None
+_url_templates = {}
+
+
+def get_url_template(view_name, lookup_url_kwarg):
+    """
+    Reverse the url once per process with a placeholder and split it around it.
+    Return None if the url can't be built by substitution.
+    """
+    key = (get_urlconf(), get_script_prefix(), view_name, lookup_url_kwarg)
+    if key not in _url_templates:
+        url = django_reverse(view_name, kwargs={lookup_url_kwarg: URL_PLACEHOLDER})
+        parts = url.split(str(URL_PLACEHOLDER))
+        _url_templates[key] = tuple(parts) if len(parts) == 2 else None
+    return _url_templates[key]
 
 
 class PrimayKeyHyperlinkField(serializers.PrimaryKeyRelatedField):
+    """
+    Primary key related field represented by hyperlink.
+    Integer lookup values are substituted into a url template compiled once per
+    process, instead of calling `reverse()` for every value; the output is the same.
+    """
 
     def __init__(self, **kwargs):
         self.view_name = kwargs.pop('view_name', None)
@@ -17,6 +46,8 @@ class PrimayKeyHyperlinkField(serializers.PrimaryKeyRelatedField):
         if self.lookup_field is None:
             self.lookup_field = 'pk'
         self.reverse = reverse
+        # (request, view name, absolute prefix, suffix) of the current request
+        self._compiled_url = None
 
         super().__init__(**kwargs)
 
@@ -78,5 +109,34 @@ class PrimayKeyHyperlinkField(serializers.PrimaryKeyRelatedField):
             return None
 
         lookup_value = getattr(obj, self.lookup_field)
+        if type(lookup_value) is int and format is None:
+            compiled_url = self.get_compiled_url(view_name, request)
+            if compiled_url is not None:
+                prefix, suffix = compiled_url
+                return prefix + str(lookup_value) + suffix
+
         kwargs = {self.lookup_url_kwarg: lookup_value}
         return self.reverse(view_name, kwargs=kwargs, request=request, format=format)
+
+    def get_compiled_url(self, view_name, request):
+        """
+        Return absolute url prefix and suffix around the lookup value, computed once per request.
+        Return None when `reverse()` would do more than building the url,
+        e.g. versioning or format override.
+        """
+        if self._compiled_url is not None:
+            compiled_request, compiled_view_name, prefix, suffix = self._compiled_url
+            if compiled_request is request and compiled_view_name == view_name:
+                return prefix, suffix
+        if request is None or getattr(request, 'versioning_scheme', None) is not None:
+            return None
+        if api_settings.URL_FORMAT_OVERRIDE and api_settings.URL_FORMAT_OVERRIDE in request.GET:
+            return None
+        template = get_url_template(view_name, self.lookup_url_kwarg)
+        if template is None:
+            return None
+        prefix, suffix = template
+        # same as `request.build_absolute_uri(url)`, which percent-encodes characters one by one
+        compiled_url = (request.build_absolute_uri(prefix), iri_to_uri(suffix))
+        self._compiled_url = (request, view_name) + compiled_url
+        return compiled_url
@@ -0,0 +1,138 @@
+"""
+Capture of slow queries.
+Queries running longer than `SLOW_QUERY_THRESHOLD_MS` during a request are
+recorded with the view that issued them; a sample of them is explained with
+EXPLAIN (ANALYZE, BUFFERS) after the response is built. Records are written to
+the `core.slow_query` logger and kept in a per-process ring buffer for the admin endpoint.
+Parameters may hold user data, so only their types are recorded. Plans show the
+values the query ran with, so they are kept in the buffer but not logged.
+"""
+
+import json
+import logging
+import random
+import threading
+import time
+from collections import deque
+from django.conf import settings
+from django.db import connections, transaction
+from django.utils import timezone
+
+
+logger = logging.getLogger('core.slow_query')
+
+_lock = threading.Lock()
+_recent = deque(maxlen=getattr(settings, 'SLOW_QUERY_BUFFER_SIZE', 200))
+
+
+class TokenBucket:
+    """ allow `rate` events per minute on average, and bursts of `capacity` """
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate / 60
+        self.capacity = capacity if capacity is not None else max(rate, 1)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def consume(self):
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens < 1:
+                return False
+            self.tokens -= 1
+            return True
+
+
+record_bucket = TokenBucket(getattr(settings, 'SLOW_QUERY_MAX_PER_MINUTE', 60))
+explain_bucket = TokenBucket(getattr(settings, 'SLOW_QUERY_EXPLAIN_MAX_PER_MINUTE', 6))
+
+
+class QueryTimer:
+    """ `execute_wrapper` collecting queries slower than the threshold """
+
+    def __init__(self, threshold):
+        self.threshold = threshold
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = time.perf_counter() - started
+            if duration >= self.threshold and not many:
+                self.queries.append((context['connection'].alias, sql, params, duration))
+
+
+def record(queries, view, method, path):
+    """ record slow queries of a request, subject to rate limits """
+    sample_rate = getattr(settings, 'SLOW_QUERY_EXPLAIN_SAMPLE_RATE', 0.1)
+    for alias, sql, params, duration in queries:
+        if not record_bucket.consume():
+            return
+        plan = None
+        if random.random() < sample_rate and explain_bucket.consume():
+            plan = explain(alias, sql, params)
+        entry = {
+            'time': timezone.now().isoformat(),
+            'view': view,
+            'method': method,
+            'path': path,
+            'database': alias,
+            'duration_ms': round(duration * 1000, 1),
+            'sql': sql,
+            'params': redact(params),
+            'plan': plan,
+        }
+        with _lock:
+            _recent.append(entry)
+        logger.warning(json.dumps(dict(entry, plan=plan is not None), ensure_ascii=False))
+
+
+def explain(alias, sql, params):
+    """
+    Return the EXPLAIN (ANALYZE, BUFFERS) plan of a select query, or None.
+    ANALYZE runs the query again, so it is done in a transaction that is rolled
+    back, under `SLOW_QUERY_EXPLAIN_TIMEOUT_MS`.
+    """
+    connection = connections[alias]
+    if connection.vendor != 'postgresql' or not sql.lstrip()[:6].upper() == 'SELECT':
+        return None
+    timeout = int(getattr(settings, 'SLOW_QUERY_EXPLAIN_TIMEOUT_MS', 5000))
+    try:
+        with transaction.atomic(using=alias):
+            with connection.cursor() as cursor:
+                cursor.execute(f"SET LOCAL statement_timeout = {timeout}")
+                cursor.execute(f"EXPLAIN (ANALYZE, BUFFERS) {sql}", params)
+                plan = '\n'.join(row[0] for row in cursor.fetchall())
+            transaction.set_rollback(True, using=alias)
+    except Exception as e:
+        logger.exception("Failed to explain slow query.")
+        return f"EXPLAIN failed: {e}"
+    return plan
+
+
+def get_recent():
+    """ return recorded entries of this process, newest first """
+    with _lock:
+        return list(reversed(_recent))
+
+
+def redact(params):
+    """ type names of query parameters in place of their values """
+    if params is None:
+        return None
+    if isinstance(params, dict):
+        return {key: redact_value(value) for key, value in params.items()}
+    return [redact_value(value) for value in params]
+
+
+def redact_value(value):
+    if value is None:
+        return None
+    if isinstance(value, (list, tuple)):
+        return f"{type(value).__name__}[{len(value)}]"
+    return type(value).__name__
@@ -1,3 +1,349 @@
-from django.test import TestCase
+import base64
+import os
+import shutil
+import tempfile
+import time
+from datetime import datetime
+from hashlib import sha256
+from unittest import mock
+from django.core.cache import cache
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import OperationalError
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, override_settings
+from django.utils import timezone
+from django.utils.http import http_date
+from rest_framework import serializers
+from rest_framework.exceptions import ParseError
+from rest_framework.relations import PKOnlyObject
+from rest_framework.request import Request
+from rest_framework.reverse import reverse
+from rest_framework.test import APIRequestFactory
+from core import profiling, routers, slowquery
+from core.middleware import ProfilerMiddleware, ReplicaRoutingMiddleware
+from core.serializers import PrimayKeyHyperlinkField
+from core.slowquery import TokenBucket
+from core.views import ConditionalRequestMixin, make_cursor, parse_cursor
 
-# Create your tests here.
+
+@override_settings(REPLICA_PIN_SECONDS=15)
+class ReplicaRoutingTests(SimpleTestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.factory = RequestFactory()
+        self.routed = []
+        self.middleware = ReplicaRoutingMiddleware(self.get_response)
+        patcher = mock.patch.object(routers, 'choose_replica', return_value='replica')
+        self.choose_replica = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def get_response(self, request):
+        self.routed.append(routers.replicas_enabled())
+        return HttpResponse()
+
+    def test_reads_use_replicas(self):
+        self.middleware(self.factory.get('/books/'))
+        self.assertEqual(self.routed, [True])
+        self.assertFalse(routers.replicas_enabled())
+
+    def test_no_replica_available(self):
+        self.choose_replica.return_value = 'default'
+        self.middleware(self.factory.get('/books/'))
+        self.assertEqual(self.routed, [False])
+
+    def test_one_replica_per_request(self):
+        aliases = []
+
+        def get_response(request):
+            router = routers.PrimaryReplicaRouter()
+            self.choose_replica.return_value = 'other'
+            aliases.extend(router.db_for_read(None) for _ in range(3))
+            return HttpResponse()
+        self.middleware.get_response = get_response
+        self.middleware(self.factory.get('/books/'))
+        self.assertEqual(aliases, ['replica'] * 3)
+        self.assertEqual(self.choose_replica.call_count, 1)
+
+    def test_write_pins(self):
+        response = self.middleware(self.factory.post('/books/'))
+        self.assertEqual(self.routed, [False])
+        self.assertIn('primary_pin', response.cookies)
+        self.assertAlmostEqual(int(response['X-Primary-Pin']), time.time() + 15, delta=2)
+
+    def test_pinned_by_cookie(self):
+        request = self.factory.get('/books/')
+        request.COOKIES['primary_pin'] = '1'
+        self.middleware(request)
+        self.assertEqual(self.routed, [False])
+
+    def test_pinned_by_header(self):
+        self.middleware(self.factory.get('/books/', HTTP_X_PRIMARY_PIN=str(int(time.time()) + 10)))
+        self.assertEqual(self.routed, [False])
+
+    def test_expired_or_malformed_header(self):
+        for value in [str(int(time.time()) - 1), 'yes', '']:
+            self.middleware(self.factory.get('/books/', HTTP_X_PRIMARY_PIN=value))
+        self.assertEqual(self.routed, [True, True, True])
+
+    def test_pinned_by_client(self):
+        self.middleware(self.factory.post('/books/', HTTP_X_CLIENT_ID='a'))
+        self.middleware(self.factory.get('/books/', HTTP_X_CLIENT_ID='a'))
+        self.middleware(self.factory.get('/books/', HTTP_X_CLIENT_ID='b'))
+        self.assertEqual(self.routed, [False, False, True])
+
+    def test_not_pinned_by_address(self):
+        # clients behind one proxy share the address
+        self.middleware(self.factory.post('/books/', REMOTE_ADDR='10.0.0.1'))
+        self.middleware(self.factory.get('/books/', REMOTE_ADDR='10.0.0.1'))
+        self.assertEqual(self.routed, [False, True])
+
+    def call_view(self, view):
+        """ run the view like the request handler, with exceptions passed to the middleware """
+        def get_response(request):
+            self.middleware.process_view(request, view, (), {})
+            try:
+                return view(request)
+            except Exception as e:
+                response = self.middleware.process_exception(request, e)
+                if response is None:
+                    raise
+                return response
+        self.middleware.get_response = get_response
+        return self.middleware(self.factory.get('/books/'))
+
+    def test_replica_failure_retried_on_primary(self):
+        aliases = []
+
+        def view(request):
+            aliases.append(routers.PrimaryReplicaRouter().db_for_read(None))
+            if aliases[-1] != 'default':
+                raise OperationalError("replica is down")
+            return HttpResponse('ok')
+
+        with mock.patch.object(routers, 'mark_unhealthy') as mark_unhealthy:
+            response = self.call_view(view)
+        self.assertEqual(response.content, b'ok')
+        self.assertEqual(aliases, ['replica', 'default'])
+        mark_unhealthy.assert_called_once_with('replica')
+
+    def test_primary_failure_not_retried(self):
+        calls = []
+
+        def view(request):
+            calls.append(routers.PrimaryReplicaRouter().db_for_read(None))
+            raise OperationalError("primary is down")
+
+        self.choose_replica.return_value = 'default'
+        with self.assertRaises(OperationalError):
+            self.call_view(view)
+        self.assertEqual(calls, ['default'])
+
+
+class CursorTests(SimpleTestCase):
+
+    def test_round_trip(self):
+        edited_time = datetime(2020, 1, 2, 3, 4, 5, 678901, tzinfo=timezone.utc)
+        cursor = make_cursor(edited_time, 42)
+        self.assertRegex(cursor, r'^[\w=-]+$')
+        self.assertEqual(parse_cursor(cursor), (edited_time, 42))
+
+    def test_round_trip_local_time(self):
+        edited_time = timezone.localtime(timezone.now())
+        self.assertEqual(parse_cursor(make_cursor(edited_time, 7)), (edited_time, 7))
+
+    def test_iso_time(self):
+        self.assertEqual(
+            parse_cursor('2020-01-02T03:04:05+00:00'),
+            (datetime(2020, 1, 2, 3, 4, 5, tzinfo=timezone.utc), 0),
+        )
+
+    def test_naive_iso_time_in_current_timezone(self):
+        edited_time, pk = parse_cursor('2020-01-02T03:04:05')
+        self.assertEqual(edited_time, timezone.make_aware(datetime(2020, 1, 2, 3, 4, 5)))
+        self.assertEqual(pk, 0)
+
+    def test_unix_timestamp(self):
+        self.assertEqual(parse_cursor('1577934245'), (datetime(2020, 1, 2, 3, 4, 5, tzinfo=timezone.utc), 0))
+        self.assertEqual(
+            parse_cursor('1577934245.5'), (datetime(2020, 1, 2, 3, 4, 5, 500000, tzinfo=timezone.utc), 0)
+        )
+
+    def test_malformed(self):
+        values = [
+            '',
+            'yesterday',
+            '1e400',
+            '2020-13-01T00:00:00',
+            base64.urlsafe_b64encode(b'abc|def').decode(),
+            base64.urlsafe_b64encode(b'2020-01-02T03:04:05+00:00|x').decode(),
+        ]
+        for value in values:
+            with self.assertRaises(ParseError):
+                parse_cursor(value)
+
+
+class PreconditionTests(SimpleTestCase):
+
+    etag = '"abc"'
+
+    def evaluate(self, method='get', last_modified=None, **headers):
+        request = getattr(RequestFactory(), method)('/books/1/', **headers)
+        return ConditionalRequestMixin().evaluate_preconditions(request, self.etag, last_modified)
+
+    def test_if_none_match(self):
+        response = self.evaluate(HTTP_IF_NONE_MATCH=self.etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], self.etag)
+        self.assertIsNone(self.evaluate(HTTP_IF_NONE_MATCH='"other"'))
+
+    def test_if_modified_since(self):
+        last_modified = int(time.time()) - 60
+        response = self.evaluate(last_modified=last_modified, HTTP_IF_MODIFIED_SINCE=http_date(last_modified))
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['Last-Modified'], http_date(last_modified))
+        self.assertIsNone(
+            self.evaluate(last_modified=last_modified, HTTP_IF_MODIFIED_SINCE=http_date(last_modified - 1))
+        )
+
+    def test_if_none_match_preferred(self):
+        last_modified = int(time.time()) - 60
+        self.assertIsNone(self.evaluate(
+            last_modified=last_modified,
+            HTTP_IF_NONE_MATCH='"other"',
+            HTTP_IF_MODIFIED_SINCE=http_date(last_modified),
+        ))
+
+    def test_recent_modification(self):
+        # another change may follow within the same second
+        last_modified = int(time.time())
+        self.assertIsNone(self.evaluate(last_modified=last_modified, HTTP_IF_MODIFIED_SINCE=http_date(last_modified)))
+
+    def test_if_match(self):
+        self.assertEqual(self.evaluate('put', HTTP_IF_MATCH='"other"').status_code, 412)
+        self.assertIsNone(self.evaluate('put', HTTP_IF_MATCH=self.etag))
+
+
+class TokenBucketTests(SimpleTestCase):
+
+    def setUp(self):
+        patcher = mock.patch.object(slowquery.time, 'monotonic', return_value=1000.0)
+        self.monotonic = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_burst_up_to_capacity(self):
+        bucket = TokenBucket(60, capacity=3)
+        self.assertEqual([bucket.consume() for _ in range(4)], [True, True, True, False])
+
+    def test_refill_at_rate(self):
+        # one token a second
+        bucket = TokenBucket(60, capacity=3)
+        for _ in range(3):
+            bucket.consume()
+        self.monotonic.return_value = 1000.5
+        self.assertFalse(bucket.consume())
+        self.monotonic.return_value = 1001.0
+        self.assertTrue(bucket.consume())
+        self.assertFalse(bucket.consume())
+
+    def test_refill_up_to_capacity(self):
+        bucket = TokenBucket(60, capacity=2)
+        bucket.consume()
+        bucket.consume()
+        self.monotonic.return_value = 2000.0
+        self.assertEqual([bucket.consume() for _ in range(3)], [True, True, False])
+
+    def test_default_capacity(self):
+        self.assertEqual(TokenBucket(6).capacity, 6)
+        bucket = TokenBucket(0)
+        self.assertTrue(bucket.consume())
+        self.monotonic.return_value = 10 ** 6
+        self.assertFalse(bucket.consume())
+
+
+class HyperlinkSerializer(serializers.Serializer):
+    link = PrimayKeyHyperlinkField(
+        read_only=True, view_name='books:book_retrieve_update_delete', lookup_url_kwarg='book_id'
+    )
+
+
+class PrimaryKeyHyperlinkFieldTests(SimpleTestCase):
+
+    pks = [1, 42, 10 ** 12]
+
+    def assertSameAsReverse(self, request, field=None):
+        if field is None:
+            field = HyperlinkSerializer(context={'request': request}).fields['link']
+        for pk in self.pks:
+            self.assertEqual(
+                str(field.to_representation(PKOnlyObject(pk=pk))),
+                reverse('books:book_retrieve_update_delete', kwargs={'book_id': pk}, request=request),
+            )
+        return field
+
+    def test_http(self):
+        self.assertSameAsReverse(Request(APIRequestFactory().get('/books/')))
+
+    def test_https_and_port(self):
+        request = APIRequestFactory().get('/books/', secure=True, HTTP_HOST='testserver:8443')
+        self.assertSameAsReverse(Request(request))
+
+    def test_host_of_each_request(self):
+        field = self.assertSameAsReverse(Request(APIRequestFactory().get('/books/', HTTP_HOST='testserver:8000')))
+        serializer = HyperlinkSerializer(context={'request': Request(APIRequestFactory().get('/books/'))})
+        field.parent = serializer
+        self.assertSameAsReverse(serializer.context['request'], field)
+
+
+@override_settings(ADMIN_SECRET_KEY='admin', PROFILE_SAMPLE_RATE=0)
+class ProfilerMiddlewareTests(SimpleTestCase):
+
+    def setUp(self):
+        self.factory = RequestFactory()
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+        settings_override = override_settings(PROFILE_DIR=self.directory)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.middleware = ProfilerMiddleware(lambda request: HttpResponse('ok'))
+
+    def get_response(self, **headers):
+        request = self.factory.get('/books/', HTTP_PROFILE='true', **headers)
+        return self.middleware(request)
+
+    def assertNotProfiled(self, response):
+        self.assertEqual(response.content, b'ok')
+        self.assertNotIn('Profile-Summary', response)
+        self.assertNotIn('Profile-File', response)
+        self.assertEqual(os.listdir(self.directory), [])
+
+    @override_settings(ADMIN_SECRET_KEY=None)
+    def test_disabled(self):
+        with self.assertRaises(MiddlewareNotUsed):
+            ProfilerMiddleware(lambda request: HttpResponse('ok'))
+
+    @override_settings(ADMIN_SECRET_KEY=None, PROFILE_SAMPLE_RATE=0.1)
+    def test_enabled_by_sampling(self):
+        ProfilerMiddleware(lambda request: HttpResponse('ok'))
+
+    def test_not_admin(self):
+        with mock.patch.object(profiling, 'start') as start:
+            self.assertNotProfiled(self.get_response())
+            self.assertNotProfiled(self.get_response(HTTP_ADMIN_KEY=sha256(b'other').hexdigest()))
+            self.assertNotProfiled(self.get_response(HTTP_ADMIN_KEY='admin'))
+        start.assert_not_called()
+
+    def test_admin(self):
+        response = self.get_response(HTTP_ADMIN_KEY=sha256(b'admin').hexdigest())
+        if 'Profile-Summary' not in response:
+            self.skipTest("another profiler is active")
+        self.assertEqual(response.content, b'ok')
+        self.assertEqual(os.listdir(self.directory), [response['Profile-File']])
+
+    def test_sampled(self):
+        with mock.patch.object(profiling, 'is_sampled', return_value=True):
+            response = self.get_response()
+        self.assertEqual(response.content, b'ok')
+        self.assertNotIn('Profile-Summary', response)
+        self.assertNotIn('Profile-File', response)
+        self.assertLessEqual(len(os.listdir(self.directory)), 1)
@@ -3,15 +3,78 @@ Extended generic view classes from django rest framework.
 `is_deleted` and `edited_time` are required fields for any model that involves these view classes.
 """
 
+import base64
+import binascii
+import time
+from datetime import datetime, timedelta
+from hashlib import sha1
 from rest_framework import generics
 from rest_framework import status
+from rest_framework.exceptions import ParseError
 from rest_framework.response import Response
+from rest_framework.views import APIView
+from django.conf import settings
 from django.core.exceptions import FieldDoesNotExist
+from django.db.models import Q
 from django.http import Http404
 from django.utils import timezone
+from django.utils.cache import get_conditional_response
+from django.utils.dateparse import parse_datetime
+from django.utils.http import http_date, quote_etag
+from core import slowquery
+from core.permissions import IsAdmin
 
 
-class ListCreateView(generics.ListCreateAPIView):
+class ConditionalRequestMixin:
+    """
+    ETag and Last-Modified derived from `edited_time`, so that conditional
+    requests are answered without serialization.
+    `edited_time` of a resource is also bumped by changes of its comments.
+    """
+
+    def get_validators(self, instance):
+        """ return etag and last modified timestamp of an instance """
+        check_edited_time_field(instance._meta.model)
+        raw = f"{instance._meta.label}:{instance.pk}:{instance.edited_time.isoformat()}"
+        return quote_etag(sha1(raw.encode()).hexdigest()), int(instance.edited_time.timestamp())
+
+    def get_list_validators(self, model, objects, count):
+        """
+        return etag of a page of a list, from pk and `edited_time` of the objects on it
+        and the total count, so no query is needed besides the page.
+        Lists have no last modified timestamp, as an object leaving the list doesn't
+        make the page any newer.
+        """
+        check_edited_time_field(model)
+        raw = "{}:{}:{}:{}".format(
+            model._meta.label,
+            self.request.get_full_path(),
+            count,
+            ','.join(f"{instance.pk}@{instance.edited_time.isoformat()}" for instance in objects),
+        )
+        return quote_etag(sha1(raw.encode()).hexdigest()), None
+
+    def evaluate_preconditions(self, request, etag, last_modified):
+        """
+        Return 304 or 412 response according to conditional headers,
+        or None if the request should be processed.
+        `Last-Modified` is in seconds, so `If-Modified-Since` is ignored when
+        `If-None-Match` is sent, or when the last modification is too recent
+        to rule out another one within the same second.
+        """
+        if request.method in ('GET', 'HEAD') and last_modified is not None and (
+            request.META.get('HTTP_IF_NONE_MATCH') or time.time() - last_modified < 2
+        ):
+            request_last_modified = None
+        else:
+            request_last_modified = last_modified
+        response = get_conditional_response(request, etag=etag, last_modified=request_last_modified)
+        if response is not None:
+            set_validator_headers(response, etag, last_modified)
+        return response
+
+
+class ListCreateView(ConditionalRequestMixin, generics.ListCreateAPIView):
     """
     Filter out instances with field is_deleted=False while retrieving instance list.
     """
@@ -22,11 +85,22 @@ class ListCreateView(generics.ListCreateAPIView):
 
         page = self.paginate_queryset(queryset)
         if page is not None:
-            serializer = self.get_serializer(page, many=True)
-            return self.get_paginated_response(serializer.data)
+            objects, count = page, self.paginator.page.paginator.count
+        else:
+            objects = list(queryset)
+            count = len(objects)
+        etag, last_modified = self.get_list_validators(queryset.model, objects, count)
+        not_modified = self.evaluate_preconditions(request, etag, last_modified)
+        if not_modified is not None:
+            return not_modified
 
-        serializer = self.get_serializer(queryset, many=True)
-        return Response(serializer.data)
+        serializer = self.get_serializer(objects, many=True)
+        if page is not None:
+            response = self.get_paginated_response(serializer.data)
+        else:
+            response = Response(serializer.data)
+        set_validator_headers(response, etag, last_modified)
+        return response
 
     def create(self, request, *args, **kwargs):
         serializer = self.get_serializer(data=request.data)
@@ -37,17 +111,22 @@ class ListCreateView(generics.ListCreateAPIView):
         return Response(serializer.data, status=status.HTTP_201_CREATED, headers=headers)
 
 
-class RetrieveUpdateDestroyView(generics.RetrieveUpdateDestroyAPIView):
+class RetrieveUpdateDestroyView(ConditionalRequestMixin, generics.RetrieveUpdateDestroyAPIView):
     """
     Filter out instances with field `is_deleted=False` while retrieving.
     `Delete` will set is_deleted=Flase instead of directly removing the record from database.
     If deleting from database is desired, add parameter `hard=true` in the request json body.
 
-    UPDATE and PATCH will always update edited_time.
+    UPDATE and PATCH update edited_time when anything is changed,
+    only changed columns are written, see `common.models.DirtyFieldsModel`.
+    GET supports `If-None-Match` and `If-Modified-Since`, writes support `If-Match`.
     """
     def destroy(self, request, *args, **kwargs):
         instance = self.get_object()
         check_is_deleted_field(instance._meta.model)
+        precondition_failed = self.evaluate_preconditions(request, *self.get_validators(instance))
+        if precondition_failed is not None:
+            return precondition_failed
         # transfer all data keys into lowercase
         cleaned_params = dict((k.lower(), v) for k, v in request.query_params.items())
         if cleaned_params.get('hard') == 'false':
@@ -72,18 +151,28 @@ class RetrieveUpdateDestroyView(generics.RetrieveUpdateDestroyAPIView):
     def retrieve(self, request, *args, **kwargs):
         instance = self.get_object()
         check_is_deleted_field(instance._meta.model)
-        if instance is not None and not instance.is_deleted:
-            serializer = self.get_serializer(instance)
-        else:
+        if instance is None or instance.is_deleted:
             raise Http404
-        return Response(serializer.data)
+
+        etag, last_modified = self.get_validators(instance)
+        not_modified = self.evaluate_preconditions(request, etag, last_modified)
+        if not_modified is not None:
+            return not_modified
+
+        serializer = self.get_serializer(instance)
+        response = Response(serializer.data)
+        set_validator_headers(response, etag, last_modified)
+        return response
 
     def update(self, request, *args, **kwargs):
         partial = kwargs.pop('partial', False)
         instance = self.get_object()
 
+        precondition_failed = self.evaluate_preconditions(request, *self.get_validators(instance))
+        if precondition_failed is not None:
+            return precondition_failed
+
         check_edited_time_field(instance._meta.model)
-        instance.edited_time = timezone.now()
 
         serializer = self.get_serializer(instance, data=request.data, partial=partial)
         serializer.is_valid(raise_exception=True)
@@ -94,7 +183,112 @@ class RetrieveUpdateDestroyView(generics.RetrieveUpdateDestroyAPIView):
             # forcibly invalidate the prefetch cache on the instance.
             instance._prefetched_objects_cache = {}
 
-        return Response(serializer.data)
+        response = Response(serializer.data)
+        set_validator_headers(response, *self.get_validators(instance))
+        return response
+
+
+class ChangeFeedView(generics.GenericAPIView):
+    """
+    Incremental change feed in stable (`edited_time`, `id`) order.
+    Pass `next` of the previous response as `since` to get what changed after it,
+    `since` also accepts an ISO 8601 time or an unix timestamp.
+    Deleted instances are returned as tombstones without data; records removed
+    with `hard=true` can't be reported.
+
+    Rows edited in the last `CHANGE_FEED_SETTLE_SECONDS` are held back, so that
+    transactions committing out of `edited_time` order are not skipped.
+    """
+    default_limit = 100
+    max_limit = 1000
+
+    def get(self, request, *args, **kwargs):
+        queryset = self.get_queryset()
+        check_is_deleted_field(queryset.model)
+        check_edited_time_field(queryset.model)
+        cleaned_params = dict((k.lower(), v) for k, v in request.query_params.items())
+
+        since = cleaned_params.get('since')
+        if since:
+            edited_time, pk = parse_cursor(since)
+            queryset = queryset.filter(Q(edited_time__gt=edited_time) | Q(edited_time=edited_time, pk__gt=pk))
+        settle = timedelta(seconds=getattr(settings, 'CHANGE_FEED_SETTLE_SECONDS', 5))
+        queryset = queryset.filter(edited_time__lte=timezone.now() - settle).order_by('edited_time', 'pk')
+
+        try:
+            limit = int(cleaned_params.get('limit', self.default_limit))
+        except ValueError:
+            raise ParseError({'detail': "`limit` must be an integer."})
+        if limit < 1:
+            raise ParseError({'detail': "`limit` must be positive."})
+        limit = min(limit, self.max_limit)
+        instances = list(queryset[:limit + 1])
+        has_more = len(instances) > limit
+        instances = instances[:limit]
+
+        results = []
+        for instance in instances:
+            change = {
+                'id': instance.pk,
+                'deleted': bool(instance.is_deleted),
+                'edited_time': instance.edited_time,
+            }
+            if not instance.is_deleted:
+                change['data'] = self.get_serializer(instance).data
+            results.append(change)
+
+        if instances:
+            next_cursor = make_cursor(instances[-1].edited_time, instances[-1].pk)
+        else:
+            next_cursor = since
+        return Response({'next': next_cursor, 'has_more': has_more, 'results': results})
+
+
+class SlowQueryList(APIView):
+    """
+    Recent slow queries recorded by the process serving the request, newest first.
+    Admin only.
+    """
+    permission_classes = [IsAdmin]
+
+    def get(self, request, *args, **kwargs):
+        return Response({'results': slowquery.get_recent()})
+
+
+def make_cursor(edited_time, pk):
+    raw = f"{edited_time.isoformat()}|{pk}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def parse_cursor(value):
+    """
+    Return (edited_time, pk) from a cursor, an ISO 8601 time or an unix timestamp.
+    """
+    try:
+        raw = base64.urlsafe_b64decode(value.encode()).decode()
+        edited_time, pk = raw.split('|')
+        edited_time = parse_datetime(edited_time)
+        if edited_time is not None:
+            return edited_time, int(pk)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        pass
+
+    try:
+        edited_time = parse_datetime(value)
+        if edited_time is None:
+            edited_time = datetime.fromtimestamp(float(value), tz=timezone.utc)
+    except (ValueError, OverflowError, OSError):
+        raise ParseError({'detail': "`since` must be a cursor, an ISO 8601 time or an unix timestamp."})
+    if timezone.is_naive(edited_time):
+        edited_time = timezone.make_aware(edited_time)
+    # pk 0 includes the instances edited at exactly `since`
+    return edited_time, 0
+
+
+def set_validator_headers(response, etag, last_modified):
+    response['ETag'] = etag
+    if last_modified is not None:
+        response['Last-Modified'] = http_date(last_modified)
 
 
 def check_is_deleted_field(model):